@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Benchmarks, run on the real DBs in databases/.
+    ./benchmark.py db [dbname ...]
+        For each storage backend which has a copy of the DBs (see migrate_db.py),
+        time a cold load of each whole DB and a cold fetch of a single item.
+        Also times opening and fetching from .snap snapshots, where up to date.
+    ./benchmark.py memory [dbname ...]
+        Use tracemalloc to measure the memory used by each loaded DB, compared
+        to the same data stored in plain __dict__ objects and lists of tuples
+        without shared strings, as gamedb used before it used __slots__.
+    ./benchmark.py format [dbname ...]
+        Compare the time to save and load each DB, and its size, using
+        serializer.py and plain pickles (protocol 2, as previously used).
+    ./benchmark.py compression [dbname ...]
+        Save each DB uncompressed and with each codec in db_layer.CODECS (to a
+        temporary directory), and compare the file size, load time and peak
+        memory use while loading.
+    ./benchmark.py templates
+        Time rendering a page of the website's templates (see templates.py),
+        compared to reading and format()ing the template files for each page as
+        was done previously, with and without a large table built with +=.
+    ./benchmark.py gzip [path?query ...]
+        For each zlib level, the compression ratio and throughput of the website's
+        gzip compression (see website.compress_response) on pages rendered from
+        the DBs (default /games?pagesize=100000) and on the static files compressed by
+        staticgz.py. Also compares compressing a page in one go to compressing it
+        streamed in chunks, each flushed, as the web server does.
+"""
+
+import os
+import sys
+import pickle
+import random
+import zlib
+import tempfile
+import tracemalloc
+
+if __name__ == '__main__':
+    import ohrkpaths  # Setup sys.path
+
+from ohrk import db_layer, gamedb, ohrkpaths, serializer, templates, util
+
+
+def cold(func, *args):
+    "Time a call with an empty DB cache. Returns (seconds, result)."
+    db_layer._cache.clear()
+    start = util.timer()
+    ret = func(*args)
+    return util.timer() - start, ret
+
+def bench_db(db_names):
+    """Compare the storage backends"""
+    # Pick a random key from each dict DB, so every backend fetches the same item
+    keys = {}
+    for name in db_names:
+        for backend in db_layer.BACKENDS.values():
+            db = backend.mtime(name) is not None and backend.load(name)
+            if isinstance(db, dict) and db:
+                keys[name] = random.choice(list(db.keys()))
+                break
+
+    print("%-12s %-8s %12s %12s" % ("DB", "Backend", "Cold load", "Fetch item"))
+    for name in db_names:
+        for backend_name, backend in db_layer.BACKENDS.items():
+            if backend.mtime(name) is None:
+                continue
+            ohrkpaths.DB_BACKENDS[name] = backend_name
+            load_time, db = cold(db_layer.load, name)
+            item_time = float('nan')
+            if name in keys:
+                item_time, item = cold(db_layer.load_item, name, keys[name])
+                assert item is not None
+            print("%-12s %-8s %11.2fms %11.2fms" % (name, backend_name, 1000 * load_time, 1000 * item_time))
+        ohrkpaths.DB_BACKENDS.pop(name, None)
+
+        snapname = db_layer.snapshot_filename(name)
+        if db_layer.SnapshotDB.read_mtime(snapname) == db_layer.get_backend(name).mtime(name):
+            load_time, db = cold(db_layer.SnapshotDB, snapname)
+            item_time = float('nan')
+            if name in keys:
+                item_time, item = cold(db.get, keys[name])
+                assert item is not None
+            print("%-12s %-8s %11.2fms %11.2fms" % (name, 'snapshot', 1000 * load_time, 1000 * item_time))
+
+class Unslotted:
+    "Stand-in for a gamedb class before it used __slots__"
+
+def unslot(obj):
+    """Deep copy of obj with gamedb objects turned into __dict__ objects, FileLists
+    into lists of tuples, and all strs copied so none are shared."""
+    if isinstance(obj, str):
+        return (' ' + obj)[1:]
+    if isinstance(obj, dict):
+        return {unslot(k): unslot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, gamedb.FileList)):
+        return [unslot(x) for x in obj]
+    if isinstance(obj, gamedb.Slotted):
+        ret = Unslotted()
+        ret.__dict__ = unslot(obj.__getstate__())
+        return ret
+    return obj
+
+def traced(func, *args):
+    "Returns (bytes allocated by func that are still alive, result)"
+    tracemalloc.start()
+    try:
+        ret = func(*args)
+        return tracemalloc.get_traced_memory()[0], ret
+    finally:
+        tracemalloc.stop()
+
+def bench_memory(db_names):
+    """Memory used by loaded DBs"""
+    print("%-16s %12s %12s %8s" % ("DB", "Loaded", "Unslotted", "Saving"))
+    total = total_old = 0
+    for name in db_names:
+        # Load once first so that modules imported by unpickling (numpy) aren't counted
+        db_layer.load(name)
+        db_layer._cache.clear()
+        size, db = traced(db_layer.load, name)
+        db_layer._cache.clear()
+        old_size, old_db = traced(unslot, db)
+        total += size
+        total_old += old_size
+        print("%-16s %11.1fK %11.1fK %7.1f%%" % (name, size / 1024, old_size / 1024, 100 - 100 * size / max(1, old_size)))
+        del db, old_db
+    print("%-16s %11.1fK %11.1fK %7.1f%%" % ("Total", total / 1024, total_old / 1024, 100 - 100 * total / max(1, total_old)))
+
+def best_time(func, *args, repeats = 3):
+    "Returns (fastest of several calls in seconds, result)"
+    times = []
+    for i in range(repeats):
+        start = util.timer()
+        ret = func(*args)
+        times.append(util.timer() - start)
+    return min(times), ret
+
+def bench_format(db_names):
+    """Compare serializer.py to pickle protocol 2"""
+    formats = [('pickle2', lambda db: pickle.dumps(db, 2), pickle.loads),
+               ('serializer', serializer.dumps, lambda data: serializer.loads(bytearray(data)))]
+    print("%-16s %-10s %10s %10s %10s" % ("DB", "Format", "Size", "Save", "Load"))
+    totals = {}
+    for name in db_names:
+        db = db_layer.load(name)
+        if db is None:
+            continue
+        if isinstance(db, db_layer.SnapshotDB):
+            db = dict(db.items())
+        for fmt, dumps, loads in formats:
+            save_time, data = best_time(dumps, db)
+            load_time, _ = best_time(loads, data)
+            total = totals.setdefault(fmt, [0, 0., 0.])
+            total[0] += len(data)
+            total[1] += save_time
+            total[2] += load_time
+            print("%-16s %-10s %9.1fK %8.2fms %8.2fms" % (name, fmt, len(data) / 1024, 1000 * save_time, 1000 * load_time))
+    for fmt, (size, save_time, load_time) in totals.items():
+        print("%-16s %-10s %9.1fK %8.2fms %8.2fms" % ("Total", fmt, size / 1024, 1000 * save_time, 1000 * load_time))
+
+def peak_traced(func, *args):
+    "Returns (peak bytes allocated during func, result)"
+    tracemalloc.start()
+    try:
+        ret = func(*args)
+        return tracemalloc.get_traced_memory()[1], ret
+    finally:
+        tracemalloc.stop()
+
+def bench_compression(db_names):
+    """Compare the compression options of the pickle backend"""
+    backend = db_layer.BACKENDS['pickle']
+    print("%-16s %-6s %10s %10s %10s %10s" % ("DB", "Codec", "Size", "Save", "Load", "Peak mem"))
+    totals = {}
+    dbs = {name: db_layer.load(name) for name in db_names}
+    # Load once first so that modules imported by unpickling (numpy) aren't counted
+    backend.load(db_names[0])
+    with tempfile.TemporaryDirectory() as tempdir:
+        db_dir = db_layer.DB_DIR
+        db_layer.DB_DIR = tempdir
+        try:
+            for name, db in dbs.items():
+                if db is None:
+                    continue
+                if isinstance(db, db_layer.SnapshotDB):
+                    db = dict(db.items())
+                for codec in db_layer.CODECS:
+                    ohrkpaths.DB_COMPRESSIONS[name] = codec
+                    save_time, _ = best_time(backend.save, name, db, repeats = 1)
+                    size = os.stat(backend.filename(name)).st_size
+                    load_time, _ = best_time(backend.load, name)
+                    peak, _ = peak_traced(backend.load, name)
+                    total = totals.setdefault(codec, [0, 0., 0., 0])
+                    total[0] += size
+                    total[1] += save_time
+                    total[2] += load_time
+                    total[3] = max(total[3], peak)
+                    print("%-16s %-6s %9.1fK %8.2fms %8.2fms %9.1fK" % (
+                        name, codec or 'none', size / 1024, 1000 * save_time, 1000 * load_time, peak / 1024))
+                ohrkpaths.DB_COMPRESSIONS.pop(name)
+        finally:
+            db_layer.DB_DIR = db_dir
+    print("(Total peak mem is the largest)")
+    for codec, (size, save_time, load_time, peak) in totals.items():
+        print("%-16s %-6s %9.1fK %8.2fms %8.2fms %9.1fK" % (
+            "Total", codec or 'none', size / 1024, 1000 * save_time, 1000 * load_time, peak / 1024))
+
+def bench_templates(rows = 2000, repeats = 200):
+    """Compare templates.py to reading and format()ting the templates for each page"""
+    page_fname = ohrkpaths.STATIC_ROOT + 'page_template.html'
+    content_fname = ohrkpaths.STATIC_ROOT + 'zipinfo.content.html'
+    fields = {'heading': 'game.zip', 'size': 1000, 'mtime': 'today', 'downloadable': '',
+              'sharing': '', 'note': '', 'note2': ''}
+    row = "<tr><td>%s</td><td>%s</td><td>%s</td></tr>\n"
+
+    def old_page(numrows):
+        table = ""
+        for idx in range(numrows):
+            table += row % ('file%d.txt' % idx, idx, 'today')
+        with open(content_fname, 'r') as temp:
+            content = temp.read().format(table = table, **fields)
+        page_template = util.read_text_file(page_fname)
+        return page_template.format(content = content, title = 'title', root = '/',
+                                    topnote = '', footer_info = 'footer')
+
+    def new_page(numrows):
+        table = [row % ('file%d.txt' % idx, idx, 'today') for idx in range(numrows)]
+        content = templates.get(content_fname).render_into([], dict(fields, table = table))
+        return ''.join(templates.get(page_fname).render_into([], {
+            'content': content, 'title': 'title', 'root': '/', 'topnote': '', 'footer_info': 'footer'}))
+
+    assert old_page(rows) == new_page(rows)
+    print("%-10s %8s %12s" % ("Method", "Rows", "Per page"))
+    for numrows in (0, rows):
+        for name, func in (('format', old_page), ('templates', new_page)):
+            total = best_time(lambda: [func(numrows) for i in range(repeats)])[0]
+            print("%-10s %8d %10.1fus" % (name, numrows, 1e6 * total / repeats))
+
+def render_url(url):
+    "Render a page of the website, returns bytes"
+    from ohrk import website
+    path, _, query = url.partition('?')
+    environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'wsgi.url_scheme': 'http',
+               'HTTP_HOST': 'localhost', 'wsgi.file_wrapper': lambda file: [file.read()]}
+    website.page_cache = None
+    # The web server runs in web/ (see local_server.py)
+    olddir = os.getcwd()
+    os.chdir(ohrkpaths.STATIC_ROOT)
+    try:
+        return b''.join(website.application(environ, lambda status, headers: None))
+    finally:
+        os.chdir(olddir)
+
+def bench_gzip(urls, repeats = 5):
+    """Compare zlib levels for compressing web pages and static files"""
+    from ohrk import staticgz, website
+    datas = [(url, render_url(url)) for url in urls or ['/games?pagesize=100000']]
+    for fname in sorted(os.listdir(ohrkpaths.STATIC_ROOT)):
+        fname = ohrkpaths.STATIC_ROOT + fname
+        if staticgz.compressible(fname) and os.path.isfile(fname):
+            with open(fname, 'rb') as infile:
+                datas.append((os.path.basename(fname), infile.read()))
+
+    def compress(data, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, website.ENCODING_WBITS['gzip'])
+        return compressor.compress(data) + compressor.flush()
+
+    def compress_streamed(data, level):
+        chunks = [data[idx : idx + website.STREAM_CHUNK_SIZE]
+                  for idx in range(0, len(data), website.STREAM_CHUNK_SIZE)]
+        website.GZIP_LEVEL = level
+        return b''.join(website.compress_stream(chunks, 'gzip'))
+
+    print("%-24s %-9s %5s %10s %10s %8s %10s" % ("Page", "Method", "Level", "Size", "Compressed", "Ratio", "Speed"))
+    for name, data in datas:
+        print("%-24s %-9s %5s %9.1fK" % (name[:24], 'none', '-', len(data) / 1024))
+        for level in (1, 3, 6, 9):
+            for method, func in (('oneshot', compress), ('streamed', compress_streamed)):
+                if method == 'streamed' and len(data) <= website.STREAM_CHUNK_SIZE:
+                    continue
+                seconds, compressed = best_time(func, data, level, repeats = repeats)
+                assert zlib.decompress(compressed, 31) == data
+                print("%-24s %-9s %5d %9.1fK %9.1fK %7.1f%% %7.1fMB/s" % (
+                    name[:24], method, level, len(data) / 1024, len(compressed) / 1024,
+                    100 * len(compressed) / len(data), len(data) / seconds / 2**20))
+
+def all_db_names():
+    names = set()
+    for backend in db_layer.BACKENDS.values():
+        names.update(backend.list_dbs())
+    return sorted(names)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('db', 'memory', 'format', 'compression', 'templates', 'gzip'):
+        sys.exit(__doc__)
+    if sys.argv[1] == 'templates':
+        bench_templates()
+        sys.exit()
+    if sys.argv[1] == 'gzip':
+        bench_gzip(sys.argv[2:])
+        sys.exit()
+    db_names = sys.argv[2:] or all_db_names()
+    if sys.argv[1] == 'db':
+        bench_db(db_names)
+    elif sys.argv[1] == 'memory':
+        bench_memory(db_names)
+    elif sys.argv[1] == 'format':
+        bench_format(db_names)
+    elif sys.argv[1] == 'compression':
+        bench_compression(db_names)
@@ -0,0 +1,176 @@
+"""
+A content-addressed store for files such as screenshots and the text files copied
+out of zips, so that identical copies (e.g. the same screenshot on several sites,
+or the same readme in every version of a game) are only stored once.
+
+Blobs are identified by a hash of their contents (their key), and are appended to
+a few large pack files in BLOB_DIR rather than each being a separate file.
+The 'blobs' DB maps each key to its location, and the set of references to it
+(strings like 'ss/123' naming the game or zip using it).
+Unreferenced blobs are only deleted by gc(), which also rewrites mostly-empty packs.
+
+A Screenshot.local_path refers to a blob as 'blob:<key><extension>', which
+ohrkpaths.local_path_to_url maps to the blobs/ URL. The text files of a zip
+(ScannedZipData.files) are BlobRefs instead of strs.
+"""
+
+import os
+import glob
+import hashlib
+
+from ohrk import db_layer, ohrkpaths, util
+
+DB_NAME = 'blobs'
+
+
+class Blob:
+    """Location of a blob in the pack files, and its references."""
+    __slots__ = ('pack', 'offset', 'size', 'refs')
+
+    def __init__(self, pack, offset, size):
+        self.pack = pack      # Pack file number
+        self.offset = offset
+        self.size = size
+        self.refs = set()     # Names of the games/zips using it
+
+class BlobRef:
+    """A reference to a blob containing utf-8 text, used in place of a str."""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __getstate__(self):
+        return self.key
+
+    def __setstate__(self, state):
+        self.key = state
+
+    def __repr__(self):
+        return 'BlobRef<%s>' % self.key
+
+def hash_key(data):
+    return hashlib.sha256(data).hexdigest()[:40]
+
+def pack_filename(pack):
+    return os.path.join(ohrkpaths.BLOB_DIR, 'pack-%04d.dat' % pack)
+
+def pack_numbers():
+    paths = glob.glob(os.path.join(ohrkpaths.BLOB_DIR, 'pack-[0-9][0-9][0-9][0-9].dat'))
+    return sorted(int(os.path.basename(path)[5:9]) for path in paths)
+
+_index = None  # The blobs DB when modifying it, otherwise load it with db_layer
+
+def _writable_index():
+    global _index
+    if _index is None:
+        _index = db_layer.load(DB_NAME)
+        if _index is None:
+            _index = {}
+        elif isinstance(_index, db_layer.SnapshotDB):
+            _index = dict(_index.items())
+    return _index
+
+def save():
+    "Save the blobs DB after put()"
+    if _index is not None:
+        db_layer.save(DB_NAME, _index)
+
+def _append(data, new_pack = False):
+    "Write data to the end of the last pack file (or a new one). Returns a Blob."
+    util.mkdir(ohrkpaths.BLOB_DIR)
+    packs = pack_numbers()
+    pack = packs[-1] if packs else 0
+    if packs and (new_pack or os.path.getsize(pack_filename(pack)) >= ohrkpaths.BLOB_PACK_SIZE):
+        pack += 1
+    with open(pack_filename(pack), 'ab') as fil:
+        offset = fil.tell()
+        fil.write(data)
+    return Blob(pack, offset, len(data))
+
+def put(data, ref):
+    """
+    Add a blob (bytes) to the store if it's not already present, and record that
+    ref refers to it. Returns its key. Call save() afterwards.
+    """
+    key = hash_key(data)
+    index = _writable_index()
+    blob = index.get(key)
+    if blob is None:
+        blob = index[key] = _append(data)
+    blob.refs.add(ref)
+    return key
+
+def put_file(path, ref):
+    """Add a file to the store. Returns a local_path for it: 'blob:<key><extension>'"""
+    with open(path, 'rb') as fil:
+        key = put(fil.read(), ref)
+    return 'blob:' + key + os.path.splitext(path)[1].lower()
+
+def put_text(text, ref):
+    "Add a str to the store. Returns a BlobRef."
+    return BlobRef(put(text.encode('utf-8'), ref))
+
+def store_texts(files, ref):
+    "Given a mapping from filenames to strs, return a dict with BlobRefs instead of strs."
+    return {fname: put_text(text, ref) if isinstance(text, str) else text
+            for fname, text in files.items()}
+
+def key_from_local_path(local_path):
+    "Return the key of the blob a local_path refers to, or None if it's not one."
+    if local_path and local_path.startswith('blob:'):
+        return os.path.splitext(local_path[5:])[0]
+
+def get(key):
+    "Return the contents of a blob, or None if it doesn't exist."
+    index = _index if _index is not None else db_layer.load(DB_NAME)
+    blob = index and index.get(key)
+    if blob is None:
+        return None
+    with open(pack_filename(blob.pack), 'rb') as fil:
+        fil.seek(blob.offset)
+        return fil.read(blob.size)
+
+def get_text(value):
+    "Given a str or BlobRef, return the str"
+    if isinstance(value, BlobRef):
+        data = get(value.key)
+        if data is None:
+            return "(Missing blob %s)" % value.key
+        return data.decode('utf-8')
+    return value
+
+def gc(references, repack_ratio = 0.5):
+    """
+    Delete unreferenced blobs and rewrite pack files which are less than repack_ratio
+    full of live blobs.
+    references: maps each key in use to the set of refs to it, found by scanning
+    all the DBs (see gamedb.blob_references). Replaces the recorded refs.
+    """
+    index = _writable_index()
+    for key in list(index):
+        refs = references.get(key)
+        if refs:
+            index[key].refs = set(refs)
+        else:
+            del index[key]
+    for key in set(references) - set(index):
+        print("!! Missing blob %s referenced by %s" % (key, ", ".join(sorted(references[key]))))
+
+    live = {pack: 0 for pack in pack_numbers()}
+    for blob in index.values():
+        live[blob.pack] = live.get(blob.pack, 0) + blob.size
+    repack = [pack for pack in live
+              if live[pack] < repack_ratio * os.path.getsize(pack_filename(pack))]
+    first = True
+    for key, blob in sorted(index.items(), key = lambda item: (item[1].pack, item[1].offset)):
+        if blob.pack in repack:
+            newblob = _append(get(key), new_pack = first)
+            newblob.refs = blob.refs
+            index[key] = newblob
+            first = False
+    # Save the updated locations before deleting the old packs
+    save()
+    for pack in repack:
+        os.remove(pack_filename(pack))
+    print("Blob store: %d blobs, %d packs rewritten" % (len(index), len(repack)))
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+A persistent log of the changes made to the gamelists and zips DBs, so that
+caches, indexes and exports can update just the games that changed.
+
+When a DB is saved by GameList.save(), save_games() or gamedb.save_zips(),
+the items are diffed against the previous save using content hashes (of each
+whole item, and of each field of items which changed). The hashes are
+kept in a '<dbname>.hashes' DB. An entry is then appended to the feed file
+(DB_DIR/changes.feed, JSON lines):
+    {"seq": 12, "time": 1600000000.0, "db": "ss", "gen": <db_layer.generation>,
+     "added": [srcid, ...], "removed": [...], "modified": {srcid: [field, ...]},
+     "reset": false}
+"reset" is true if the hashes were missing or out of date (the DB was saved
+without going through here), in which case all items are listed as added and
+consumers should assume everything changed.
+
+Consumers keep a cursor and call read(cursor) to get the entries since then.
+Run as a script to print the feed:
+    ./changefeed.py [after_seq]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import fcntl
+import pickle
+import hashlib
+
+if __name__ == '__main__':
+    import ohrkpaths  # Setup sys.path
+
+from ohrk import db_layer, util
+
+
+def feed_filename():
+    return db_layer.DB_DIR + '/changes.feed'
+
+def hashes_dbname(source_name):
+    return source_name + '.hashes'
+
+def content_hash(value):
+    "Hash of any picklable value"
+    data = io.BytesIO()
+    pickler = pickle.Pickler(data, 5)
+    # Don't use the memo, so the result doesn't depend on which objects are shared
+    pickler.fast = True
+    pickler.dump(value)
+    return hashlib.blake2b(data.getbuffer(), digest_size = 8).digest()
+
+def item_fields(item):
+    """
+    Returns a list of (name, value) for the attributes of a DB item (a gamedb.Slotted)
+    which are compared, including ColdFields, but not attributes in _derived.
+    """
+    cls = type(item)
+    cold_fields = getattr(cls, '_cold_fields', ())
+    skip = set('_' + name for name in cold_fields)
+    skip.add('_coldkey')
+    skip.update(getattr(cls, '_derived', ()))
+    ret = []
+    for name in cls._slot_names:
+        if name not in skip and hasattr(item, name):
+            ret.append((name, getattr(item, name)))
+    for name in cold_fields:
+        ret.append((name, getattr(item, name)))
+    return ret
+
+class Changes:
+    "The result of diff(), to pass to commit() after saving the DB"
+    def __init__(self, source_name, hashes, reset):
+        self.source_name = source_name
+        self.hashes = hashes      # The new contents of the hashes DB
+        self.reset = reset
+        self.added = []
+        self.removed = []
+        self.modified = {}        # key -> list of field names
+
+    def keys(self):
+        "All the keys of added, modified and removed items"
+        return self.added + list(self.modified) + self.removed
+
+    def __bool__(self):
+        return bool(self.reset or self.added or self.removed or self.modified)
+
+def diff(source_name, items, keys = None):
+    """
+    Compare a dict of items (Games or ScannedZipData) to the hashes from the last
+    save of the DB source_name. If keys is given, only compare those keys (the
+    rest are unchanged), and ones not in items have been removed.
+    Call before saving the DB. Returns a Changes.
+    """
+    saved = db_layer.load(hashes_dbname(source_name))
+    reset = False
+    if saved is None or saved['gen'] != db_layer.generation(source_name):
+        # Out of date; unless the DB doesn't exist yet, can't tell what changed
+        reset = db_layer.generation(source_name) is not None
+        saved = None
+        keys = None
+    old_hashes = saved['items'] if saved else {}
+    hashes = dict(old_hashes)
+    changes = Changes(source_name, hashes, reset)
+
+    if keys is None:
+        # In a stable order: that of items, then the removed ones
+        keys = list(items) + [key for key in old_hashes if key not in items]
+    for key in keys:
+        item = items.get(key)
+        old = old_hashes.get(key)
+        if item is None:
+            if old:
+                changes.removed.append(key)
+                del hashes[key]
+            continue
+        fields = item_fields(item)
+        item_hash = content_hash(fields)
+        if old and old[0] == item_hash:
+            continue
+        field_hashes = {name: content_hash(value) for name, value in fields}
+        hashes[key] = (item_hash, field_hashes)
+        if not old:
+            changes.added.append(key)
+        else:
+            old_fields = old[1]
+            changes.modified[key] = sorted(name for name in set(field_hashes) | set(old_fields)
+                                           if field_hashes.get(name) != old_fields.get(name))
+    return changes
+
+def commit(changes):
+    """
+    After saving the DB, save the new hashes and append the changes (if any) to the feed.
+    Returns the entry, or None.
+    """
+    gen = db_layer.generation(changes.source_name)
+    db_layer.save(hashes_dbname(changes.source_name), {'gen': gen, 'items': changes.hashes})
+    if not changes:
+        return None
+    entry = {'seq': None, 'time': time.time(), 'db': changes.source_name, 'gen': gen,
+             'added': changes.added, 'removed': changes.removed, 'modified': changes.modified,
+             'reset': changes.reset}
+    util.mkdir(db_layer.DB_DIR)
+    with open(feed_filename(), 'ab+') as feed:
+        # Lock so that concurrent writers get unique seq numbers
+        fcntl.flock(feed, fcntl.LOCK_EX)
+        entry['seq'] = _last_seq(feed) + 1
+        feed.write(json.dumps(entry).encode('utf-8') + b'\n')
+    return entry
+
+def _last_seq(feed):
+    "The seq of the last entry in an open feed file, or 0"
+    feed.seek(0, os.SEEK_END)
+    end = feed.tell()
+    if end == 0:
+        return 0
+    # Read backwards until the start of the last line is found
+    start = end
+    while start > 0:
+        start = max(0, start - 4096)
+        feed.seek(start)
+        chunk = feed.read(end - start)
+        lines = chunk.rstrip(b'\n').split(b'\n')
+        if len(lines) > 1 or start == 0:
+            return json.loads(lines[-1])['seq']
+    return 0
+
+class Cursor:
+    "A position in the feed: the last seq read, and the file offset after it."
+    def __init__(self, seq = 0, offset = 0):
+        self.seq = seq
+        self.offset = offset
+
+    def __repr__(self):
+        return 'Cursor<%d @%d>' % (self.seq, self.offset)
+
+def read(cursor = None):
+    """
+    Returns (entries, cursor): a list of the feed entries after cursor (or all of them),
+    and a new Cursor positioned after them. Entries can also be filtered by seq, so
+    a cursor can be rebuilt as Cursor(seq) if only the seq was stored.
+    """
+    cursor = cursor or Cursor()
+    entries = []
+    try:
+        feed = open(feed_filename(), 'rb')
+    except FileNotFoundError:
+        return entries, cursor
+    with feed:
+        fcntl.flock(feed, fcntl.LOCK_SH)
+        if cursor.offset > os.fstat(feed.fileno()).st_size:
+            cursor = Cursor(cursor.seq)  # The feed was replaced, rescan
+        feed.seek(cursor.offset)
+        seq, offset = cursor.seq, cursor.offset
+        while True:
+            line = feed.readline()
+            if not line.endswith(b'\n'):
+                break  # EOF, or partially written
+            offset += len(line)
+            entry = json.loads(line)
+            if entry['seq'] > seq:
+                entries.append(entry)
+                seq = entry['seq']
+    return entries, Cursor(seq, offset)
+
+if __name__ == '__main__':
+    after = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    entries, cursor = read(Cursor(after))
+    for entry in entries:
+        print(json.dumps(entry))
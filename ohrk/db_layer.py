@@ -2,16 +2,43 @@
 This module handles saving, loading, and caching of databases, which are
 pickle-able python objects of arbitrary types, not instances of a specific class.
 
-Should probably use a real DB, but for now they are just saved as .pickle files.
+How DBs are stored is up to a storage backend, selected by ohrkpaths.DB_BACKEND
+(or per-DB by ohrkpaths.DB_BACKENDS):
+ 'pickle': each DB is a single .pickle file, always loaded in full. Saved in full too,
+           unless ohrkpaths.DB_JOURNAL is set, in which case save_items() appends
+           to a journal instead. Can be compressed (.pickle.gz or .pickle.xz), see
+           ohrkpaths.DB_COMPRESSION.
+ 'sqlite': all DBs are in databases/ohrk.sqlite. DBs which are dicts with string keys
+           (gamelists, zips) are stored one row per item, so single items can be
+           loaded or saved without touching the rest.
+Use migrate_db.py to copy DBs between backends.
+
+Additionally, if ohrkpaths.DB_SNAPSHOTS is set then a read-only .snap file is written
+alongside each dict DB when it's saved, and web requests mmap that instead of loading
+the DB; see SnapshotDB.
+
+Normally load() checks whether a cached DB is out of date (once per request), but
+the web server can instead run a DBWatcher thread to reload changed DBs in the background.
 """
 
 
+import io
 import os
-import pickle
+import ctypes
+import glob
+import lzma
+import mmap
+import select
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections.abc import Mapping
 from dataclasses import dataclass
 from typing import Any
 
-from ohrk import util
+from ohrk import ohrkpaths, serializer, util
 
 
 DB_DIR = os.path.join(os.path.dirname(__file__), 'databases')
@@ -29,96 +56,786 @@ class CacheItem:
 class RequestContext:
     """A instance should be created when beginning a request, to hold
     request-specific caches, etc.
-    It is a global shared for all DB accesses until a new object is created."""
+    It is used for all DB accesses by the thread that created it until it creates a new
+    one (so website.warmup() can run in a background thread).
+    readonly: the DBs won't be modified, so can be loaded from snapshots."""
 
-    def __init__(self, cache = True):
+    def __init__(self, cache = True, readonly = False):
         # If a DB appears in the quickcache, then no check is made whether it needs to be reloaded:
         # it is only reloaded once per request.
         if cache:
             self.quickcache = {}
+        self.readonly = readonly
         # Otherwise exceptions on trying to access nonexistent quickcache are ignored
         # Time DB loads
         self.timer = util.Timer()
-        global _context
-        _context = self
+        # DB name -> generation of each DB read during the request (including ones
+        # which didn't exist), so that results derived from them can be cached
+        self.generations = {}
+        _thread_state.context = self
 
 
 # _cache holds loaded databases, cached between requests.
 _cache = {}
-_context = RequestContext(cache = False)  # Dummy value, until set by a real request
+_thread_state = threading.local()
+_default_context = RequestContext(cache = False)  # Dummy value, until set by a real request
+
+def _context():
+    "The current thread's RequestContext"
+    return getattr(_thread_state, 'context', _default_context)
+
+
+###############################################################################
+## Snapshots
+
+
+class SnapshotDB(Mapping):
+    """
+    A read-only dict DB backed by a mmapped .snap file. Items are unpickled straight
+    from the mapped buffer each time they're accessed rather than kept in memory,
+    so all processes share a single page-cache copy of the DB, and opening it
+    costs almost nothing.
+
+    File layout (all integers little-endian):
+      header:  HEADER
+      items:   each item pickled separately
+      keys:    the utf-8 encoded keys
+      entries: ENTRY for each item, in the original dict order
+      sorted:  u32 entry indices, ordered by key, for binary search
+    """
+    MAGIC = b'OHRKSNP1'
+    HEADER = struct.Struct('<8sIdQQ')   # magic, count, DB mtime, entries offset, sorted offset
+    ENTRY = struct.Struct('<QIQI')      # item offset, item length, key offset, key length
+    INDEX = struct.Struct('<I')
+
+    def __init__(self, fname):
+        with open(fname, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        self._buf = memoryview(self._mmap)
+        magic, self._count, self.mtime, self._entries, self._sorted = self.HEADER.unpack_from(self._buf)
+        if magic != self.MAGIC:
+            raise ValueError(fname + " isn't a DB snapshot")
+
+    @classmethod
+    def read_mtime(cls, fname):
+        "Returns the mtime of the DB from which a snapshot was written, or None if it doesn't exist."
+        try:
+            with open(fname, 'rb') as f:
+                magic, count, mtime, _, _ = cls.HEADER.unpack(f.read(cls.HEADER.size))
+                if magic == cls.MAGIC:
+                    return mtime
+        except (FileNotFoundError, struct.error):
+            return None
+
+    @classmethod
+    def write(cls, fname, db, mtime):
+        """Write a snapshot of a dict with str keys. Atomically replaces any existing file,
+        so processes which have the old one mapped aren't affected."""
+        entries = []
+        keys = []
+        tmpname = fname + '.tmp'
+        with open(tmpname, 'wb') as f:
+            f.write(bytes(cls.HEADER.size))
+            for key, item in db.items():
+                data = serializer.dumps(item)
+                entries.append([f.tell(), len(data)])
+                f.write(data)
+            for entry, key in zip(entries, db.keys()):
+                keyb = key.encode('utf-8')
+                entry += [f.tell(), len(keyb)]
+                keys.append(keyb)
+                f.write(keyb)
+            entries_offset = f.tell()
+            for entry in entries:
+                f.write(cls.ENTRY.pack(*entry))
+            sorted_offset = f.tell()
+            for idx in sorted(range(len(keys)), key = keys.__getitem__):
+                f.write(cls.INDEX.pack(idx))
+            f.seek(0)
+            f.write(cls.HEADER.pack(cls.MAGIC, len(entries), mtime, entries_offset, sorted_offset))
+        os.replace(tmpname, fname)
+
+    def _entry(self, idx):
+        return self.ENTRY.unpack_from(self._buf, self._entries + idx * self.ENTRY.size)
+
+    def _key(self, idx):
+        _, _, keyoff, keylen = self._entry(idx)
+        return bytes(self._buf[keyoff : keyoff + keylen])
+
+    def _value(self, idx):
+        off, length, _, _ = self._entry(idx)
+        return serializer.loads(self._buf[off : off + length])
+
+    def _find(self, key):
+        "Returns the entry index for a key, or None"
+        if not isinstance(key, str):
+            return None
+        keyb = key.encode('utf-8')
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            idx, = self.INDEX.unpack_from(self._buf, self._sorted + mid * self.INDEX.size)
+            midkey = self._key(idx)
+            if midkey == keyb:
+                return idx
+            if midkey < keyb:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def __getitem__(self, key):
+        idx = self._find(key)
+        if idx is None:
+            raise KeyError(key)
+        return self._value(idx)
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for idx in range(self._count):
+            yield self._key(idx).decode('utf-8')
+
+    # Faster than the Mapping defaults, which look up each key
+    def values(self):
+        for idx in range(self._count):
+            yield self._value(idx)
+
+    def items(self):
+        for idx in range(self._count):
+            yield self._key(idx).decode('utf-8'), self._value(idx)
+
+def snapshot_filename(source_name):
+    return DB_DIR + '/' + source_name + '.snap'
+
+def write_snapshot(source_name, db, mtime):
+    "Write a snapshot of a DB, if it's a dict with str keys."
+    if isinstance(db, dict) and all(isinstance(key, str) for key in db):
+        fname = snapshot_filename(source_name)
+        print("Writing " + fname)
+        SnapshotDB.write(fname, db, mtime)
+
+
+###############################################################################
+## Compression of .pickle files
+
+
+class Codec:
+    """A compression format for the pickle backend. compressor and decompressor
+    are functions returning new zlib/lzma-style (de)compression objects."""
+    def __init__(self, extension, compressor = None, decompressor = None):
+        self.extension = extension
+        self.compressor = compressor
+        self.decompressor = decompressor
+
+CODECS = {
+    None: Codec('.pickle'),
+    # Write gzip headers (wbits=31) so the downloadable DBs can be gunzipped
+    'zlib': Codec('.pickle.gz', lambda: zlib.compressobj(6, zlib.DEFLATED, 31), lambda: zlib.decompressobj(31)),
+    'lzma': Codec('.pickle.xz', lzma.LZMACompressor, lzma.LZMADecompressor),
+}
+
+# (De)compress this much at a time
+COMPRESS_CHUNK = 2**18
+
+def get_codec(source_name):
+    "Returns the Codec which the pickle backend saves a DB with"
+    return CODECS[ohrkpaths.DB_COMPRESSIONS.get(source_name, ohrkpaths.DB_COMPRESSION)]
+
+class DecompressStream(io.RawIOBase):
+    """
+    A readable file which decompresses another file. At most COMPRESS_CHUNK bytes are
+    decompressed per readinto() call, so reading a large block (as serializer.load
+    does) decompresses directly into the destination without a full size temporary copy.
+    Wrap in an io.BufferedReader before reading small pieces.
+    """
+    def __init__(self, fileobj, decompressor):
+        self.fileobj = fileobj
+        self.decompressor = decompressor
+        self.pending = b''  # Compressed input not yet passed to the decompressor
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        decomp = self.decompressor
+        size = min(len(buf), COMPRESS_CHUNK)
+        data = b''
+        while not data and not decomp.eof and size:
+            at_end = False
+            # (zlib objects have no needs_input, but return unconsumed input instead)
+            if not self.pending and getattr(decomp, 'needs_input', True):
+                self.pending = self.fileobj.read(COMPRESS_CHUNK)
+                at_end = not self.pending
+            data = decomp.decompress(self.pending, size)
+            self.pending = getattr(decomp, 'unconsumed_tail', b'')
+            if at_end and not data:
+                raise EOFError("Compressed data is truncated: " + getattr(self.fileobj, 'name', ''))
+        buf[:len(data)] = data
+        return len(data)
+
+def write_compressed(fileobj, data, codec):
+    "Write bytes-like data to a binary file, compressed with a Codec."
+    if not codec.compressor:
+        fileobj.write(data)
+        return
+    compressor = codec.compressor()
+    view = memoryview(data)
+    for offset in range(0, len(view), COMPRESS_CHUNK):
+        fileobj.write(compressor.compress(view[offset : offset + COMPRESS_CHUNK]))
+    fileobj.write(compressor.flush())
+
+
+###############################################################################
+## Storage backends
+
+
+class PickleBackend:
+    """
+    Each DB is a single .pickle file, or .pickle.gz/.pickle.xz if compressed
+    (see ohrkpaths.DB_COMPRESSION). When the compression setting changes, the
+    existing file is still loaded, and is replaced the next time the DB is saved.
+    If ohrkpaths.DB_JOURNAL is set, save_items() appends the changes to a .journal
+    file next to it instead of rewriting the whole DB, and load() replays the journal.
+    The journal is compacted (folded back into the .pickle) by save(), which happens
+    automatically when it grows past ohrkpaths.DB_JOURNAL_COMPACT_RATIO times the
+    size of the .pickle.
+    """
+    per_item = False  # Can't load/save individual items
+
+    def __init__(self):
+        self.truncated_journals = set()
+
+    def filename(self, source_name):
+        "The file the DB is saved to"
+        return DB_DIR + '/' + source_name + get_codec(source_name).extension
+
+    def _existing_file(self, source_name):
+        "Returns (filename, Codec) of the saved DB, or (None, None) if it doesn't exist."
+        codecs = [get_codec(source_name)] + list(CODECS.values())
+        for codec in codecs:
+            fname = DB_DIR + '/' + source_name + codec.extension
+            if os.path.isfile(fname):
+                return fname, codec
+        return None, None
+
+    def journal_filename(self, source_name):
+        return DB_DIR + '/' + source_name + '.journal'
+
+    def list_dbs(self):
+        names = set()
+        for codec in CODECS.values():
+            paths = glob.glob(DB_DIR + '/*' + codec.extension)
+            names.update(os.path.basename(path)[:-len(codec.extension)] for path in paths)
+        return sorted(names)
+
+    def mtime(self, source_name):
+        "Returns the time the DB was last saved, or None if it doesn't exist."
+        fname, codec = self._existing_file(source_name)
+        try:
+            mtime = os.stat(fname).st_mtime
+        except (FileNotFoundError, TypeError):
+            return None
+        try:
+            return max(mtime, os.stat(self.journal_filename(source_name)).st_mtime)
+        except FileNotFoundError:
+            return mtime
+
+    def load(self, source_name):
+        "Returns the DB, or None if it doesn't exist."
+        fname, codec = self._existing_file(source_name)
+        if fname:
+            with open(fname, 'rb') as dbfile:
+                print("Loading " + fname)
+                if codec.decompressor:
+                    dbfile = io.BufferedReader(DecompressStream(dbfile, codec.decompressor()))
+                # (Old DBs are plain pickles, see serializer.py)
+                # When loading a DB pickled by Python 2, str becomes bytes and is decoded to a (unicode) str.
+                # Could use encoding='latin-1' so that no error is thrown for
+                # strings which aren't UTF-8.
+                # Can't use encoding='bytes' because then all dict keys become bytes!!
+                db = serializer.load(dbfile)
+            self._replay_journal(source_name, db)
+            return db
+
+    def _replay_journal(self, source_name, db):
+        "Apply the changes in the journal, if any, to db."
+        try:
+            journal = open(self.journal_filename(source_name), 'rb')
+        except FileNotFoundError:
+            return
+        with journal:
+            size = os.fstat(journal.fileno()).st_size
+            while journal.tell() < size:
+                try:
+                    items, removed = serializer.load(journal)
+                except Exception:
+                    # The last entry was only partially written. Anything appended after
+                    # it would be lost, so the next save_items() has to compact instead.
+                    print("!! Ignoring truncated entry in " + journal.name)
+                    self.truncated_journals.add(source_name)
+                    break
+                db.update(items)
+                for key in removed:
+                    db.pop(key, None)
+
+    def save(self, source_name, db):
+        fname = self.filename(source_name)
+        print("Saving " + fname)
+        # Write to a temp file first, so the DB is never seen half-written
+        with open(fname + '.tmp', 'wb') as dbfile:
+            write_compressed(dbfile, serializer.dumps(db), get_codec(source_name))
+        os.replace(fname + '.tmp', fname)
+        # Remove any copy saved with a different compression setting
+        for codec in CODECS.values():
+            oldname = DB_DIR + '/' + source_name + codec.extension
+            if oldname != fname and os.path.isfile(oldname):
+                os.remove(oldname)
+        # Any changes in the journal are now in the .pickle
+        try:
+            os.remove(self.journal_filename(source_name))
+        except FileNotFoundError:
+            pass
+        self.truncated_journals.discard(source_name)
+
+    def save_items(self, source_name, db, items, removed):
+        "db is the whole DB, with items and removed already applied."
+        fname = self.filename(source_name)
+        if not ohrkpaths.DB_JOURNAL or not os.path.isfile(fname) or source_name in self.truncated_journals:
+            return self.save(source_name, db)
+        jname = self.journal_filename(source_name)
+        print("Appending %d changes to %s" % (len(items) + len(removed), jname))
+        with open(jname, 'ab') as journal:
+            serializer.dump((items, list(removed)), journal)
+            journal_size = journal.tell()
+        if journal_size > ohrkpaths.DB_JOURNAL_COMPACT_RATIO * os.stat(fname).st_size:
+            self.save(source_name, db)
+
+
+class SQLiteBackend:
+    """
+    All DBs are stored in a single SQLite file. The 'dbs' table has a row for each DB.
+    DBs which are dicts with str keys have a row in the 'items' table for each item,
+    with the name, author and mtime attributes of the item (if any) copied into
+    indexed columns. Other DBs are pickled whole into dbs.data.
+    """
+    per_item = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dbs (
+            name TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            per_item INTEGER NOT NULL,
+            data BLOB
+        );
+        CREATE TABLE IF NOT EXISTS items (
+            source TEXT NOT NULL,
+            key TEXT NOT NULL,
+            name TEXT COLLATE NOCASE,
+            author TEXT COLLATE NOCASE,
+            mtime REAL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (source, key)
+        );
+        CREATE INDEX IF NOT EXISTS items_name ON items (name);
+        CREATE INDEX IF NOT EXISTS items_author ON items (author);
+        CREATE INDEX IF NOT EXISTS items_mtime ON items (mtime);
+    """
+
+    def __init__(self):
+        # sqlite3 connections can't be shared between threads
+        self._local = threading.local()
+
+    def filename(self, source_name = None):
+        return DB_DIR + '/ohrk.sqlite'
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            util.mkdir(DB_DIR)
+            conn = sqlite3.connect(self.filename())
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _columns(item):
+        "The values of the indexed columns for a DB item"
+        name = getattr(item, 'name', None)
+        if callable(name):  # ScannedZipData.name()
+            name = name()
+        author = getattr(item, 'author', None)
+        mtime = getattr(item, 'mtime', None)
+        return (name if isinstance(name, str) else None,
+                author if isinstance(author, str) else None,
+                mtime if isinstance(mtime, (int, float)) else None)
+
+    def _rows(self, source_name, items):
+        for key, item in items.items():
+            yield (source_name, key) + self._columns(item) + (serializer.dumps(item),)
+
+    def _touch(self, conn, source_name, per_item, data = None):
+        "Create or update the row in 'dbs', giving it a new mtime"
+        row = conn.execute("SELECT mtime FROM dbs WHERE name = ?", (source_name,)).fetchone()
+        mtime = time.time()
+        if row and mtime <= row[0]:
+            # Must always change, as it's used to invalidate caches
+            mtime = row[0] + 0.001
+        conn.execute("INSERT OR REPLACE INTO dbs (name, mtime, per_item, data) VALUES (?, ?, ?, ?)",
+                     (source_name, mtime, per_item, data))
+
+    def list_dbs(self):
+        return [row[0] for row in self._connect().execute("SELECT name FROM dbs ORDER BY name")]
+
+    def mtime(self, source_name):
+        row = self._connect().execute("SELECT mtime FROM dbs WHERE name = ?", (source_name,)).fetchone()
+        return row and row[0]
+
+    def load(self, source_name):
+        conn = self._connect()
+        row = conn.execute("SELECT per_item, data FROM dbs WHERE name = ?", (source_name,)).fetchone()
+        if not row:
+            return None
+        print("Loading %s from %s" % (source_name, self.filename()))
+        per_item, data = row
+        if not per_item:
+            return serializer.loads(data)
+        # Preserve the original order of the dict
+        rows = conn.execute("SELECT key, data FROM items WHERE source = ? ORDER BY rowid", (source_name,))
+        return {key: serializer.loads(data) for key, data in rows}
+
+    def load_item(self, source_name, key):
+        row = self._connect().execute("SELECT data FROM items WHERE source = ? AND key = ?",
+                                      (source_name, key)).fetchone()
+        return row and serializer.loads(row[0])
+
+    def find_keys(self, source_name, **columns):
+        "Returns the keys of the items in a DB with the given (case-insensitive) name/author/mtime."
+        query = "SELECT key FROM items WHERE source = ?"
+        for column in columns:
+            assert column in ('name', 'author', 'mtime')
+            query += " AND %s = ?" % column
+        return [row[0] for row in self._connect().execute(query, (source_name,) + tuple(columns.values()))]
+
+    def save(self, source_name, db):
+        print("Saving %s to %s" % (source_name, self.filename()))
+        per_item = isinstance(db, dict) and all(isinstance(key, str) for key in db)
+        with self._connect() as conn:  # A transaction
+            conn.execute("DELETE FROM items WHERE source = ?", (source_name,))
+            if per_item:
+                conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?, ?)", self._rows(source_name, db))
+                self._touch(conn, source_name, True)
+            else:
+                self._touch(conn, source_name, False, serializer.dumps(db))
+
+    def save_items(self, source_name, db, items, removed):
+        "db is None if the DB isn't loaded, otherwise the whole DB with the changes applied."
+        row = self._connect().execute("SELECT per_item FROM dbs WHERE name = ?", (source_name,)).fetchone()
+        if not row or not row[0]:
+            # New DB, or not stored per-item
+            if db is None:
+                db = self.load(source_name) or {}
+                db.update(items)
+                for key in removed:
+                    db.pop(key, None)
+            return self.save(source_name, db)
+        with self._connect() as conn:
+            # An upsert rather than INSERT OR REPLACE so that existing items keep their rowid (order)
+            conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (source, key) DO UPDATE SET "
+                             "name = excluded.name, author = excluded.author, mtime = excluded.mtime, data = excluded.data",
+                             self._rows(source_name, items))
+            conn.executemany("DELETE FROM items WHERE source = ? AND key = ?", [(source_name, key) for key in removed])
+            self._touch(conn, source_name, True)
+
+
+BACKENDS = {
+    'pickle': PickleBackend(),
+    'sqlite': SQLiteBackend(),
+}
+
+def get_backend(source_name):
+    "Returns the storage backend for a DB"
+    return BACKENDS[ohrkpaths.DB_BACKENDS.get(source_name, ohrkpaths.DB_BACKEND)]
+
+
+###############################################################################
 
 
 def db_filename(source_name):
-    return DB_DIR + '/' + source_name + '.pickle'
+    return get_backend(source_name).filename(source_name)
+
+def exists(source_name):
+    return get_backend(source_name).mtime(source_name) is not None
 
-def _load(source_name):
+def _load(source_name, readonly = False):
     """
     Loads from saved database with the given name if already exists, otherwise returns None.
     Returns a CacheItem. Does not read or write the cache.
+    readonly: may load from a snapshot.
     """
-    fname = db_filename(source_name)
-    if os.path.isfile(fname):
-        with open(fname, 'rb') as dbfile:
-            print("Loading " + fname)
-            ret = CacheItem()
-            # When loading a DB pickled by Python 2, str becomes bytes and is decoded to a (unicode) str.
-            # Could use encoding='latin-1' so that no error is thrown for
-            # strings which aren't UTF-8.
-            # Can't use encoding='bytes' because then all dict keys become bytes!!
-            ret.db = pickle.load(dbfile)
-            ret.mtime = os.stat(fname).st_mtime
-            return ret
-
-def load(source_name):
+    backend = get_backend(source_name)
+    # Get the mtime first, so that if the DB gets modified while loading it will get reloaded
+    mtime = backend.mtime(source_name)
+    if mtime is not None:
+        ret = CacheItem()
+        ret.mtime = mtime
+        if readonly and ohrkpaths.DB_SNAPSHOTS:
+            snapname = snapshot_filename(source_name)
+            if SnapshotDB.read_mtime(snapname) == mtime:
+                print("Mapping " + snapname)
+                ret.db = SnapshotDB(snapname)
+                return ret
+        ret.db = backend.load(source_name)
+        return ret
+
+def _put_cache(source_name, db, mtime):
+    cacheitem = CacheItem()
+    cacheitem.db = db
+    cacheitem.mtime = mtime
+    _cache[source_name] = cacheitem
+    try:
+        _context().quickcache[source_name] = db
+    except:
+        pass
+
+def load(source_name, derived = False):
     """
     Loads (with caching) from saved database with the given name if already exists, otherwise returns None.
+    derived: the DB only contains data derived from other DBs, which the caller noted with
+    note_read(), so it isn't noted in RequestContext.generations itself.
     """
     try:
-        return _context.quickcache[source_name]
+        return _context().quickcache[source_name]
     except:
         pass
 
-    with _context.timer:
-
-        if source_name in _cache:
-            fname = db_filename(source_name)
+    with _context().timer:
+        # (Careful, the DBWatcher thread may replace or remove _cache items at any time)
+        cacheitem = _cache.get(source_name)
 
+        if cacheitem and not _watcher:
             # Check if the DB has changed since
-            if not os.path.isfile(fname):
-                del _cache[source_name]
+            mtime = get_backend(source_name).mtime(source_name)
+            if mtime is None:
+                _cache.pop(source_name, None)
+                if not derived:
+                    note_read(source_name, None)
                 return None
 
-            mtime = os.stat(fname).st_mtime
-            if mtime != _cache[source_name].mtime:
+            if mtime != cacheitem.mtime:
                 print("Dropped out-of-date cached DB")
-                del _cache[source_name]
+                cacheitem = None
 
-        if source_name not in _cache:
-            cacheitem = _load(source_name)
+        if not cacheitem:
+            cacheitem = _load(source_name, _context().readonly)
             if not cacheitem:
+                if not derived:
+                    note_read(source_name, None)
                 return None
             _cache[source_name] = cacheitem
-            try:
-                _context.quickcache[source_name] = cacheitem.db
-            except:
-                pass
-        return _cache[source_name].db
+        if not derived:
+            note_read(source_name, cacheitem.mtime)
+        try:
+            _context().quickcache[source_name] = cacheitem.db
+        except:
+            pass
+        return cacheitem.db
+
+def generation(source_name):
+    """
+    Returns a value which changes whenever the DB is modified (its mtime), or None
+    if it doesn't exist. If the DB is cached, that's the generation of the cached copy,
+    which is what load() returns within the current request.
+    """
+    cacheitem = _cache.get(source_name)
+    if cacheitem:
+        return cacheitem.mtime
+    return get_backend(source_name).mtime(source_name)
+
+def note_read(source_name, gen):
+    "Record in the RequestContext that a DB with a certain generation was read."
+    _context().generations[source_name] = gen
+
+def unchanged(generations):
+    """
+    Whether the DBs in a dict like RequestContext.generations still have those generations,
+    so that anything derived from them is still valid.
+    """
+    for source_name, gen in generations.items():
+        # Without the DBWatcher the cached generation isn't updated until the DB is loaded again
+        current = generation(source_name) if _watcher else get_backend(source_name).mtime(source_name)
+        if current != gen:
+            return False
+    return True
+
+def load_item(source_name, key):
+    """
+    Load a single item from a DB which is a dict, or return None if the DB or item doesn't exist.
+    Avoids loading the whole DB if it isn't already cached and the backend allows.
+    """
+    backend = get_backend(source_name)
+    if not backend.per_item or source_name in _cache:
+        db = load(source_name)
+        return db and db.get(key)
+    note_read(source_name, generation(source_name))
+    with _context().timer:
+        return backend.load_item(source_name, key)
+
+def find_keys(source_name, **columns):
+    """
+    Returns the keys of the items in a dict DB whose name, author and/or mtime
+    attributes equal the given values (compared case-insensitively for strings).
+    """
+    backend = get_backend(source_name)
+    if backend.per_item:
+        note_read(source_name, generation(source_name))
+        with _context().timer:
+            return backend.find_keys(source_name, **columns)
+    def matches(item):
+        for column, value in columns.items():
+            itemval = getattr(item, column, None)
+            if callable(itemval):
+                itemval = itemval()
+            if isinstance(value, str) and isinstance(itemval, str):
+                value, itemval = value.lower(), itemval.lower()
+            if itemval != value:
+                return False
+        return True
+    db = load(source_name) or {}
+    return [key for key, item in db.items() if matches(item)]
 
 def save(source_name, db):
     """
     Save to file, and place in the cache.
     """
-    with _context.timer:
+    with _context().timer:
         util.mkdir(DB_DIR)
-        fname = db_filename(source_name)
-        print("Saving " + fname)
-        with open(fname, 'wb') as dbfile:
-            pickle.dump(db, dbfile, 2)  # protocol 2 for python 2 compat
-        cacheitem = CacheItem()
-        cacheitem.db = db
-        cacheitem.mtime = os.stat(fname).st_mtime
-        _cache[source_name] = cacheitem
-        try:
-            _context.quickcache[source_name] = db
-        except:
-            pass
+        backend = get_backend(source_name)
+        backend.save(source_name, db)
+        mtime = backend.mtime(source_name)
+        if ohrkpaths.DB_SNAPSHOTS:
+            write_snapshot(source_name, db, mtime)
+        _put_cache(source_name, db, mtime)
+
+def save_items(source_name, items, removed = ()):
+    """
+    Update some items in a DB which is a dict: items is a dict of new/modified items,
+    removed is a list of keys to delete. Creates the DB if it doesn't exist.
+    Cheaper than save() if the backend supports it, in which case the DB isn't loaded
+    if it isn't already cached.
+    """
+    backend = get_backend(source_name)
+    db = None
+    if not backend.per_item or source_name in _cache:
+        db = load(source_name)
+        if db is None:
+            db = {}
+        elif isinstance(db, SnapshotDB):
+            db = dict(db.items())
+        db.update(items)
+        for key in removed:
+            db.pop(key, None)
+    with _context().timer:
+        util.mkdir(DB_DIR)
+        backend.save_items(source_name, db, items, removed)
+        mtime = backend.mtime(source_name)
+        if db is not None:
+            if ohrkpaths.DB_SNAPSHOTS:
+                write_snapshot(source_name, db, mtime)
+            _put_cache(source_name, db, mtime)
+        # Otherwise any snapshot is now out of date and will be ignored
+
+def compact(source_name):
+    """
+    Rewrite a DB in full. For the pickle backend this folds the journal into the .pickle.
+    """
+    db = load(source_name)
+    if isinstance(db, SnapshotDB):
+        db = dict(db.items())
+    if db is not None:
+        save(source_name, db)
+
+
+###############################################################################
+## Background reloading
+
+
+def _inotify_fd():
+    """Returns a nonblocking inotify file descriptor watching for files in DB_DIR
+    being written, or None if inotify isn't available (Linux only)."""
+    IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_DELETE = 0x2, 0x8, 0x80, 0x200
+    try:
+        libc = ctypes.CDLL(None, use_errno = True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+    if libc.inotify_add_watch(fd, DB_DIR.encode(), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+class DBWatcher(threading.Thread):
+    """
+    A thread which reloads cached DBs when they change on disk and then swaps the
+    new version into the cache, so that requests never wait for a reload: they
+    keep getting the previous version until the new one is completely loaded.
+    While it's running load() doesn't check whether cached DBs are up to date.
+    Checks every 'interval' seconds, or sooner if inotify says a file was written.
+    Meant for the web server only: reloaded DBs may be read-only snapshots.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name = 'DBWatcher', daemon = True)
+        self.interval = interval
+        self.inotify_fd = _inotify_fd()
+
+    def wait(self):
+        if self.inotify_fd is None:
+            time.sleep(self.interval)
+            return
+        ready, _, _ = select.select([self.inotify_fd], [], [], self.interval)
+        if ready:
+            # A file was written; give the writer a moment to finish
+            time.sleep(0.2)
+            try:
+                while os.read(self.inotify_fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def check(self):
+        "Reload any out-of-date DBs"
+        for source_name, cacheitem in list(_cache.items()):
+            try:
+                mtime = get_backend(source_name).mtime(source_name)
+                if mtime is None:
+                    _cache.pop(source_name, None)
+                elif mtime != cacheitem.mtime:
+                    print("DBWatcher: reloading " + source_name)
+                    newitem = _load(source_name, readonly = True)
+                    if newitem:
+                        _cache[source_name] = newitem
+            except Exception as e:
+                # Probably the DB is still being written. Keep the old version and retry later
+                print("DBWatcher: couldn't reload %s: %r" % (source_name, e))
+
+    def run(self):
+        while True:
+            self.wait()
+            self.check()
+
+_watcher = None
+
+def start_watcher(interval):
+    "Start the DBWatcher thread, if not already running."
+    global _watcher
+    if not _watcher:
+        _watcher = DBWatcher(interval)
+        _watcher.start()
@@ -1,5 +1,13 @@
 #!/bin/sh
 
+# Download zips and rpgs and their .cold side DBs (see gamedb.ColdField), which
+# may be .pickle, .pickle.gz or .pickle.xz files (see db_layer.CODECS). The
+# names which don't exist on the server just fail.
+URL=http://tmc.castleparadox.com/ohr/archive/databases
+
 cd databases
-wget http://tmc.castleparadox.com/ohr/archive/databases/zips.pickle -O zips.pickle
-wget http://tmc.castleparadox.com/ohr/archive/databases/rpgs.pickle -O rpgs.pickle
+for db in zips rpgs; do
+    for fname in $db.pickle $db.pickle.gz $db.pickle.xz $db.cold.pickle $db.cold.pickle.gz $db.cold.pickle.xz; do
+        wget -nv -N $URL/$fname
+    done
+done
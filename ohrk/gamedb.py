@@ -3,9 +3,11 @@ The Game and related classes.
 """
 
 import os
+import copy
 import shutil
+from array import array
 
-from ohrk import db_layer, ohrkpaths, scrape, util
+from ohrk import blobstore, changefeed, db_layer, history, indexes, ohrkpaths, scrape, util
 
 
 SOURCES = {
@@ -23,9 +25,133 @@ SOURCES = {
     # "steam",
 
 
-class Screenshot:
+class Slotted:
+    """
+    Base class for the objects stored in the DBs, which use __slots__ instead of a
+    __dict__ to save memory. They're pickled as a dict of attributes like a normal
+    object, so objects pickled before the class used __slots__ still load, and
+    attributes missing from old objects are set from _defaults.
+    """
+    __slots__ = ()
+    _defaults = {}   # Attribute -> default value, or function (e.g. list) to create it
+    _interned = ()   # Attributes (strs or lists of strs) to intern when loading, to share duplicates
+    # Schema version saved by serializer.py. When changing the meaning of attributes,
+    # increment it and add a function to _migrations to upgrade the state (a dict)
+    # from the previous version.
+    _version = 1
+    _migrations = {}  # version -> function(state) returning the state for version + 1
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._slot_names = tuple(name for klass in reversed(cls.__mro__)
+                                for name in klass.__dict__.get('__slots__', ()))
+
+    def _set_defaults(self):
+        for name, default in self._defaults.items():
+            setattr(self, name, default() if callable(default) else default)
+
+    def __getstate__(self):
+        state = {}
+        for name in self._slot_names:
+            try:
+                state[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        self._set_defaults()
+        for name, value in state.items():
+            if name in self._interned:
+                value = util.intern_strs(value)
+            try:
+                setattr(self, name, value)
+            except AttributeError:
+                print("!! Dropping unknown attribute %s.%s" % (type(self).__name__, name))
+        self._loaded()
+
+    def _loaded(self):
+        "Called after loading, to fix up data saved by old versions."
+        pass
+
+    def dumpinfo(self):
+        "For debugging"
+        return '%s<%r>' % (type(self).__name__, self.__getstate__())
+
+class ColdField:
+    """
+    Declares (as a class attribute) a bulky attribute which isn't needed for listing
+    or filtering, and so is saved in a side DB instead of in the main DB (see
+    split_cold_fields), and loaded from it only when accessed.
+    The value is stored in the attribute '_' + name, which must be in __slots__;
+    if it isn't set, it's loaded from the side DB.
+    """
+    def __init__(self, default):
+        self.default = default  # A value, or a function to create the default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.attr = '_' + name
+
+    def __get__(self, obj, objtype = None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.attr)
+        except AttributeError:
+            pass
+        coldkey = getattr(obj, '_coldkey', None)
+        if coldkey:
+            fields = db_layer.load_item(*coldkey)
+            if fields and self.name in fields:
+                return fields[self.name]
+        if callable(self.default):
+            return self.default()
+        return self.default
+
+    def __set__(self, obj, value):
+        setattr(obj, self.attr, value)
+
+    def __delete__(self, obj):
+        try:
+            delattr(obj, self.attr)
+        except AttributeError:
+            pass
+
+def cold_dbname(source_name):
+    "Name of the side DB holding the ColdFields of the items in a DB"
+    return source_name + '.cold'
+
+def split_cold_fields(source_name, items):
+    """
+    Given a dict of items (Games or ScannedZipData) returns (resident, cold) dicts:
+    shallow copies of the items without their ColdFields, which are instead
+    in the cold dict, under the same keys.
+    """
+    resident = {}
+    cold = {}
+    for key, item in items.items():
+        cold_fields = getattr(item, '_cold_fields', ())
+        if not cold_fields:
+            resident[key] = item
+            continue
+        # Read the fields first, in case they're already in the side DB.
+        values = {name: getattr(item, name) for name in cold_fields}
+        item = copy.copy(item)
+        if isinstance(item, Game):
+            item.short_description = util.strip_html(values['description'])[:SHORT_DESCRIPTION_LEN]
+        for name in cold_fields:
+            delattr(item, name)
+        item._coldkey = (cold_dbname(source_name), key)
+        resident[key] = item
+        cold[key] = values
+    return resident, cold
+
+
+class Screenshot(Slotted):
+    __slots__ = ('url', 'local_path', 'description', 'is_inline')
     # Defaults for existing objects
-    is_inline = False
+    _defaults = {'is_inline': False}
 
     def __init__(self, url, local_path, description = "", is_inline = False):
         self.url = url                 # URL for the original copy, if any
@@ -58,14 +184,13 @@ class Screenshot:
     def __repr__(self):
         return 'Screenshot<%s, %s>' % (self.local_path.split('/')[-1], self.description or "")
 
-    def dumpinfo(self):
-        "For debugging"
-        return 'Screenshot<' + repr(self.__dict__) + '>'
-
-class Review:
+class Review(Slotted):
     """
     A link to a review, retrospective, commentary, or preview elsewhere.
     """
+    __slots__ = ('url', 'author', 'byline', 'title', 'location', 'article_type', 'score', 'summary')
+    _interned = ('author',)
+
     def __init__(self, url, author = "", title = "", byline = '', article_type = "Review", score = "", summary = "", location = ""):
         self.url = url             # External URL
         self.author = author       # Author(s) of the article
@@ -79,14 +204,13 @@ class Review:
     def __repr__(self):
         return 'Review<%s of %s by %s>' % (self.article_type, self.title, self.author)
 
-    def dumpinfo(self):
-        "For debugging"
-        return 'Review<' + repr(self.__dict__) + '>'
-
-class DownloadLink:
+class DownloadLink(Slotted):
     """
     Info about a download link on a game entry. May point to an element of the 'zips' DB.
     """
+    __slots__ = ('listname', 'zipname', 'external', 'title', 'description', 'download_count', 'sizestr', 'mtime')
+    _interned = ('listname',)
+
     def __init__(self, listname, zipname, external, title = ""):
         self.listname = listname # The ID of the gamelist, eg 'ss'
         self.zipname = zipname   # The identifier of the zip, used as key and in URLs. Not the filename!
@@ -123,29 +247,44 @@ class DownloadLink:
     def __repr__(self):
         return 'Download<%s %s>' % (self.zipkey(), self.title)
 
-    def dumpinfo(self):
-        "For debugging"
-        return 'DownloadLink<' + repr(self.__dict__) + '>'
+# Length of Game.short_description
+SHORT_DESCRIPTION_LEN = 200
 
-class Game:
+class Game(Slotted):
     """
     A single entry
     """
 
-    # FIXME: Adding members to the class provides defaults for old serialised Game objects
-    # but can't initialise lists here; this is a mess...
-    extra_info = ""         # Info generated by the scraper or .rpg scanner. Raw text.
-    mtime = None            # Last modification time of the game/game entry. Might be creation time instead
-    size = None             # Game size in bytes
-    gen = None              # Contents of .gen lump (numpy.ndarray)
-    fixbits = None          # Contents of the fixbits.bin lump (numpy.ndarray)
-    website = None          # URL for an external website (often just author website)
-    blurb = None            # One-line description (itch.io only)
-    archives = None         # rpg files only: List of zipkeys (ids) of every zip file in which this game was found.
-    error = ""              # Any error message that occurred when processing the .rpg (errors extracting not included)
-    archinym = None
+    __slots__ = ('name', 'author', 'author_link', '_description', 'url', 'screenshots', 'downloads',
+                 'reviews', 'tags', 'archives', '_extra_info', 'short_description', 'mtime', 'size',
+                 'gen', 'fixbits', 'website', 'blurb', 'error', 'archinym', '_coldkey',
+                 # Only set by some scrapers
+                 'src', 'ctime', 'pubtime', 'download_count', 'rating')
+    _interned = ('author', 'tags')
+
+    # Saved in a side DB, see ColdField
+    _cold_fields = ('description', 'extra_info')
+    # Computed from other fields, so ignored by changefeed
+    _derived = ('short_description',)
+    description = ColdField("")
+    extra_info = ColdField("")  # Info generated by the scraper or .rpg scanner. Raw text.
+
+    # Set by __init__, and also the defaults for old serialised Game objects
+    _defaults = {
+        'short_description': None,  # Start of the description without HTML, set by split_cold_fields
+        'mtime': None,          # Last modification time of the game/game entry. Might be creation time instead
+        'size': None,           # Game size in bytes
+        'gen': None,            # Contents of .gen lump (numpy.ndarray)
+        'fixbits': None,        # Contents of the fixbits.bin lump (numpy.ndarray)
+        'website': None,        # URL for an external website (often just author website)
+        'blurb': None,          # One-line description (itch.io only)
+        'archives': None,       # rpg files only: List of zipkeys (ids) of every zip file in which this game was found.
+        'error': "",            # Any error message that occurred when processing the .rpg (errors extracting not included)
+        'archinym': None,
+    }
 
     def __init__(self):
+        self._set_defaults()
         self.name = ""
         self.author = ""
         self.author_link = ""        # External URL to the author's profile page, or otherwise mailto:email address
@@ -165,6 +304,12 @@ class Game:
     def get_author(self):
         return self.author or "(blank author)"
 
+    def get_short_description(self):
+        "Returns the description without HTML, possibly truncated to SHORT_DESCRIPTION_LEN chars"
+        if self.short_description is None:
+            return util.strip_html(self.description)
+        return self.short_description
+
     def create_datadir(self, dbname, srcid):
         datadir = 'data/%s/%s/' % (dbname, srcid)
         util.mkdir(datadir)
@@ -192,6 +337,21 @@ class Game:
                 filename = util.md5hash(url)[:7]
             else:
                 filename = url.split('/')[-1]
+
+        if ohrkpaths.BLOB_STORE:
+            try:
+                data = scrape.get_url(url)
+            except scrape.BadUrl:
+                print("!! Couldn't download " + url)
+                return False
+            key = blobstore.put(data, '%s/%s' % (dbname, srcid))
+            path = 'blob:' + key + os.path.splitext(filename)[1].lower()
+            screenshot = Screenshot(url, path, description, is_inline)
+            if verbose:
+                print(screenshot.dumpinfo())
+            self.screenshots.append(screenshot)
+            return True
+
         datadir = self.create_datadir(dbname, srcid)
 
 
@@ -225,11 +385,14 @@ class Game:
     def add_screenshot_file(self, dbname, srcid, path, description = ""):
         """
         Add a screenshot to this game, copying an existing file into the data/
-        dir for the game.
+        dir for the game, or the blob store.
         """
-        datadir = self.create_datadir(dbname, srcid)
-        filename = datadir + os.path.basename(path)
-        shutil.copy2(path, filename)   # copy stat info too
+        if ohrkpaths.BLOB_STORE:
+            filename = blobstore.put_file(path, '%s/%s' % (dbname, srcid))
+        else:
+            datadir = self.create_datadir(dbname, srcid)
+            filename = datadir + os.path.basename(path)
+            shutil.copy2(path, filename)   # copy stat info too
         screenshot = Screenshot('', filename, description, is_inline = False)
         self.screenshots.append(screenshot)
 
@@ -257,18 +420,133 @@ class GameList:
         ret.games = games
         return ret
 
+    @classmethod
+    def load_game(cls, source_name, srcid):
+        """Load a single Game, without loading the whole list if the DB backend supports that.
+        Returns None if it doesn't exist."""
+        return db_layer.load_item(source_name, srcid)
+
     def save(self):
         """
-        Save to file.
+        Save to file. The descriptions, etc, are saved to a separate DB.
+        The changes are recorded in the changefeed, and if the DB backend can save
+        individual games cheaply (or DB_JOURNAL is on) only the changed games are written.
         """
-        db_layer.save(self.name, self.games)
-        
-class ScannedZipData:
+        changes = changefeed.diff(self.name, self.games)
+        # Save new screenshots first
+        blobstore.save()
+        if not changes.reset and db_layer.exists(self.name) and (
+                ohrkpaths.DB_JOURNAL or db_layer.get_backend(self.name).per_item):
+            if changes:
+                self._save_items(changes.keys())
+        else:
+            resident, cold = split_cold_fields(self.name, self.games)
+            # Save the side DB first, so that it's never older than the main one
+            db_layer.save(cold_dbname(self.name), cold)
+            db_layer.save(self.name, resident)
+        indexes.refresh(self.name)
+        changefeed.commit(changes)
+        if ohrkpaths.DB_HISTORY:
+            history.record(changes, self.games)
+
+    def save_games(self, srcids):
+        """
+        Save just the games with the given srcids, which are deleted from the saved DB if
+        they're no longer in self.games. Rebuilding the indexes is put off until
+        indexes.rebuild_stale() (or the end of the process).
+        """
+        changes = changefeed.diff(self.name, self.games, srcids)
+        blobstore.save()
+        self._save_items(srcids)
+        indexes.invalidate(self.name)
+        changefeed.commit(changes)
+        if ohrkpaths.DB_HISTORY:
+            history.record(changes, self.games)
+
+    def _save_items(self, srcids):
+        changed = {srcid: self.games[srcid] for srcid in srcids if srcid in self.games}
+        removed = [srcid for srcid in srcids if srcid not in self.games]
+        resident, cold = split_cold_fields(self.name, changed)
+        db_layer.save_items(cold_dbname(self.name), cold, removed)
+        db_layer.save_items(self.name, resident, removed)
+
+def save_zips(zips_db):
+    """Save the 'zips' DB, a dict of ScannedZipData. The extracted files are saved to a separate DB,
+    or to the blob store if BLOB_STORE is enabled."""
+    if ohrkpaths.BLOB_STORE:
+        for zipkey, zipdata in zips_db.items():
+            if not zipdata.unreadable:
+                zipdata.files = blobstore.store_texts(zipdata.files, 'zips/' + zipkey)
+        blobstore.save()
+    changes = changefeed.diff('zips', zips_db)
+    resident, cold = split_cold_fields('zips', zips_db)
+    db_layer.save(cold_dbname('zips'), cold)
+    db_layer.save('zips', resident)
+    indexes.refresh('zips')
+    changefeed.commit(changes)
+
+def blob_references():
+    """
+    Scan the gamelists and zips for references to blobs, returning a dict mapping
+    each key to the set of refs to it, for blobstore.gc().
+    """
+    references = {}
+    for listname in SOURCES:
+        for srcid, game in (db_layer.load(listname) or {}).items():
+            for screenshot in game.screenshots:
+                key = blobstore.key_from_local_path(screenshot.local_path)
+                if key:
+                    references.setdefault(key, set()).add('%s/%s' % (listname, srcid))
+    for zipkey, zipdata in (db_layer.load('zips') or {}).items():
+        if not zipdata.unreadable:
+            for value in zipdata.files.values():
+                if isinstance(value, blobstore.BlobRef):
+                    references.setdefault(value.key, set()).add('zips/' + zipkey)
+    return references
+
+
+class FileList:
+    """
+    A compact list of (fname, size, mtime) tuples, stored as columns.
+    """
+    __slots__ = ('names', 'sizes', 'mtimes')
+
+    def __init__(self, files = ()):
+        self.names = []
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        for file in files:
+            self.append(file)
+
+    def append(self, file):
+        fname, size, mtime = file
+        self.names.append(fname)
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, idx):
+        return self.names[idx], self.sizes[idx], self.mtimes[idx]
+
+    def __iter__(self):
+        return zip(self.names, self.sizes, self.mtimes)
+
+class ScannedZipData(Slotted):
     """
     This class holds information about a zip file.
     It's a picklable repackaging of some of the information in rpgbatch.ArchiveInfo
     """
 
+    # rpgs, scripts, filelist and files are missing if unreadable
+    __slots__ = ('error', 'unreadable', 'filename', 'size', 'mtime', 'rpgs', 'scripts', 'filelist',
+                 '_files', '_coldkey')
+
+    # Saved in a side DB, see ColdField
+    _cold_fields = ('files',)
+    files = ColdField(dict)
+
     def __init__(self, zipinfo, filename):
         """zipinfo is an ArchiveInfo object"""
         self.error = zipinfo.error   # Any error message produced while trying to read, else ""
@@ -290,7 +568,7 @@ class ScannedZipData:
                 if hash:
                     self.rpgs[fname] = hash[:9]
             self.scripts = zipinfo.scripts
-            self.filelist = []  # (fname, size, mtime) tuples
+            self.filelist = FileList()  # (fname, size, mtime) tuples
             self.files = {}     # Extracted files; fname -> contents mapping
             for fname in zipinfo.zip.namelist():
                 size = zipinfo.file_size(fname)
@@ -305,10 +583,17 @@ class ScannedZipData:
                         if size < 15000 and '_debug' not in fname:
                             self.files[fname] = scrape.auto_decode(zipinfo.zip.read(fname))
 
+    def _loaded(self):
+        if isinstance(getattr(self, 'filelist', None), list):
+            self.filelist = FileList(self.filelist)
+
     def name(self):
         "For consistency with DownloadLink"
         return self.filename
 
+indexes.register_gamelist_indexes(SOURCES)
+
+
 class _GameIndex():
     """Dead code"""
     def __init__(self):
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+History of the games in each gamelist, so that edits and deletions on the
+original sites aren't lost when a gamelist is scraped again.
+
+If ohrkpaths.DB_HISTORY is set, each time a gamelist is saved the changes found
+by changefeed are recorded in the '<dbname>.history' DB, which maps each srcid
+to a GameHistory: a list of Versions. Most Versions only contain the fields which
+changed; every HISTORY_KEYFRAME_INTERVAL versions a keyframe with all fields is
+stored, so that reconstructing a version only needs to apply a few deltas.
+
+Run as a script to query it:
+    ./history.py game <dbname> <srcid>       Print all versions of a game
+    ./history.py at <dbname> <YYYY-MM-DD>    List the games in a gamelist at a date
+"""
+
+import sys
+import copy
+import time
+import bisect
+
+if __name__ == '__main__':
+    import ohrkpaths  # Setup sys.path
+
+from ohrk import changefeed, db_layer, ohrkpaths
+
+# Store all fields every this many versions
+HISTORY_KEYFRAME_INTERVAL = 10
+
+
+class Version:
+    """One version of a game, or its removal."""
+    def __init__(self, time, gen, keyframe, fields, unset = (), removed = False):
+        self.time = time          # When the gamelist was saved
+        self.gen = gen            # Generation of the DB (see db_layer.generation)
+        self.keyframe = keyframe  # If true, fields contains all the fields
+        self.fields = fields      # name -> value of the fields which changed
+        self.unset = unset        # Names of fields which no longer exist
+        self.removed = removed    # The game was deleted
+
+class GameHistory:
+    def __init__(self, cls):
+        self.cls = cls            # Game class
+        self.versions = []
+        self.times = []           # Version.time of each version, for bisecting
+
+    def add(self, version):
+        self.versions.append(version)
+        self.times.append(version.time)
+
+    def state(self, idx):
+        "Returns the fields of version idx (a dict), or None if that's a removal."
+        if self.versions[idx].removed:
+            return None
+        start = idx
+        while not self.versions[start].keyframe:
+            start -= 1
+        state = {}
+        for version in self.versions[start : idx + 1]:
+            state.update(version.fields)
+            for name in version.unset:
+                state.pop(name, None)
+        return state
+
+    def item(self, idx):
+        "Returns version idx as an object (e.g. a Game), or None if that's a removal."
+        state = self.state(idx)
+        if state is None:
+            return None
+        item = self.cls.__new__(self.cls)
+        item.__setstate__(copy.deepcopy(state))
+        return item
+
+    def index_at(self, when):
+        "Returns the index of the version current at a time, or None if there wasn't one."
+        idx = bisect.bisect_right(self.times, when) - 1
+        if idx >= 0:
+            return idx
+
+    def since_keyframe(self):
+        "Number of versions after the last keyframe"
+        for count, version in enumerate(reversed(self.versions)):
+            if version.keyframe:
+                return count
+        return len(self.versions)
+
+def history_dbname(source_name):
+    return source_name + '.history'
+
+def record(changes, items):
+    """
+    Add the changes from changefeed.diff() to the history. Call after saving the DB.
+    items: the dict of items that was saved.
+    """
+    now = time.time()
+    gen = db_layer.generation(changes.source_name)
+    dbname = history_dbname(changes.source_name)
+    histories = db_layer.load(dbname)
+    keys = changes.added + list(changes.modified)
+    if histories is None:
+        # Start with every item
+        histories = {}
+        keys = list(items)
+    updated = {}
+
+    def get_history(key):
+        hist = updated.get(key) or histories.get(key)
+        if hist is None:
+            hist = GameHistory(type(items[key]))
+        updated[key] = hist
+        return hist
+
+    for key in changes.removed:
+        if key in histories:
+            get_history(key).add(Version(now, gen, False, {}, removed = True))
+    for key in keys:
+        hist = get_history(key)
+        fields = dict(changefeed.item_fields(items[key]))
+        last = hist.state(len(hist.versions) - 1) if hist.versions else None
+        if last is None or hist.since_keyframe() + 1 >= HISTORY_KEYFRAME_INTERVAL:
+            version = Version(now, gen, True, fields)
+        else:
+            # Compare to the previous version, since changes.modified isn't known after a reset
+            changed = {name: value for name, value in fields.items()
+                       if name not in last or changefeed.content_hash(value) != changefeed.content_hash(last[name])}
+            if not changed and set(last) == set(fields):
+                continue
+            version = Version(now, gen, False, changed, unset = list(set(last) - set(fields)))
+        # Copy, so later modifications of the items don't change the history
+        version.fields = copy.deepcopy(version.fields)
+        hist.add(version)
+    db_layer.save_items(dbname, updated)
+
+def game_history(source_name, srcid):
+    """Returns the GameHistory of a game, or None."""
+    histories = db_layer.load(history_dbname(source_name)) or {}
+    return histories.get(srcid)
+
+def state_at(source_name, when):
+    """
+    Returns a dict of all the items in a gamelist at a time (in seconds since the epoch),
+    as recorded by the history.
+    """
+    ret = {}
+    for srcid, hist in (db_layer.load(history_dbname(source_name)) or {}).items():
+        idx = hist.index_at(when)
+        if idx is not None:
+            item = hist.item(idx)
+            if item is not None:
+                ret[srcid] = item
+    return ret
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['game'] and len(sys.argv) == 4:
+        hist = game_history(sys.argv[2], sys.argv[3])
+        if not hist:
+            sys.exit("No history")
+        for idx, version in enumerate(hist.versions):
+            kind = 'removed' if version.removed else 'keyframe' if version.keyframe else 'changed'
+            print("%s %s: %s" % (time.ctime(version.time), kind, ", ".join(sorted(version.fields))))
+            item = hist.item(idx)
+            if item is not None:
+                print("    " + item.dumpinfo())
+    elif sys.argv[1:2] == ['at'] and len(sys.argv) == 4:
+        when = time.mktime(time.strptime(sys.argv[3], '%Y-%m-%d'))
+        for srcid, item in sorted(state_at(sys.argv[2], when).items()):
+            print(srcid, item)
+    else:
+        sys.exit(__doc__)
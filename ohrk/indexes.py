@@ -0,0 +1,1036 @@
+"""
+Derived indexes: data computed from one or more DBs, such as lookup tables, which
+is saved as its own DB so that it doesn't have to be recomputed by every process.
+Each saved index records the generations (see db_layer.generation) of the DBs it
+was built from, and is rebuilt (in memory) if it's out of date when requested.
+Scripts that modify DBs call refresh() to rebuild and save the indexes, or, after
+saving just a few games (GameList.save_games), invalidate() to put that off until
+rebuild_stale() is called (at the latest when the process exits), so that a batch of
+small saves doesn't rebuild everything each time.
+"""
+
+import re
+import atexit
+import heapq
+import difflib
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+from ohrk import db_layer, inspect_rpg, util
+
+
+class Index:
+    """
+    Describes an index: its DB name, the DBs it depends on, and the function to
+    build its data, which is called as build(*deps).
+    If optional_deps, it's built even if some of the DBs don't exist, passing None for those.
+    If not load_deps, build() is called without arguments (e.g. when it's built from other
+    indexes instead) and the DBs are only used to tell whether it's out of date.
+    version: increase it when the data changes format, so saved copies are rebuilt.
+    """
+    def __init__(self, name, deps, build, optional_deps = False, load_deps = True, version = 0):
+        self.name = name
+        self.deps = tuple(deps)
+        self.build = build
+        self.optional_deps = optional_deps
+        self.load_deps = load_deps
+        self.version = version
+
+    def buildable(self, gens):
+        "Whether the DBs needed exist, given their generations"
+        if self.optional_deps:
+            return any(gen is not None for gen in gens)
+        return None not in gens
+
+    def generations(self):
+        return tuple(db_layer.generation(dep) for dep in self.deps)
+
+    def up_to_date(self, derived, gens):
+        "Whether a Derived (or None) was built by this version from DBs with these generations"
+        return derived is not None and derived.gens == gens and derived.version == self.version
+
+class Derived:
+    """The saved form of an index: its data, plus the generations of the DBs it was built from."""
+    version = 0  # Of the Index; not saved by older versions
+
+    def __init__(self, gens, data, version = 0):
+        self.gens = gens
+        self.data = data
+        self.version = version
+
+# All the indexes, by name
+INDEXES = {}
+
+# name -> Derived, the up-to-date indexes in memory
+_built = {}
+
+# Names of the indexes which invalidate() has put off rebuilding
+_stale = set()
+
+def register(name, deps, build, optional_deps = False, load_deps = True, version = 0):
+    INDEXES[name] = Index(name, deps, build, optional_deps, load_deps, version)
+
+def _build(index, gens):
+    print("Building index " + index.name)
+    if not index.load_deps:
+        return Derived(gens, index.build(), index.version)
+    return Derived(gens, index.build(*(db_layer.load(dep) for dep in index.deps)), index.version)
+
+def get(name, build = True):
+    """
+    Return the data of an index, loading or rebuilding it if needed. Returns None if
+    any of the DBs it depends on don't exist (or all, if they're optional).
+    If not build, returns None instead of building it (e.g. for expensive indexes
+    which web requests shouldn't build; see refresh() and website.warmup()).
+    """
+    index = INDEXES[name]
+    gens = index.generations()
+    for dep, gen in zip(index.deps, gens):
+        db_layer.note_read(dep, gen)
+    if not index.buildable(gens):
+        return None
+    derived = _built.get(name)
+    if not index.up_to_date(derived, gens):
+        derived = db_layer.load(name, derived = True)
+        if not index.up_to_date(derived, gens):
+            if not build:
+                return None
+            derived = _build(index, gens)
+        _built[name] = derived
+    return derived.data
+
+def refresh(source_name):
+    """
+    Rebuild and save the indexes of just a DB after it has been saved. Indexes which
+    also depend on other DBs (e.g. merged from all the gamelists) are only invalidate()d,
+    so that saving several DBs builds them once, in rebuild_stale().
+    """
+    others = []
+    for index in INDEXES.values():
+        if list(index.deps) == [source_name]:
+            _rebuild(index)
+        elif source_name in index.deps:
+            others.append(index.name)
+    _mark_stale(others)
+
+def _rebuild(index):
+    "Rebuild (unless get() already has) and save an index, if its DBs exist"
+    _stale.discard(index.name)
+    gens = index.generations()
+    if not index.buildable(gens):
+        return
+    derived = _built.get(index.name)
+    if not index.up_to_date(derived, gens):
+        derived = _build(index, gens)
+    db_layer.save(index.name, derived)
+    _built[index.name] = derived
+
+def invalidate(source_name):
+    """
+    Mark the indexes which depend on a DB as out of date, after it has been modified,
+    without rebuilding them. get() rebuilds them in memory if needed, and
+    rebuild_stale() saves them.
+    """
+    _mark_stale([index.name for index in INDEXES.values() if source_name in index.deps])
+
+def _mark_stale(names):
+    if names and not _stale:
+        atexit.register(rebuild_stale)
+    for name in names:
+        _stale.add(name)
+        _built.pop(name, None)
+
+def rebuild_stale():
+    "Rebuild and save the indexes marked by invalidate() or refresh()."
+    # In order of registration, so merged indexes come after the ones they're merged from
+    for index in list(INDEXES.values()):
+        if index.name in _stale:
+            _rebuild(index)
+    atexit.unregister(rebuild_stale)
+
+
+################################################################################
+## .gen and fixbits.bin data of all games in the rpgs DB
+
+class GenMatrix:
+    """
+    The .gen lumps of a set of games as the rows of a 2D int16 array, and fixbits.bin
+    lumps as rows of bits (a uint8 array of packed bits). Games which don't have a
+    .gen aren't included. Shorter lumps are padded with zeros.
+    """
+
+    def __init__(self, games):
+        "games: a dict of Games, such as the rpgs DB."
+        srcids = [srcid for srcid, game in games.items() if game.gen is not None]
+        # srcid -> row number
+        self.rows = {srcid: row for row, srcid in enumerate(srcids)}
+        gens = [games[srcid].gen for srcid in srcids]
+        fixbits = [self._fixbits_array(games[srcid].fixbits) for srcid in srcids]
+        self.gen = np.zeros((len(srcids), max(map(len, gens), default = 0)), np.int16)
+        for row, gen in enumerate(gens):
+            self.gen[row, :len(gen)] = gen
+        self.fixbits = np.zeros((len(srcids), max(map(len, fixbits), default = 0)), np.uint8)
+        for row, bits in enumerate(fixbits):
+            self.fixbits[row, :len(bits)] = bits
+
+    @staticmethod
+    def _fixbits_array(fixbits):
+        if fixbits is None:
+            return np.zeros(0, np.uint8)
+        return np.frombuffer(bytes(fixbits), np.uint8)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def row_indices(self, srcids):
+        "Returns an array of the row numbers for a list of srcids, -1 for games without a row."
+        return np.array([self.rows.get(srcid, -1) for srcid in srcids], np.intp)
+
+    def column(self, key, rows = None):
+        """
+        Returns the values of one of inspect_rpg.genLimits (e.g. 'maps') for all rows,
+        or for an array of row numbers, as int32s.
+        """
+        genidx, offset, name = inspect_rpg.genLimitsDict[key]
+        if genidx >= self.gen.shape[1]:
+            values = np.zeros(len(self.gen), np.int32)
+        else:
+            values = self.gen[:, genidx].astype(np.int32) + offset
+        if rows is not None:
+            values = values[rows]
+        return values
+
+    def fixbit(self, bitnum, rows = None):
+        "Returns a bool array of whether a fixbit is set, for all rows or an array of row numbers."
+        if bitnum // 8 >= self.fixbits.shape[1]:
+            bits = np.zeros(len(self.fixbits), bool)
+        else:
+            bits = (self.fixbits[:, bitnum // 8] >> (bitnum % 8)) & 1 == 1
+        if rows is not None:
+            bits = bits[rows]
+        return bits
+
+    def argsort(self, key, rows = None, reverse = False):
+        "Returns row numbers (or indices into rows) sorted by the value of a genLimits column."
+        values = self.column(key, rows)
+        return np.argsort(-values if reverse else values, kind = 'stable')
+
+    def stats(self, key, rows = None):
+        "Returns a dict with the min, max, mean and median of a genLimits column, or None if no rows."
+        values = self.column(key, rows)
+        if len(values) == 0:
+            return None
+        return {'min': int(values.min()), 'max': int(values.max()),
+                'mean': float(values.mean()), 'median': float(np.median(values))}
+
+def gen_index_name(source_name):
+    return source_name + '.gen'
+
+register(gen_index_name('rpgs'), ['rpgs'], GenMatrix)
+
+def gen_matrix(source_name):
+    "Returns the GenMatrix for a gamelist, or None if it doesn't have one."
+    name = gen_index_name(source_name)
+    if name in INDEXES:
+        return get(name)
+
+
+################################################################################
+## Inverted indexes of the gamelists, for ?search=
+
+class Postings:
+    """
+    An inverted index: maps each term to a sorted array of the positions of the items
+    containing it, and optionally to a parallel array of values (e.g. term counts).
+    These are all stored in one array, with term_ids mapping each term to its range
+    in offsets, because a dict of many small arrays is slow to save and load.
+    """
+
+    def __init__(self, positions, values = None):
+        """
+        positions: a dict mapping each term to a sorted list or array of positions.
+        values: None, or a dict mapping each term to a list or array of values.
+        """
+        self.term_ids = {}
+        lengths = []
+        for term, term_positions in positions.items():
+            self.term_ids[term] = len(lengths)
+            lengths.append(len(term_positions))
+        self.offsets = np.zeros(len(lengths) + 1, np.int64)
+        np.cumsum(lengths, out = self.offsets[1:])
+        self.positions = np.zeros(self.offsets[-1], np.int32)
+        self.values = None if values is None else np.zeros(self.offsets[-1], np.float32)
+        for term, idx in self.term_ids.items():
+            start, end = self.offsets[idx], self.offsets[idx + 1]
+            self.positions[start:end] = positions[term]
+            if values is not None:
+                self.values[start:end] = values[term]
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def __contains__(self, term):
+        return term in self.term_ids
+
+    def _range(self, term):
+        idx = self.term_ids.get(term)
+        if idx is None:
+            return 0, 0
+        return self.offsets[idx], self.offsets[idx + 1]
+
+    def get(self, term):
+        "Returns an array of the positions of the items containing a term (maybe empty)."
+        start, end = self._range(term)
+        return self.positions[start:end]
+
+    def get_values(self, term):
+        "Returns the array of values for the positions returned by get(term)."
+        start, end = self._range(term)
+        return self.values[start:end]
+
+    @classmethod
+    def concat(cls, parts):
+        """
+        Combine the Postings of several lists of items, given as a list of (Postings, base)
+        where base is the position of the first item of each list in the combined list.
+        """
+        positions = defaultdict(list)
+        values = defaultdict(list)
+        with_values = all(postings.values is not None for postings, base in parts)
+        for postings, base in parts:
+            for term in postings.term_ids:
+                positions[term].append(postings.get(term) + base)
+                if with_values:
+                    values[term].append(postings.get_values(term))
+        concat = lambda arrays: {term: np.concatenate(arrs) for term, arrs in arrays.items()}
+        return cls(concat(positions), concat(values) if with_values and parts else None)
+
+def search_text(game):
+    """
+    The lower-cased text of the fields of a Game that ?search= looks in, separated
+    by NULs so that a term can't match across two fields.
+    """
+    fields = [game.author, game.name, game.description, game.extra_info]
+    fields += [shot.description for shot in game.screenshots if shot.description]
+    for download in game.downloads:
+        fields.append(download.title)
+        if download.description:
+            fields.append(download.description)
+    return '\0'.join(fields).lower()
+
+def trigrams(text):
+    return set(text[i : i + 3] for i in range(len(text) - 2))
+
+class TrigramIndex:
+    """
+    Finds the games containing a substring (in search_text), or with a tag, without
+    scanning every game. For each trigram (3 characters) it lists the positions of
+    the games containing it, so the candidates for a search term are the games
+    containing all of the term's trigrams, which are then checked for the whole term
+    by fetching the games (the texts aren't kept, they're mostly ColdFields).
+    Terms of up to 3 characters don't need checking: the games containing one are
+    exactly those with a trigram containing it.
+    """
+
+    def __init__(self, keys, texts, tags):
+        """
+        keys: the key of each game (the srcid, or (source_name, srcid) when merged).
+        texts: the search_text() of each game.
+        tags: for each game, the list of its tags.
+        """
+        self.keys = keys
+        positions = defaultdict(list)
+        for pos, text in enumerate(texts):
+            for trigram in trigrams(text):
+                positions[trigram].append(pos)
+        self.trigrams = Postings(positions)
+        positions = defaultdict(list)
+        for pos, game_tags in enumerate(tags):
+            for tag in set(tag.lower() for tag in game_tags):
+                positions[tag].append(pos)
+        self.tags = Postings(positions)  # Lower-cased tags
+
+    @classmethod
+    def from_games(cls, games):
+        "games: a dict of Games, such as a gamelist DB."
+        return cls(list(games), [search_text(game) for game in games.values()],
+                   [game.tags for game in games.values()])
+
+    @classmethod
+    def merge(cls, parts):
+        """
+        Combine the indexes of several gamelists, given as a list of (source_name, TrigramIndex).
+        The keys of the result are (source_name, key) pairs.
+        """
+        ret = cls.__new__(cls)
+        ret.keys = []
+        bases = []
+        for source_name, index in parts:
+            bases.append(len(ret.keys))
+            ret.keys += [(source_name, key) for key in index.keys]
+        ret.trigrams = Postings.concat([(index.trigrams, base) for (_, index), base in zip(parts, bases)])
+        ret.tags = Postings.concat([(index.tags, base) for (_, index), base in zip(parts, bases)])
+        return ret
+
+    def __len__(self):
+        return len(self.keys)
+
+    def candidates(self, term):
+        """Returns the positions of the games which might contain a lower-case term, which
+        are exactly those which do if it's at most 3 characters long."""
+        if len(term) < 3:
+            # search_text() always has at least 3 characters, so every occurrence
+            # is part of a trigram
+            lists = [self.trigrams.get(trigram) for trigram in self.trigrams.term_ids if term in trigram]
+            return np.unique(np.concatenate(lists)) if lists else np.zeros(0, np.int32)
+        # Intersect the shortest lists first
+        lists = sorted((self.trigrams.get(trigram) for trigram in trigrams(term)), key = len)
+        ret = lists[0]
+        for positions in lists[1:]:
+            if len(ret) == 0:
+                break
+            ret = np.intersect1d(ret, positions, assume_unique = True)
+        return ret
+
+    def search(self, terms, load_game):
+        """
+        Returns the keys, in order, of the games which have any of the terms as a tag or
+        contain one in their search_text, ignoring case.
+        load_game: a function to get the Game for a key, to check the candidates for
+        terms longer than 3 characters.
+        """
+        found = np.zeros(len(self.keys), bool)
+        keys = self.keys
+        for term in terms:
+            term = term.lower()
+            found[self.tags.get(term)] = True
+            candidates = self.candidates(term)
+            if len(term) <= 3:
+                found[candidates] = True
+                continue
+            for pos in candidates:
+                if not found[pos]:
+                    game = load_game(keys[pos])
+                    found[pos] = game is not None and term in search_text(game)
+
+        return [keys[pos] for pos in np.flatnonzero(found)]
+
+# The fields of a Game used for ranking search results, and their weights
+RELEVANCE_FIELD_WEIGHTS = {'name': 4.0, 'author': 3.0, 'tags': 2.0, 'reviews': 1.5, 'description': 1.0}
+# BM25 parameters: term frequency saturation, and document length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_word_regexp = re.compile(r'\w+')
+
+def tokenize(text):
+    "Split text into lower-case words"
+    return _word_regexp.findall(text.lower())
+
+def relevance_fields(game):
+    "Returns a dict of the texts of the fields in RELEVANCE_FIELD_WEIGHTS for a Game."
+    return {
+        'name': game.name,
+        'author': game.author,
+        'tags': ' '.join(game.tags),
+        'reviews': ' '.join(review.title for review in game.reviews if review.title),
+        'description': util.strip_html(game.description),
+    }
+
+class RelevanceIndex:
+    """
+    Ranks games by how well they match some search words, using BM25 with the fields
+    weighted by RELEVANCE_FIELD_WEIGHTS (a word in a field of weight 2 counts as two
+    occurrences, and the document length is the weighted sum of the field lengths).
+    The index stores the weighted count of each word in each game; the inverse
+    document frequencies are computed when searching, so indexes can be merged.
+    """
+
+    def __init__(self, keys, docs):
+        """
+        keys: the key of each game (the srcid, or (source_name, srcid) when merged).
+        docs: the relevance_fields() of each game.
+        """
+        self.keys = keys
+        self.lengths = np.zeros(len(docs), np.float32)
+        positions = defaultdict(list)
+        counts = defaultdict(list)
+        for pos, fields in enumerate(docs):
+            doc_counts = defaultdict(float)
+            for field, text in fields.items():
+                weight = RELEVANCE_FIELD_WEIGHTS[field]
+                words = tokenize(text)
+                self.lengths[pos] += weight * len(words)
+                for word in words:
+                    doc_counts[word] += weight
+            for word, count in doc_counts.items():
+                positions[word].append(pos)
+                counts[word].append(count)
+        self.words = Postings(positions, counts)
+
+    @classmethod
+    def from_games(cls, games):
+        "games: a dict of Games, such as a gamelist DB."
+        return cls(list(games), [relevance_fields(game) for game in games.values()])
+
+    @classmethod
+    def merge(cls, parts):
+        """
+        Combine the indexes of several gamelists, given as a list of (source_name, RelevanceIndex).
+        The keys of the result are (source_name, key) pairs.
+        """
+        ret = cls.__new__(cls)
+        ret.keys = []
+        bases = []
+        for source_name, index in parts:
+            bases.append(len(ret.keys))
+            ret.keys += [(source_name, key) for key in index.keys]
+        ret.lengths = np.concatenate([index.lengths for _, index in parts] or [np.zeros(0, np.float32)])
+        ret.words = Postings.concat([(index.words, base) for (_, index), base in zip(parts, bases)])
+        return ret
+
+    def __len__(self):
+        return len(self.keys)
+
+    def scores(self, terms):
+        "Returns an array of the BM25 score of each game for some search terms (0 if no match)."
+        scores = np.zeros(len(self.keys), np.float32)
+        if not len(self.keys):
+            return scores
+        avg_length = max(self.lengths.mean(), 1)
+        for word in set(word for term in terms for word in tokenize(term)):
+            positions = self.words.get(word)
+            if not len(positions):
+                continue
+            idf = np.log(1 + (len(self.keys) - len(positions) + 0.5) / (len(positions) + 0.5))
+            counts = self.words.get_values(word)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[positions] / avg_length)
+            scores[positions] += idf * counts * (BM25_K1 + 1) / (counts + norm)
+        return scores
+
+    def top(self, terms, count, accept = None):
+        """
+        Returns (results, nummatched): a list of (key, score) of the count best matching
+        games, best first, and the number of games which matched any of the words.
+        accept: optional function which is passed a key and returns whether to include it.
+        Uses a heap, so only the games returned (and those rejected) need to be sorted.
+        """
+        scores = self.scores(terms)
+        matched = np.flatnonzero(scores)
+        heap = list(zip((-scores[matched]).tolist(), matched.tolist()))
+        heapq.heapify(heap)
+        results = []
+        while heap and len(results) < count:
+            negscore, pos = heapq.heappop(heap)
+            key = self.keys[pos]
+            if accept is None or accept(key):
+                results.append((key, -negscore))
+        return results, len(matched)
+
+
+################################################################################
+## Tags
+
+# Maps normalised tags to the tag to use instead (after lower-casing, see normalize_tag)
+TAG_SYNONYMS = {
+    'role playing game': 'rpg',
+    'roleplaying game': 'rpg',
+    'role playing': 'rpg',
+    'roleplaying': 'rpg',
+    'completed': 'complete',
+    'finished': 'complete',
+    'finished game': 'complete',
+}
+
+def normalize_tag(tag):
+    "Returns the form of a tag used to group different spellings of it: lower-cased, and see TAG_SYNONYMS"
+    tag = ' '.join(tag.lower().replace('-', ' ').replace('_', ' ').split())
+    return TAG_SYNONYMS.get(tag, tag)
+
+class TagIndex:
+    """
+    The games with each tag, with tags grouped by normalize_tag(), and the number of games
+    with each, for /tags and ?tag=.
+    """
+
+    def __init__(self, keys, tags):
+        """
+        keys: the key of each game (the srcid, or (source_name, srcid) when merged).
+        tags: for each game, the list of its tags.
+        """
+        self.games = {}      # normalised tag -> set of keys
+        self.spellings = {}  # normalised tag -> {tag: number of games}
+        for key, game_tags in zip(keys, tags):
+            for tag in set(game_tags):
+                normtag = normalize_tag(tag)
+                self.games.setdefault(normtag, set()).add(key)
+                spellings = self.spellings.setdefault(normtag, {})
+                spellings[tag] = spellings.get(tag, 0) + 1
+        self._update()
+
+    def _update(self):
+        "Compute counts and names"
+        self.counts = {normtag: len(keys) for normtag, keys in self.games.items()}
+        # The most common spelling of each tag to display, preferring those which
+        # aren't synonyms (e.g. "RPG" over "Role playing game")
+        def preference(normtag, tag):
+            return (tag.lower() != normtag, -self.spellings[normtag][tag], tag)
+        self.names = {normtag: min(spellings, key = lambda tag: preference(normtag, tag))
+                      for normtag, spellings in self.spellings.items()}
+
+    @classmethod
+    def from_games(cls, games):
+        "games: a dict of Games, such as a gamelist DB."
+        return cls(list(games), [game.tags for game in games.values()])
+
+    @classmethod
+    def merge(cls, parts):
+        """
+        Combine the indexes of several gamelists, given as a list of (source_name, TagIndex).
+        The keys of the result are (source_name, key) pairs.
+        """
+        ret = cls([], [])
+        for source_name, index in parts:
+            for normtag, keys in index.games.items():
+                ret.games.setdefault(normtag, set()).update((source_name, key) for key in keys)
+                spellings = ret.spellings.setdefault(normtag, {})
+                for tag, count in index.spellings[normtag].items():
+                    spellings[tag] = spellings.get(tag, 0) + count
+        ret._update()
+        return ret
+
+    def select(self, tags):
+        "Returns the set of keys of the games with any of the tags (normalised)."
+        ret = set()
+        for tag in tags:
+            ret.update(self.games.get(normalize_tag(tag), ()))
+        return ret
+
+
+################################################################################
+## Authors
+
+# Maps normalised author names (see normalize_author) to the normalised name of the
+# same person, for aliases too different to be grouped automatically
+AUTHOR_ALIASES = {}
+# Spellings of author names (normalised) from different gamelists are grouped if their
+# difflib similarity ratio is at least this, and they're at least AUTHOR_FUZZY_MIN_LEN long
+AUTHOR_FUZZY_RATIO = 0.9
+AUTHOR_FUZZY_MIN_LEN = 5
+
+_author_separator_regexp = re.compile(r'\s*(?:,|&|/|\band\b)\s*', re.I)
+_non_alnum_regexp = re.compile(r'[\W_]+')
+
+def split_authors(author):
+    "Split a Game.author field naming several people, e.g. 'Bob & Alice'"
+    return [name for name in _author_separator_regexp.split(author) if name]
+
+def normalize_author(name):
+    """
+    Returns the form of an author's name used to group spellings of it: lower-case
+    letters and digits only, with accents removed, and see AUTHOR_ALIASES.
+    """
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    key = _non_alnum_regexp.sub('', name.lower())
+    return AUTHOR_ALIASES.get(key, key)
+
+def normalize_game_name(name):
+    "Used to count the entries for the same game in different gamelists once"
+    return _non_alnum_regexp.sub('', name.lower())
+
+def game_time(game):
+    "The best available date when a game was released or updated, as a Unix time, or None"
+    for attr in ('pubtime', 'ctime', 'mtime'):
+        when = getattr(game, attr, None)
+        if when:
+            return when
+
+class AuthorStats:
+    """
+    Information about an author (or several spellings of their name) across all gamelists,
+    for the /authors/<key> page.
+    """
+    def __init__(self, key, entries):
+        """
+        entries: list of (source_name, srcid, game, spelling) for each of their games,
+        where spelling is the author name as it appears in that game.
+        """
+        self.key = key
+        spellings = defaultdict(int)
+        for source_name, srcid, game, spelling in entries:
+            spellings[spelling] += 1
+        self.spellings = sorted(spellings, key = lambda spelling: (-spellings[spelling], spelling))
+        self.name = self.spellings[0]
+        # (time or None, source_name, srcid, game name), oldest first
+        self.games = sorted(((game_time(game), source_name, srcid, game.get_name())
+                             for source_name, srcid, game, spelling in entries),
+                            key = lambda entry: (entry[0] or 0, entry[1], entry[2]))
+        self.sources = defaultdict(int)  # source_name -> number of games
+        # The earliest time for each distinct game
+        releases = {}
+        tags = defaultdict(int)
+        for source_name, srcid, game, spelling in entries:
+            self.sources[source_name] += 1
+            name = normalize_game_name(game.name)
+            when = game_time(game)
+            if name not in releases or (when and (not releases[name] or when < releases[name])):
+                releases[name] = when
+            for tag in set(normalize_tag(tag) for tag in game.tags):
+                tags[tag] += 1
+        self.sources = dict(self.sources)
+        self.num_distinct = len(releases)
+        times = sorted(when for when in releases.values() if when)
+        self.first = times[0] if times else None
+        self.last = times[-1] if times else None
+        # Median days between releases of distinct games
+        gaps = np.diff(times) / 86400
+        self.median_gap = float(np.median(gaps)) if len(gaps) else None
+        # (normalised tag, number of games), most common first
+        self.tags = sorted(tags.items(), key = lambda item: (-item[1], item[0]))
+
+class AuthorIndex:
+    """
+    Groups the games in the gamelists by author, combining different spellings of
+    the same name (see normalize_author, AUTHOR_ALIASES and AUTHOR_FUZZY_RATIO), with
+    the stats for each author precomputed.
+    """
+
+    def __init__(self, source_names, dbs):
+        "dbs: the gamelist DB (dict of Games, or None if missing) for each of source_names"
+        self.authors = {}  # key -> AuthorStats
+        self.aliases = {}  # normalised spelling -> key
+        self.fields = {}   # Game.author value -> list of (source_name, srcid), for ?author=
+        entries = defaultdict(list)  # normalised spelling -> list of entries for AuthorStats
+        sources = defaultdict(set)   # normalised spelling -> source_names
+        for source_name, games in zip(source_names, dbs):
+            for srcid, game in (games or {}).items():
+                self.fields.setdefault(game.author, []).append((source_name, srcid))
+                for spelling in split_authors(game.author):
+                    normname = normalize_author(spelling)
+                    if normname:
+                        entries[normname].append((source_name, srcid, game, spelling))
+                        sources[normname].add(source_name)
+
+        groups = self._group(entries, sources)
+        for members in groups.values():
+            group_entries = [entry for normname in members for entry in entries[normname]]
+            # Name the group after its most common spelling
+            key = min(members, key = lambda normname: (-len(entries[normname]), normname))
+            self.authors[key] = AuthorStats(key, group_entries)
+            for normname in members:
+                self.aliases[normname] = key
+
+    @staticmethod
+    def _group(entries, sources):
+        """
+        Returns a dict of lists of normalised spellings which are the same person, grouping
+        similar spellings which appear in different gamelists.
+        """
+        parent = {normname: normname for normname in entries}
+        def find(normname):
+            while parent[normname] != normname:
+                normname = parent[normname]
+            return normname
+        # Only compare names starting with the same two characters
+        blocks = defaultdict(list)
+        for normname in sorted(entries):
+            if len(normname) >= AUTHOR_FUZZY_MIN_LEN:
+                blocks[normname[:2]].append(normname)
+        for block in blocks.values():
+            for idx, name1 in enumerate(block):
+                matcher = difflib.SequenceMatcher(b = name1)
+                for name2 in block[idx + 1:]:
+                    if sources[name1] & sources[name2]:
+                        continue  # A site wouldn't have two spellings for one person
+                    matcher.set_seq1(name2)
+                    if matcher.quick_ratio() >= AUTHOR_FUZZY_RATIO and matcher.ratio() >= AUTHOR_FUZZY_RATIO:
+                        parent[find(name2)] = find(name1)
+        groups = defaultdict(list)
+        for normname in entries:
+            groups[find(normname)].append(normname)
+        return groups
+
+    def lookup(self, name):
+        "Returns the AuthorStats for a name (in any spelling) or key, or None."
+        return self.authors.get(self.aliases.get(normalize_author(name)))
+
+    def key_of(self, author_field):
+        "Returns the key of the (first) author named in a Game.author value, or None"
+        for spelling in split_authors(author_field):
+            key = self.aliases.get(normalize_author(spelling))
+            if key:
+                return key
+
+    def games_matching(self, term):
+        "Returns the set of (source_name, srcid) of the games whose Game.author contains term, ignoring case."
+        term = term.lower()
+        ret = set()
+        for field, keys in self.fields.items():
+            if term in field.lower():
+                ret.update(keys)
+        return ret
+
+
+################################################################################
+## Download/scripts availability
+
+def game_download_summary(game, zips_db):
+    """Tell whether a game has a download available and whether it has scripts:
+    returns a pair of "Yes", "No" or "?"."""
+    if game.archives:
+        # Assume the zip is actually downloadable (FIXME: return Yes for loose .rpgs too)
+        has_scripts = "No"
+        for key in game.archives:
+            if key in zips_db:
+                if hasattr(zips_db[key], 'scripts') and zips_db[key].scripts:
+                    has_scripts = "Yes"
+        return "Yes", has_scripts
+
+    has_download = "No"
+    has_scripts = "No"
+    if game.website:
+        has_download = "?"
+        has_scripts = "?"
+    for download in game.downloads:
+        has_download = "?"
+        key = download.zipkey()
+        if key in zips_db:
+            if hasattr(zips_db[key], 'rpgs') and zips_db[key].rpgs:
+                # Has at least one rpg/rpgdir, even if it's corrupt or unextractable
+                has_download = "Yes"
+            if hasattr(zips_db[key], 'scripts') and zips_db[key].scripts:
+                has_scripts = "Yes"
+        else:
+            # A download link, but we don't recognise it, eg a .rar file
+            if has_download == "No":
+                has_download = "?"
+            if has_scripts == "No":
+                has_scripts = "?"
+    return has_download, has_scripts
+
+def download_summaries_of(games, zips_db):
+    """
+    Returns a dict mapping each srcid in a gamelist DB to its game_download_summary(),
+    so that listing and filtering games doesn't need the zips DB.
+    """
+    zips_db = zips_db or {}
+    return {srcid: game_download_summary(game, zips_db) for srcid, game in (games or {}).items()}
+
+
+################################################################################
+## Sort orders, for listing pages of games
+
+# Name -> function (key, item) returning the value to sort the games in a gamelist by
+GAME_SORT_KEYS = {
+    'name': lambda srcid, game: game.name.lower().strip(),
+    'author': lambda srcid, game: game.author.lower().strip(),
+    'mtime': lambda srcid, game: game.mtime or 0,
+    'size': lambda srcid, game: game.size or 0,
+}
+
+# The same for the zips DB
+ZIP_SORT_KEYS = {
+    'name': lambda zipkey, zipdata: zipkey.lower(),
+    'mtime': lambda zipkey, zipdata: zipdata.mtime or 0,
+    'size': lambda zipkey, zipdata: zipdata.size or 0,
+}
+
+class SortOrders:
+    """
+    The items in a DB sorted by each of several sort keys (ties broken by the DB key), so
+    that a page of a listing can be found without comparing the items again.
+    """
+    def __init__(self, keys, values):
+        """
+        keys: list of the DB keys.
+        values: dict mapping each sort key name to a list of the values to sort by, parallel to keys.
+        """
+        self.keys = keys
+        self.values = values
+        self.positions = {key: pos for pos, key in enumerate(keys)}
+        self.orders = {}  # sort key name -> array of positions in keys, in sorted order
+        self.ranks = {}   # sort key name -> array of the rank of each position in keys
+        for name, vals in values.items():
+            order = np.array(sorted(range(len(keys)), key = lambda pos: (vals[pos], keys[pos])), np.intp)
+            ranks = np.empty(len(keys), np.intp)
+            ranks[order] = np.arange(len(keys))
+            self.orders[name] = order
+            self.ranks[name] = ranks
+
+    @classmethod
+    def from_items(cls, items, sort_keys):
+        "items: a dict DB. sort_keys: e.g. GAME_SORT_KEYS"
+        keys = list(items or {})
+        return cls(keys, {name: [func(key, items[key]) for key in keys] for name, func in sort_keys.items()})
+
+    @classmethod
+    def from_games(cls, games):
+        return cls.from_items(games, GAME_SORT_KEYS)
+
+    @classmethod
+    def merge(cls, parts):
+        "Combine the SortOrders of several gamelists, given (source_name, SortOrders) pairs"
+        parts = [(source_name, orders) for source_name, orders in parts if orders]
+        keys = [(source_name, key) for source_name, orders in parts for key in orders.keys]
+        values = {name: [value for source_name, orders in parts for value in orders.values[name]]
+                  for name in GAME_SORT_KEYS}
+        return cls(keys, values)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def sorted_keys(self, name, reverse = False):
+        "Returns all the keys sorted by a sort key"
+        order = self.orders[name]
+        return [self.keys[pos] for pos in (order[::-1] if reverse else order)]
+
+    def argsort(self, keys, name, reverse = False):
+        "Returns an array of the indices into a list of keys which would sort them by a sort key"
+        ranks = self.ranks[name][np.array([self.positions[key] for key in keys], np.intp)]
+        order = np.argsort(ranks)
+        return order[::-1] if reverse else order
+
+def zip_sort_orders(zips_db):
+    return SortOrders.from_items(zips_db, ZIP_SORT_KEYS)
+
+register('zips.order', ['zips'], zip_sort_orders)
+
+
+################################################################################
+## Zips
+
+class ZipIndex:
+    """
+    Which games link to or contain each zip (or other archive), and which zips are copies
+    of each other. Each game is a (source_name, srcid) pair. Keys are zipkeys
+    (see gamedb.DownloadLink.zipkey).
+    """
+    def __init__(self, source_names, dbs):
+        gamelists = dbs[:-1]
+        zips_db = dbs[-1] or {}
+        self.downloads = defaultdict(list)  # zipkey -> games with a DownloadLink to it
+        self.archives = defaultdict(list)   # zipkey -> games (.rpgs) found in it
+        self.names = {}  # game -> its name, for the games in downloads and archives
+        for source_name, games in zip(source_names, gamelists):
+            for srcid, game in (games or {}).items():
+                for download in game.downloads:
+                    if download.zipname:
+                        self.downloads[download.zipkey()].append((source_name, srcid))
+                        self.names[source_name, srcid] = game.name
+                # None for games saved before archives was added
+                for zipkey in game.archives or ():
+                    self.archives[zipkey].append((source_name, srcid))
+                    self.names[source_name, srcid] = game.name
+        self.downloads = dict(self.downloads)
+        self.archives = dict(self.archives)
+
+        # Zips with the same size and files are the same archive mirrored in several places
+        by_contents = defaultdict(list)
+        for zipkey, zipdata in zips_db.items():
+            if not zipdata.unreadable:
+                contents = (zipdata.size, tuple(zipdata.filelist.names), tuple(zipdata.filelist.sizes))
+                by_contents[contents].append(zipkey)
+        self.copies = {}  # zipkey -> sorted list of zipkeys of identical zips, including itself
+        for zipkeys in by_contents.values():
+            if len(zipkeys) > 1:
+                zipkeys.sort()
+                for zipkey in zipkeys:
+                    self.copies[zipkey] = zipkeys
+
+    def owner(self, zipkey):
+        "Returns the game which links to a zip on the site it came from, or None."
+        source_name = zipkey.split(':', 1)[0]
+        for game in self.downloads.get(zipkey, ()):
+            if game[0] == source_name:
+                return game
+
+    def sharing(self, zipkey):
+        """
+        Returns a list of (game, zipkey) for all the games which link to or contain this zip
+        or a copy of it.
+        """
+        ret = []
+        keys = [zipkey] + [key for key in self.copies.get(zipkey, ()) if key != zipkey]
+        for key in keys:
+            for game in self.downloads.get(key, []) + self.archives.get(key, []):
+                if (game, key) not in ret:
+                    ret.append((game, key))
+        return ret
+
+
+################################################################################
+
+def search_index_name(source_name, kind = 'search'):
+    """
+    The name of an index of a gamelist, or of all the non-hidden gamelists if source_name
+    is None. kind is 'search' for a TrigramIndex, 'relevance' for a RelevanceIndex,
+    'tags' for a TagIndex, 'order' for SortOrders or 'downloads' for download_summaries_of()
+    (only per gamelist).
+    """
+    return (source_name or 'all') + '.' + kind
+
+def register_gamelist_indexes(sources):
+    """
+    Register a TrigramIndex, RelevanceIndex, TagIndex and SortOrders for each gamelist, and merged
+    ones for all the non-hidden gamelists, given gamedb.SOURCES. Saving a gamelist only
+    rebuilds its own indexes, and the merged ones from those (in rebuild_stale()).
+    Also the download_summaries_of() each gamelist, the ZipIndex of all of them, and the
+    AuthorIndex of the non-hidden gamelists (excluding rpgs).
+    """
+    visible = [source_name for source_name, info in sources.items() if not info.get('hidden')]
+    for kind, cls in (('search', TrigramIndex), ('relevance', RelevanceIndex), ('tags', TagIndex),
+                      ('order', SortOrders)):
+        for source_name in sources:
+            register(search_index_name(source_name, kind), [source_name], cls.from_games,
+                     version = 1 if kind == 'search' else 0)
+        # Merged from the per-gamelist indexes (which refresh() rebuilds first), skipping
+        # gamelists which don't exist, rather than from the gamelists themselves
+        def build_merged(kind = kind, cls = cls):
+            parts = [(source_name, get(search_index_name(source_name, kind))) for source_name in visible]
+            return cls.merge([(source_name, part) for source_name, part in parts if part is not None])
+        register(search_index_name(None, kind), visible, build_merged, optional_deps = True, load_deps = False,
+                 version = 1 if kind == 'search' else 0)
+    for source_name in sources:
+        register(search_index_name(source_name, 'downloads'), [source_name, 'zips'],
+                 download_summaries_of, optional_deps = True)
+    gamelists = [source_name for source_name in visible if sources[source_name]['is_gamelist']]
+    register('authors', gamelists, lambda *dbs: AuthorIndex(gamelists, dbs), optional_deps = True)
+    register('zips.owners', list(sources) + ['zips'], lambda *dbs: ZipIndex(list(sources), dbs),
+             optional_deps = True, version = 1)
+
+def search_index(source_name = None):
+    "Returns the TrigramIndex of a gamelist, or of all the non-hidden gamelists if source_name is None."
+    return get(search_index_name(source_name))
+
+def relevance_index(source_name = None):
+    "Returns the RelevanceIndex of a gamelist, or of all the non-hidden gamelists if source_name is None."
+    return get(search_index_name(source_name, 'relevance'))
+
+def tag_index(source_name = None):
+    "Returns the TagIndex of a gamelist, or of all the non-hidden gamelists if source_name is None."
+    return get(search_index_name(source_name, 'tags'))
+
+def sort_orders(source_name = None):
+    "Returns the SortOrders of a gamelist, or of all the non-hidden gamelists if source_name is None."
+    return get(search_index_name(source_name, 'order'))
+
+def zip_orders():
+    "Returns the SortOrders of the zips DB, or None if it doesn't exist."
+    return get('zips.order')
+
+def author_index(build = True):
+    """Returns the AuthorIndex of the non-hidden gamelists (not rpgs), or None if there are none.
+    If not build, also returns None if it isn't already built and up to date, since
+    building it loads every gamelist."""
+    return get('authors', build)
+
+def download_summaries(source_name):
+    "Returns a dict mapping the srcids in a gamelist to (download, scripts) summaries, see game_download_summary."
+    return get(search_index_name(source_name, 'downloads'))
+
+def zip_index():
+    "Returns the ZipIndex, or None if there are no gamelists or zips."
+    return get('zips.owners')
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Copy databases from one db_layer storage backend to another, e.g. to convert the
+existing .pickle files into the SQLite DB:
+    ./migrate_db.py pickle sqlite
+Optionally followed by the names of the DBs to copy; default all of them.
+Afterwards set DB_BACKEND in ohrkpaths.py to use the new copies.
+
+Or write .snap files (see db_layer.SnapshotDB) for existing DBs:
+    ./migrate_db.py snapshots [dbname ...]
+
+Or load and save the gamelists and zips DBs again, which moves descriptions
+etc. into side DBs (see gamedb.ColdField):
+    ./migrate_db.py resave [dbname ...]
+
+Or fold the journals of DBs (see ohrkpaths.DB_JOURNAL) back into them:
+    ./migrate_db.py compact [dbname ...]
+
+Or rebuild the derived indexes (see indexes.py) of DBs; default all of them:
+    ./migrate_db.py reindex [dbname ...]
+
+Or move the screenshots in data/ and the text files in the zips DB into the blob
+store (see blobstore.py; enable BLOB_STORE in ohrkpaths.py first). The old files
+in data/ aren't deleted:
+    ./migrate_db.py blobs [dbname ...]
+
+Or delete unused blobs and repack the blob store:
+    ./migrate_db.py gc
+"""
+
+import os
+import sys
+
+if __name__ == '__main__':
+    import ohrkpaths  # Setup sys.path
+
+from ohrk import blobstore, db_layer, gamedb, indexes, util
+
+
+def migrate(from_backend, to_backend, db_names = None):
+    """Copy DBs between two backends (names as in db_layer.BACKENDS)."""
+    src = db_layer.BACKENDS[from_backend]
+    dest = db_layer.BACKENDS[to_backend]
+    util.mkdir(db_layer.DB_DIR)
+    for name in db_names or src.list_dbs():
+        db = src.load(name)
+        if db is None:
+            print("!! %s doesn't exist in %s" % (name, from_backend))
+            continue
+        dest.save(name, db)
+        if isinstance(db, dict):
+            print("%s: %d items" % (name, len(db)))
+
+def write_snapshots(db_names = None):
+    """Write snapshots of DBs in the current backend."""
+    if not db_names:
+        db_names = set()
+        for backend in db_layer.BACKENDS.values():
+            db_names.update(backend.list_dbs())
+    for name in sorted(db_names):
+        backend = db_layer.get_backend(name)
+        mtime = backend.mtime(name)
+        if mtime is not None:
+            db_layer.write_snapshot(name, backend.load(name), mtime)
+
+def resave(db_names = None):
+    """Load and save gamelists and zips in the current backend."""
+    for name in db_names or list(gamedb.SOURCES) + ['zips']:
+        if not db_layer.exists(name):
+            continue
+        if name == 'zips':
+            gamedb.save_zips(db_layer.load('zips'))
+        else:
+            gamedb.GameList.load(name).save()
+
+def reindex(db_names = None):
+    """Rebuild and save the indexes depending on some DBs."""
+    if not db_names:
+        db_names = set(dep for index in indexes.INDEXES.values() for dep in index.deps)
+    for name in sorted(db_names):
+        indexes.refresh(name)
+    indexes.rebuild_stale()
+
+def move_to_blobstore(db_names = None):
+    """Move screenshots (files under data/) and zip text files into the blob store."""
+    for name in db_names or list(gamedb.SOURCES) + ['zips']:
+        if not db_layer.exists(name):
+            continue
+        if name == 'zips':
+            # save_zips() does it
+            gamedb.save_zips(db_layer.load('zips'))
+            continue
+        gamelist = gamedb.GameList.load(name)
+        count = 0
+        for srcid, game in gamelist.games.items():
+            for screenshot in game.screenshots:
+                path = screenshot.local_path
+                if path and not path.startswith('blob:') and os.path.isfile(path):
+                    screenshot.local_path = blobstore.put_file(path, '%s/%s' % (name, srcid))
+                    count += 1
+        gamelist.save()
+        print("%s: moved %d screenshots" % (name, count))
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['snapshots']:
+        write_snapshots(sys.argv[2:])
+    elif sys.argv[1:2] == ['resave']:
+        resave(sys.argv[2:])
+    elif sys.argv[1:2] == ['reindex']:
+        reindex(sys.argv[2:])
+    elif sys.argv[1:2] == ['blobs']:
+        move_to_blobstore(sys.argv[2:])
+    elif sys.argv[1:2] == ['gc']:
+        blobstore.gc(gamedb.blob_references())
+    elif sys.argv[1:2] == ['compact']:
+        for name in sys.argv[2:] or db_layer.BACKENDS['pickle'].list_dbs():
+            db_layer.compact(name)
+    elif len(sys.argv) < 3 or not set(sys.argv[1:3]).issubset(db_layer.BACKENDS):
+        sys.exit("Usage: %s from_backend to_backend [dbname ...]\nBackends: %s"
+                 % (sys.argv[0], ", ".join(db_layer.BACKENDS)))
+    else:
+        migrate(sys.argv[1], sys.argv[2], sys.argv[3:])
@@ -29,3 +29,48 @@ def local_path_to_url(local_path):
     """Returns a URL if a file can be accessed externally, or None if it can't"""
     if local_path.startswith('data/'):
         return 'hosted/' + local_path[5:]
+    if local_path.startswith('blob:'):
+        # Served by the website from the blob store
+        return 'blobs/' + local_path[5:]
+
+# Storage backend for databases, see db_layer.py: 'pickle' or 'sqlite'
+DB_BACKEND = 'pickle'
+# Overrides of DB_BACKEND for individual DBs, e.g. {'zips': 'sqlite'}
+DB_BACKENDS = {}
+# Pickle backend: compress DBs when saving: None, 'zlib' (.pickle.gz) or 'lzma' (.pickle.xz).
+# Compressed DBs are decompressed as they're read, see db_layer.DecompressStream.
+DB_COMPRESSION = None
+# Overrides of DB_COMPRESSION for individual DBs, e.g. {'zips': 'lzma'}
+DB_COMPRESSIONS = {}
+# Pickle backend: save changes to individual games (GameList.save_games()) by appending
+# to a journal file, which is compacted when it exceeds this fraction of the DB size.
+DB_JOURNAL = False
+DB_JOURNAL_COMPACT_RATIO = 0.5
+# Write a .snap file alongside each gamelist/zips DB when saving, and have the
+# web server mmap those instead of loading the DBs. See db_layer.SnapshotDB.
+DB_SNAPSHOTS = False
+# If not None, the web server reloads changed DBs in a background thread, checking
+# every this many seconds (or immediately, where inotify is available).
+DB_WATCH_INTERVAL = None
+# Load all the gamelists and zips DBs in a background thread when the web server starts
+# (local_server.py does so once it's listening) rather than on the first requests that
+# need them. The ready/ page reports progress, with status 503 until it's done.
+WARMUP = False
+# Store downloaded screenshots and the text files copied out of zips in the
+# content-addressed blob store (see blobstore.py) instead of in data/ and the zips DB.
+BLOB_STORE = False
+# Where blobstore.py puts its pack files, relative to src/ like data/
+BLOB_DIR = 'data/blobs/'
+# Start a new pack file once the last one is this large
+BLOB_PACK_SIZE = 64 * 2**20
+# Record the changes to games each time a gamelist is saved, see history.py
+DB_HISTORY = False
+# Keep up to this many bytes of rendered pages in memory in the web server, see
+# pagecache.py. 0 to disable.
+PAGE_CACHE_SIZE = 32 * 2**20
+# zlib compression level (1-9) for dynamic pages sent gzip or deflate compressed to
+# browsers which accept it (Accept-Encoding). 0 to disable.
+GZIP_LEVEL = 6
+# Level for the prebuilt .gz copies of static files in STATIC_ROOT, which are sent
+# instead of the files when up to date. Made by staticgz.py.
+STATIC_GZIP_LEVEL = 9
@@ -0,0 +1,64 @@
+"""
+An in-memory LRU cache of rendered web pages, used by website.application.
+
+Each page is stored with the generations of the DBs it read (RequestContext.generations),
+and is dropped when any of them changes. The footer of the page ("Page rendered in ...")
+isn't cached; it's stored split around it, so that a new footer can be inserted.
+"""
+
+from collections import OrderedDict
+
+from ohrk import db_layer
+
+
+class CachedPage:
+    def __init__(self, status, headers, before, after, generations):
+        self.status = status
+        self.headers = headers
+        self.before = before            # The page (bytes) up to the footer
+        self.after = after              # ...and after it
+        self.generations = generations  # The DBs read, see RequestContext.generations
+
+    def size(self):
+        return len(self.before) + len(self.after)
+
+class PageCache:
+    """
+    Maps keys (anything hashable, identifying a request) to CachedPages, evicting the
+    least recently used pages once they total more than max_size bytes.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.pages = OrderedDict()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.pages)
+
+    def get(self, key):
+        "Returns the CachedPage for a key, or None if there isn't one or it's out of date."
+        page = self.pages.get(key)
+        if page and not db_layer.unchanged(page.generations):
+            self.remove(key)
+            page = None
+        if page:
+            self.pages.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return page
+
+    def put(self, key, page):
+        self.remove(key)
+        if page.size() > self.max_size:
+            return
+        self.pages[key] = page
+        self.size += page.size()
+        while self.size > self.max_size:
+            self.remove(next(iter(self.pages)))
+
+    def remove(self, key):
+        page = self.pages.pop(key, None)
+        if page:
+            self.size -= page.size()
@@ -125,7 +125,7 @@ def process_sources(db_name, sources):
     iterator.print_summary()
 
     games_db.save()
-    db_layer.save('zips', zips_db)
+    gamedb.save_zips(zips_db)
 
 if len(sys.argv) < 2:
     sys.exit("Specify .rpg files, .rpgdir directories, .zip files, or directories containing any of these as arguments.")
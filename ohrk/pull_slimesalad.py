@@ -462,7 +462,7 @@ def process_gamedump(phpbb2 = False, limit = 9999, cache_index = CACHE_INDEX):
         if phpbb2:
             pageurl = pageurl.replace('/forum', '/phpbb2')
         game = process_game_page(pageurl, gameinfo)
-        print(game.__dict__)
+        print(game.dumpinfo())
 
         limit -= 1
         if limit <= 0:
@@ -501,7 +501,7 @@ def process_one_game(url):
     Calls process_game_page() with gamedump.php entry
     """
     game = process_game_page(url.replace('http://', 'https://'), get_gameinfo(url))
-    print(game.__dict__)
+    print(game.dumpinfo())
     return game
 
 def list_downloads_by_mod_date():
@@ -268,6 +268,8 @@ def clean_strings(obj):
             #print("list item %s,%s" % (k,v))
             ret.append(clean_strings(v))
         obj = tuple(ret)
+    elif isinstance(obj, gamedb.Slotted):
+        obj.__setstate__(clean_strings(obj.__getstate__()))
     elif hasattr(obj, '__dict__'):
         #print("recurse into %s.__dict__" % obj)
         obj.__dict__ = clean_strings(obj.__dict__)
@@ -0,0 +1,182 @@
+"""
+The binary format used to save DBs: pickle protocol 5, with NumPy arrays (and
+anything else supporting pickle.PickleBuffer) stored out-of-band after the
+pickle so they can be loaded without copying, and with a schema version saved
+with objects of classes which have a _version attribute (the gamedb classes,
+see gamedb.Slotted). Those are saved as a tuple of attribute values, with the
+class, version and attribute names stored only once per file, which is
+faster to load than a pickled __dict__.
+
+Objects saved by an older version of a class are upgraded when loaded by its
+_migrations: a dict mapping each old version number to a function which takes
+the state (the dict from __getstate__) and returns the state for the next version.
+
+Data which doesn't start with MAGIC is loaded as a plain pickle, so DBs
+written before this format existed can still be loaded.
+
+The header includes all the lengths, so serialised objects can be concatenated
+and read back one at a time with load().
+
+Layout: HEADER (MAGIC, number of buffers, pickle length), then the length of
+each buffer (BUFLEN), then the pickle, then each buffer, 8-byte aligned.
+"""
+
+import io
+import pickle
+import struct
+from collections import deque
+from itertools import repeat
+
+from ohrk import util
+
+MAGIC = b'OHRKSER1'
+HEADER = struct.Struct('<8sIQ')
+BUFLEN = struct.Struct('<Q')
+ALIGN = 8
+
+
+class _Schema:
+    """
+    The class, schema version and set attributes of some saved objects. Each
+    is saved only once per pickle, with every object referring to it (via the pickle memo).
+    """
+    def __init__(self, cls, version, fields):
+        self.cls = cls
+        self.version = version
+        self.fields = fields
+        # Whether objects can be restored just by setting the attributes
+        self.current = (version == cls._version and set(fields).issubset(cls._slot_names)
+                        and set(cls._defaults).issubset(fields))
+        self.interned = [(idx, name) for idx, name in enumerate(fields) if name in cls._interned]
+
+    def __reduce__(self):
+        return _Schema, (self.cls, self.version, self.fields)
+
+def _restore(schema, values):
+    "Recreate an object saved by _Pickler, upgrading it if needed"
+    cls = schema.cls
+    obj = cls.__new__(cls)
+    if schema.current:
+        # Fast path: setattr() in a C loop
+        deque(map(setattr, repeat(obj), schema.fields, values), 0)
+        for idx, name in schema.interned:
+            setattr(obj, name, util.intern_strs(values[idx]))
+        obj._loaded()
+        return obj
+    version = schema.version
+    state = dict(zip(schema.fields, values))
+    if version > cls._version:
+        raise ValueError("%s was saved by a newer version (%d > %d)" % (cls.__name__, version, cls._version))
+    while version < cls._version:
+        state = cls._migrations[version](state)
+        version += 1
+    obj.__setstate__(state)
+    return obj
+
+class _Pickler(pickle.Pickler):
+    """Saves objects of classes with a _version (gamedb.Slotted subclasses) as a
+    _Schema and a tuple of attribute values."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.schemas = {}  # (cls, fields) -> _Schema
+
+    def reducer_override(self, obj):
+        # (Not called for common builtin types, so is cheap)
+        cls = type(obj)
+        version = getattr(cls, '_version', None)
+        if version is None or isinstance(obj, type):
+            return NotImplemented
+        fields = []
+        values = []
+        for name in cls._slot_names:
+            try:
+                values.append(getattr(obj, name))
+                fields.append(name)
+            except AttributeError:
+                pass
+        fields = tuple(fields)
+        schema = self.schemas.get((cls, fields))
+        if schema is None:
+            schema = self.schemas[cls, fields] = _Schema(cls, version, fields)
+        return _restore, (schema, tuple(values))
+
+def _padding(length):
+    return -length % ALIGN
+
+def dumps(obj):
+    "Serialise obj, returning bytes"
+    buffers = []
+    def buffer_callback(buf):
+        buffers.append(buf.raw())
+        return False  # Out-of-band
+    data = io.BytesIO()
+    _Pickler(data, 5, buffer_callback = buffer_callback).dump(obj)
+    data = data.getbuffer()
+    parts = [HEADER.pack(MAGIC, len(buffers), len(data))]
+    parts += [BUFLEN.pack(buf.nbytes) for buf in buffers]
+    parts.append(data)
+    offset = sum(map(len, parts))
+    for buf in buffers:
+        parts.append(b'\0' * _padding(offset))
+        offset += _padding(offset)
+        parts.append(buf)
+        offset += buf.nbytes
+    return b''.join(parts)
+
+def dump(obj, file):
+    "Serialise obj to a binary file"
+    file.write(dumps(obj))
+
+def loads(data):
+    """Load from bytes-like data, which can be either this format or a plain pickle.
+    Any NumPy arrays will be views of data, so it must not be modified afterwards;
+    pass a bytearray to get writable arrays."""
+    view = memoryview(data)
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        return pickle.loads(data)
+    magic, numbuffers, length = HEADER.unpack_from(view)
+    offset = HEADER.size
+    lengths = [BUFLEN.unpack_from(view, offset + i * BUFLEN.size)[0] for i in range(numbuffers)]
+    offset += numbuffers * BUFLEN.size
+    pickled = view[offset : offset + length]
+    offset += length
+    buffers = []
+    for buflen in lengths:
+        offset += _padding(offset)
+        buffers.append(view[offset : offset + buflen])
+        offset += buflen
+    return pickle.loads(pickled, buffers = buffers)
+
+def load(file):
+    """Load from a binary file, in either this format or a plain pickle.
+    Reads just one object, so can be used on a stream of dump()ed objects.
+    The data is read straight into the buffer it's loaded from.
+    Raises EOFError if the data is truncated."""
+    header = file.read(HEADER.size)
+    if header[:len(MAGIC)] != MAGIC:
+        if file.seekable():
+            file.seek(-len(header), io.SEEK_CUR)
+            return pickle.load(file)
+        # A stream, such as db_layer.DecompressStream
+        return pickle.loads(header + file.read())
+    if len(header) < HEADER.size:
+        raise EOFError
+    magic, numbuffers, length = HEADER.unpack(header)
+    buflens = file.read(numbuffers * BUFLEN.size)
+    if len(buflens) < numbuffers * BUFLEN.size:
+        raise EOFError
+    # Work out the total size
+    offset = HEADER.size + len(buflens) + length
+    for i in range(numbuffers):
+        offset += _padding(offset) + BUFLEN.unpack_from(buflens, i * BUFLEN.size)[0]
+    data = bytearray(offset)
+    data[:HEADER.size] = header
+    data[HEADER.size : HEADER.size + len(buflens)] = buflens
+    toread = memoryview(data)[HEADER.size + len(buflens):]
+    while len(toread):
+        count = file.readinto(toread)
+        if not count:
+            raise EOFError
+        toread = toread[count:]
+    return loads(data)
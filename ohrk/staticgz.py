@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Prebuilt gzipped copies of the static files in STATIC_ROOT (main.css, sorttable.js, etc).
+
+website.static_serve sends <file>.gz (with Content-Encoding: gzip) instead of
+<file> to browsers which accept gzip, but only if the .gz is at least as new as
+the file, so a stale copy is never served: the file is just sent uncompressed
+until this is rerun.
+
+Run as a script (the build step) to write the .gz copies which are missing or
+out of date, at STATIC_GZIP_LEVEL:
+    ./staticgz.py [-f]
+-f rewrites all of them.
+"""
+
+import os
+import sys
+import gzip
+
+if __name__ == '__main__':
+    import ohrkpaths  # Setup sys.path
+
+from ohrk import ohrkpaths
+
+# Files with these extensions are worth compressing
+COMPRESSIBLE_EXTENSIONS = ('txt', 'html', 'css', 'js')
+
+
+def compressible(fname):
+    # *.content.html are templates, not sent as they are
+    return fname.split('.')[-1] in COMPRESSIBLE_EXTENSIONS and not fname.endswith('.content.html')
+
+def gz_fname(fname):
+    return fname + '.gz'
+
+def is_fresh(fname):
+    "Whether fname has a .gz copy that's up to date"
+    try:
+        return os.path.getmtime(gz_fname(fname)) >= os.path.getmtime(fname)
+    except OSError:
+        return False
+
+def compress_file(fname, level = None):
+    "Write the .gz copy of a file. Returns (original size, compressed size)."
+    if level is None:
+        level = ohrkpaths.STATIC_GZIP_LEVEL
+    with open(fname, 'rb') as infile:
+        data = infile.read()
+    compressed = gzip.compress(data, level, mtime = int(os.path.getmtime(fname)))
+    # Written to a temp file first, so the web server never sees half a file
+    tempname = gz_fname(fname) + '.tmp'
+    with open(tempname, 'wb') as outfile:
+        outfile.write(compressed)
+    os.replace(tempname, gz_fname(fname))
+    return len(data), len(compressed)
+
+def compress_static(root = None, force = False):
+    "Compress all the compressible files under root (default STATIC_ROOT) without an up-to-date .gz"
+    root = root or ohrkpaths.STATIC_ROOT
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name != '__pycache__']
+        for name in sorted(filenames):
+            fname = os.path.join(dirpath, name)
+            if not compressible(fname) or (is_fresh(fname) and not force):
+                continue
+            size, compressed = compress_file(fname)
+            print("%s: %d -> %d bytes" % (fname, size, compressed))
+
+if __name__ == '__main__':
+    if sys.argv[1:] not in ([], ['-f']):
+        sys.exit(__doc__)
+    compress_static(force = '-f' in sys.argv)
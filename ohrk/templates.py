@@ -0,0 +1,62 @@
+"""
+The HTML templates in web/: page_template.html and the *.content.html files, which
+contain str.format() style {fields}.
+
+Each template is parsed once and kept in memory, and reloaded if the file's mtime
+changes. Rendering produces a sequence of fragments, which are only joined at the
+end (or sent to the browser as they're produced, see website.render_page), and a
+field's value can itself be a list or generator of fragments (such as the content of
+a page, or the rows of a table) to avoid joining it early. A generator isn't run until
+its field is reached.
+"""
+
+import os
+import types
+import string
+
+from ohrk import util
+
+_formatter = string.Formatter()
+
+
+class Template:
+    def __init__(self, fname):
+        self.fname = fname
+        self.mtime = os.path.getmtime(fname)
+        # List of (literal text, field name or None, format spec, conversion)
+        self.parts = list(_formatter.parse(util.read_text_file(fname)))
+
+    def render_iter(self, fields):
+        "Generates the fragments of the rendered template, given a dict of field values."
+        for literal, name, spec, conversion in self.parts:
+            if literal:
+                yield literal
+            if name is None:
+                continue
+            value = _formatter.get_field(name, (), fields)[0]
+            if isinstance(value, (list, types.GeneratorType)) and not spec and not conversion:
+                yield from value
+            else:
+                value = _formatter.convert_field(value, conversion)
+                yield _formatter.format_field(value, spec or '')
+
+    def render_into(self, fragments, fields):
+        "Append the rendered template to the list fragments, given a dict of field values."
+        fragments += self.render_iter(fields)
+        return fragments
+
+    def render(self, **fields):
+        "Returns the rendered template as a str"
+        return ''.join(self.render_into([], fields))
+
+_templates = {}  # fname -> Template
+
+def get(fname):
+    "Returns the Template for a file, loading it if it isn't loaded or has been modified."
+    template = _templates.get(fname)
+    if template is None or template.mtime != os.path.getmtime(fname):
+        template = _templates[fname] = Template(fname)
+    return template
+
+def exists(fname):
+    return fname in _templates or os.path.isfile(fname)
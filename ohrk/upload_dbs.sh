@@ -1,5 +1,18 @@
 #!/bin/sh
 
+# Each gamelist is uploaded along with its .cold side DB (descriptions, etc, see
+# gamedb.ColdField) and its journal if any (DB_JOURNAL), in whichever of the
+# formats in db_layer.CODECS it's saved in (.pickle, .pickle.gz or .pickle.xz).
+DBS="cp cpbkup googleplay opohr ss ss_links hs pepsi"
+
 #lftp -e 'mirror -R -e ohrblog web/pics/ohrblog ; exit' cp
 cd databases
-lftp -e 'mput -O ohr/ohr_archive/ohrk/databases cp.pickle cpbkup.pickle googleplay.pickle opohr.pickle ss.pickle ss_links.pickle hs.pickle pepsi.pickle; exit' cp
+FILES=""
+for db in $DBS; do
+    for fname in $db.pickle $db.pickle.gz $db.pickle.xz $db.cold.pickle $db.cold.pickle.gz $db.cold.pickle.xz $db.journal $db.cold.journal; do
+        if [ -f $fname ]; then
+            FILES="$FILES $fname"
+        fi
+    done
+done
+lftp -e "mput -O ohr/ohr_archive/ohrk/databases $FILES; exit" cp
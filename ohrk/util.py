@@ -102,6 +102,14 @@ def md5hash(string):
     md5.update(string.encode('utf-8'))
     return md5.hexdigest()
 
+def intern_strs(value):
+    "sys.intern() a str or a list of strs"
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return [sys.intern(x) if isinstance(x, str) else x for x in value]
+    return value
+
 def strip_strings(strings):
     """Given a list of strings, strip them""" # and remove whitespace-only strings"""
     return [x.strip() for x in strings]
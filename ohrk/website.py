@@ -8,14 +8,19 @@ serves static files.
 import os.path
 import cgi
 import sys
+import glob
 import time
 import random
-from collections import defaultdict
+import threading
+import zlib
+import hashlib
+import email.utils
+import numpy as np
 #import tabulate
 
 from ohrk.rpg_const import *
 from ohrk.ohrkpaths import *
-from ohrk import gamedb, db_layer, inspect_rpg, urlimp, util
+from ohrk import blobstore, gamedb, db_layer, indexes, inspect_rpg, pagecache, staticgz, templates, urlimp, util
 from ohrk import pull_slimesalad
 
 
@@ -47,19 +52,33 @@ class RequestInfo:
         "Initialise self and global variables for a new request"
         self.req_timer = util.Timer().start()  # Time the total time spent handling the request
         self.environ = environ
-        self.set_header = start_response
+        self.start_response = start_response
+        self.status = self.headers = None
         self.footer_info = ''
-        self.dbcontext = db_layer.RequestContext()
+        self.footer = None
+        self.cache_status = None  # 'hit' or 'miss' if the page cache was checked
+        self.cacheable = True     # False if the page is missing something which isn't ready yet
+        self.dbcontext = db_layer.RequestContext(readonly = True)
         # Other stuff initialised later:
         #self.path      # The path part of the URL
         #self.query     # Query decoded into a Str -> List[Str] mapping
 
+    def set_header(self, status, headers):
+        "Set the response status and headers. They're sent by application()."
+        self.status, self.headers = status, headers
+
+    def send_header(self):
+        return self.start_response(self.status, self.headers)
+
     def get_footer(self):
         ret = self.footer_info
         if self.dbcontext.timer.time:
              ret += " DB load in %.3fs. " % self.dbcontext.timer.time
+        if self.cache_status:
+             ret += " Page cache %s." % self.cache_status
         self.req_timer.stop()
         ret += " Page rendered in %.3fs." % self.req_timer.time
+        self.footer = ret
         return ret
 
 
@@ -68,13 +87,12 @@ reqinfo = RequestInfo(None, None)  # dummy
 
 ################################################################################
 
-def handle_game_aliases(path, db):
+def handle_game_aliases(path):
     """
     Handle /gamelists/<listname>/<gameid>/... URLs which are aliases to the real pages
     by redirecting to the canonical page. Returns None if not an alias.
 
     path: a list of path segments; path[0]=='gamelists'
-    db:   the loaded DB for this gamelist
     """
     # ss/p=###/..., where p=### is taken from a game URL, as an alias,
     listname, gameid = path[1], path[2]
@@ -97,23 +115,24 @@ def handle_gamelists(path):
         return render_gamelists()
     else:
         listname = path[1]
-        db = gamedb.GameList.load(listname)
-        if not db:
+        if not db_layer.exists(listname):
             return notfound("Game list %s does not exist." % listname)
 
         if len(path) == 2:
-            return render_gamelist(db)
+            return render_gamelist(gamedb.GameList.load(listname))
         else:
             gameid = path[2]
 
             # First, handle aliases to games as special cases (returns a redirection)
-            ret = handle_game_aliases(path, db)
+            ret = handle_game_aliases(path)
             if ret:
                 return ret
 
-            if gameid not in db.games:
+            # Avoid loading the whole gamelist
+            game = gamedb.GameList.load_game(listname, gameid)
+            if not game:
                 return notfound("Game %s/%s does not exist." % (listname, gameid))
-            return render_game(listname, gameid, db.games[gameid])
+            return render_game(listname, gameid, game)
 
 
 ################################################################################
@@ -123,65 +142,80 @@ def render_gamelists():
     Generate the gamelists/ page
     """
     topnote = util.link(".", "Back to root ...") + "\n"
-    ret = "<h1>Mirrored Gamelists</h1>\n"
-    ret += "<p>The following gamelists have been imported:</p>\n<ul>"
+    ret = ["<h1>Mirrored Gamelists</h1>\n"]
+    ret.append("<p>The following gamelists have been imported:</p>\n<ul>")
     for src, info in sorted(gamedb.SOURCES.items()):
         if info.get('hidden', False):
             continue
-        ret += '<li> <a href="gamelists/%s">%s</a> </li>\n' % (src, info['name'])
-    ret += '</ul>'
+        ret.append('<li> <a href="gamelists/%s">%s</a> </li>\n' % (src, info['name']))
+    ret.append('</ul>')
     return render_page(ret, title = 'OHRk - Gamelists', topnote = topnote)
 
-def gamelist_filter_game(game):
+def gamelist_search(source_name = None):
+    """
+    If the query has search=... terms, returns a list of the keys of the games in a gamelist
+    (or in all non-hidden gamelists, as (source_name, srcid), if source_name is None)
+    which match any of them, otherwise None.
+    """
+    if 'search' not in reqinfo.query:
+        return None
+    index = indexes.search_index(source_name)
+    if index is None:
+        return []
+    if source_name:
+        load_game = lambda srcid: gamedb.GameList.load_game(source_name, srcid)
+    else:
+        load_game = lambda key: gamedb.GameList.load_game(*key)
+    return index.search(reqinfo.query['search'], load_game)
+
+def gamelist_tagged(source_name = None):
+    """
+    If the query has tag=... filters, returns the set of keys of the games in a gamelist
+    (or in all non-hidden gamelists, as (source_name, srcid), if source_name is None)
+    which have any of them (compared by indexes.normalize_tag), otherwise None.
+    """
+    if 'tag' not in reqinfo.query:
+        return None
+    index = indexes.tag_index(source_name)
+    if index is None:
+        return set()
+    return index.select(reqinfo.query['tag'])
+
+def gamelist_authored(source_name = None):
+    """
+    If the query has author=... filters, returns the set of keys of the games in a gamelist
+    (or in all gamelists, as (source_name, srcid), if source_name is None) whose author
+    contains any of them, ignoring case, otherwise None.
+    """
+    if 'author' not in reqinfo.query:
+        return None
+    index = indexes.author_index(build = False)
+    keys = set()
+    if index is None:
+        # Not built yet (see warmup()), so nothing matches for now
+        reqinfo.cacheable = False
+        return keys
+    for term in reqinfo.query['author']:
+        keys.update(index.games_matching(term))
+    if source_name:
+        keys = set(srcid for listname, srcid in keys if listname == source_name)
+    return keys
+
+def gamelist_filter_game(dbname, gameid, game):
     """
     Inspects the query part of the URL, and returns True if this
-    game should be displayed on the game page
+    game should be displayed on the game page. Doesn't handle search=..., tag=... or
+    author=..., see gamelist_search, gamelist_tagged and gamelist_authored.
     """
-    if 'tag' in reqinfo.query:
-        # There can be multiple tags=... in the query; show a game
-        # if any of them match
-        for tag in reqinfo.query['tag']:
-            if tag in game.tags:
-                break
-        else:
-            return False
     if 'download' in reqinfo.query or 'scripts' in reqinfo.query:
         # Handle download/scripts=yes/no/?
-        zips_db = db_layer.load('zips')
         vals = {}
-        vals['download'], vals['scripts'] = get_game_download_summary(game, zips_db)
+        vals['download'], vals['scripts'] = indexes.download_summaries(dbname)[gameid]
         for key in ('download', 'scripts'):
             if key in reqinfo.query:
                 # Take first query only
                 if vals[key].lower() != reqinfo.query[key][0].lower():
                     return False
-    if 'author' in reqinfo.query:
-        for term in reqinfo.query['author']:
-            if term.lower() in game.author.lower():
-                break
-        else:
-            return False
-    if 'search' in reqinfo.query:
-        found = False
-        for term in reqinfo.query['search']:
-            term = term.lower()
-            # FIXME: tags aren't lower-cased, so tags which aren't lower-case can't be found!
-            if (term in game.author.lower() or term in game.name.lower()
-                or term in game.description.lower() or term in game.tags
-                or term in game.extra_info):
-                break
-            for screenshot in game.screenshots:
-                if screenshot.description and term in screenshot.description.lower():
-                    found = True
-                    break
-            if found: break
-            for download in game.downloads:
-                if term in download.title.lower() or (download.description and term in download.description.lower()):
-                    found = True
-                    break
-            if found: break
-        else:
-            return False
     return True
 
 def gamelist_describe_filter():
@@ -201,6 +235,47 @@ def gamelist_describe_filter():
     return ("Filtering for games with %s. Click %s to show all games."
             % (", and ".join(filters), util.link(backlink, "here")))
 
+# Number of games shown with ?sort=relevance
+RELEVANCE_RESULTS = 100
+
+# Default ?pagesize= of gamelists and the zips list
+LIST_PAGESIZE = 250
+
+def gamelist_select_games(source_name, all_keys, lookup):
+    """
+    Returns (keyed_games, nummatched): the (dbname, srcid, game) tuples of the games to
+    display according to the query. If ?search=...&sort=relevance, these are the best
+    RELEVANCE_RESULTS matches, best first, and nummatched is the number of games matching
+    any of the words; otherwise they're in index order and nummatched is None.
+    source_name: a gamelist, or None for all the non-hidden gamelists.
+    all_keys: the keys of all the games (srcids, or (source_name, srcid) if source_name is None).
+    lookup: function mapping a key to its (dbname, srcid, game).
+    """
+    keyed_games = []
+    tagged = gamelist_tagged(source_name)
+    authored = gamelist_authored(source_name)
+    def accept(key):
+        return ((tagged is None or key in tagged) and (authored is None or key in authored)
+                and gamelist_filter_game(*lookup(key)))
+    if 'search' in reqinfo.query and reqinfo.query.get('sort') == ['relevance']:
+        index = indexes.relevance_index(source_name)
+        results, nummatched = index.top(reqinfo.query['search'], RELEVANCE_RESULTS, accept)
+        return [lookup(key) for key, score in results], nummatched
+    keys = gamelist_search(source_name)
+    if keys is None:
+        keys = all_keys
+    for key in keys:
+        # Filter out certain games
+        if accept(key):
+            keyed_games.append(lookup(key))
+    return keyed_games, None
+
+def describe_ranking(keyed_games, nummatched):
+    if nummatched is None:
+        return ""
+    return (" Sorted by relevance: showing the best %d of the %d games containing any of the words."
+            % (len(keyed_games), nummatched))
+
 def render_gamelist(db):
     """
     Generate one of the gamelists/<db.name>/ pages.
@@ -210,34 +285,37 @@ def render_gamelist(db):
     filterinfo = gamelist_describe_filter()
     numtotal = len(db.games)
 
-    keyed_games = []
-    for gameid, game in db.games.items():
-        # Filter out certain games
-        if gamelist_filter_game(game):
-            keyed_games.append((db.name, gameid, game))
+    keyed_games, nummatched = gamelist_select_games(
+        db.name, db.games, lambda gameid: (db.name, gameid, db.games[gameid]))
+    filterinfo += describe_ranking(keyed_games, nummatched)
 
-    return render_games_table(keyed_games, dbinfo['name'], dbinfo['is_gamelist'], filterinfo, numtotal)
+    return render_games_table(keyed_games, dbinfo['name'], dbinfo['is_gamelist'], filterinfo, numtotal,
+                              sort = nummatched is None, source_name = db.name)
 
 def render_games(path):
     """
     Generate the games/ page. Right now this simply combines all game lists.
     """
-    keyed_games = []
     numtotal = 0
+    dbs = {}
     for listname, listinfo in gamedb.SOURCES.items():
         if listinfo.get('hidden'):
             continue
         db = gamedb.GameList.load(listname)
+        if db is None:
+            continue
+        dbs[listname] = db
         numtotal += len(db.games)
-        for gameid, game in db.games.items():
-            # Filter out certain games
-            if gamelist_filter_game(game):
-                keyed_games.append((db.name, gameid, game))
+    all_keys = [(listname, gameid) for listname, db in dbs.items() for gameid in db.games]
+    keyed_games, nummatched = gamelist_select_games(
+        None, all_keys, lambda key: (key[0], key[1], dbs[key[0]].games[key[1]]))
 
     # If there is a filter active, say so
     filterinfo = gamelist_describe_filter()
+    filterinfo += describe_ranking(keyed_games, nummatched)
 
-    return render_games_table(keyed_games, "All games", True, filterinfo, numtotal, show_source = True)
+    return render_games_table(keyed_games, "All games", True, filterinfo, numtotal, show_source = True,
+                              sort = nummatched is None)
 
 def gamelist_extra_column_headers():
     """
@@ -256,37 +334,77 @@ def gamelist_extra_column_headers():
         return column_key.title()
     return list(map(getname, columns))
 
-def gamelist_extra_column_cells(game):
+def gen_matrix_rows(keyed_games):
     """
-    Return a list of extra table cells for a game on a gamelist page,
-    according to ?column=... queries.
+    For the keyed_games (as for render_games_table) that have .gen data, find their
+    rows in the GenMatrix of their source. Returns a list of (matrix, positions, rows)
+    for each source, where positions are indices into keyed_games and rows is an
+    array of the corresponding row numbers.
     """
-    if 'column' not in reqinfo.query:
-        return []
-    columns = reqinfo.query['column']
-
     ret = []
+    for dbname in sorted(set(dbname for dbname, gameid, game in keyed_games)):
+        matrix = indexes.gen_matrix(dbname)
+        if not matrix:
+            continue
+        positions = [pos for pos, (db, gameid, game) in enumerate(keyed_games)
+                     if db == dbname and gameid in matrix.rows]
+        rows = matrix.row_indices([keyed_games[pos][1] for pos in positions])
+        ret.append((matrix, positions, rows))
+    return ret
+
+def gamelist_extra_column_cells(keyed_games):
+    """
+    Return a list of the extra table cells for each game in keyed_games (as for
+    render_games_table) on a gamelist page, according to ?column=... queries.
+    """
+    columns = reqinfo.query.get('column', [])
+    cells = [[] for _ in keyed_games]
+    if any(colname in inspect_rpg.genLimitsDict for colname in columns):
+        genrows = gen_matrix_rows(keyed_games)
+
     for colname in columns:
-        if colname == 'tags':
-            ret.append(', '.join(game.tags))
-        elif colname == 'screenshots':
-            ret.append(str(len(game.screenshots)))
-        elif colname == 'reviews':
-            ret.append(str(len(game.reviews)))
-        elif colname == 'size':
-            if game.size:
-                ret.append(str(game.size // 1024))
-            else:
-                ret.append("")
-        elif colname in inspect_rpg.genLimitsDict:
-            if game.gen is not None:
-                genidx, offset, name = inspect_rpg.genLimitsDict[colname]
-                ret.append(str(game.gen[genidx] + offset))
+        if colname in inspect_rpg.genLimitsDict:
+            column = ['N/A'] * len(keyed_games)
+            for matrix, positions, rows in genrows:
+                for pos, value in zip(positions, matrix.column(colname, rows)):
+                    column[pos] = str(value)
+            for row, cell in zip(cells, column):
+                row.append(cell)
+            continue
+        for row, (dbname, gameid, game) in zip(cells, keyed_games):
+            if colname == 'tags':
+                row.append(', '.join(game.tags))
+            elif colname == 'screenshots':
+                row.append(str(len(game.screenshots)))
+            elif colname == 'reviews':
+                row.append(str(len(game.reviews)))
+            elif colname == 'size':
+                if game.size:
+                    row.append(str(game.size // 1024))
+                else:
+                    row.append("")
             else:
-                ret.append('N/A')
-        else:
-            ret.append('bad column')
-    return ret
+                row.append('bad column')
+    return cells
+
+def gamelist_gen_stats(keyed_games):
+    """
+    Return a description of the range of values of each .gen column selected with
+    ?column=... over keyed_games, or "".
+    """
+    columns = [colname for colname in reqinfo.query.get('column', []) if colname in inspect_rpg.genLimitsDict]
+    if not columns:
+        return ""
+    genrows = gen_matrix_rows(keyed_games)
+    rows_by_matrix = [(matrix, rows) for matrix, positions, rows in genrows if len(rows)]
+    ret = []
+    for colname in columns:
+        values = np.concatenate([matrix.column(colname, rows) for matrix, rows in rows_by_matrix] or [[]])
+        if len(values):
+            genidx, offset, name = inspect_rpg.genLimitsDict[colname]
+            ret.append("%s: min %d, median %g, mean %.1f, max %d" % (
+                (name or colname).capitalize(), values.min(), np.median(values), values.mean(), values.max()))
+    return "<br>".join(ret)
 
 def gamelist_column_checkboxes(is_rpglist, is_gamelist):
     """
@@ -328,56 +446,157 @@ def gamelist_column_checkboxes(is_rpglist, is_gamelist):
                 ret += '<input type="hidden" name="%s" value="%s"></input>' % (key, val)
     return ret
 
-def render_games_table(keyed_games, list_title, is_gamelist, filterinfo, numtotal, show_source = False):
+def query_int(name, default, minimum = None, maximum = None):
+    """
+    Returns the value of an integer query parameter, or default if it's missing or not an
+    integer, clamped to [minimum, maximum].
+    """
+    try:
+        value = int(reqinfo.query.get(name, [default])[0])
+    except ValueError:
+        value = default
+    if maximum is not None:
+        value = min(value, maximum)
+    if minimum is not None:
+        value = max(value, minimum)
+    return value
+
+def query_url(**changes):
     """
-    Generate a page with a table containing a list of games.
+    Returns the URL of the current page with some query parameters changed (or removed
+    if the value is None), for links to other pages of a listing.
+    """
+    newquery = dict(reqinfo.query)
+    for key, value in changes.items():
+        if value is None:
+            newquery.pop(key, None)
+        else:
+            newquery[key] = [value]
+    return reqinfo.path + '?' + urlimp.urlencode(newquery, doseq = True)
+
+def list_sort_params():
+    """
+    Returns (sort key, reverse) from ?sort=...&order=asc/desc. The sort key isn't checked.
+    """
+    return reqinfo.query.get('sort', ['name'])[0], reqinfo.query.get('order', ['asc'])[0] == 'desc'
+
+def list_page(items, thing = "games"):
+    """
+    Returns (the items on the current page according to ?page=...&pagesize=..., HTML
+    description of the page with links to the others). The first page is ?page=0;
+    out of range pages show the first or last page.
+    """
+    pagesize = query_int('pagesize', LIST_PAGESIZE, minimum = 1)
+    if len(items) <= pagesize:
+        return items, ""
+    numpages = (len(items) + pagesize - 1) // pagesize
+    page = query_int('page', 0, minimum = 0, maximum = numpages - 1)
+    shown = items[page * pagesize : (page + 1) * pagesize]
+    ret = "Page %d of %d: %s %d-%d." % (page + 1, numpages, thing, page * pagesize + 1, page * pagesize + len(shown))
+    links = []
+    if page > 0:
+        links.append(util.link(query_url(page = str(page - 1)), "Previous page"))
+    if page + 1 < numpages:
+        links.append(util.link(query_url(page = str(page + 1)), "Next page"))
+    links.append(util.link(query_url(page = None, pagesize = str(len(items))), "Show all"))
+    return shown, ret + " " + " | ".join(links)
+
+def sort_link(title, sortkey):
+    "Returns a column header which links to the listing sorted by sortkey (reversed if it already is)"
+    cursort, reverse = list_sort_params()
+    if cursort == sortkey:
+        title += " ▼" if reverse else " ▲"
+        order = 'asc' if reverse else 'desc'
+    else:
+        order = 'asc'
+    return util.link(query_url(sort = sortkey, order = order, page = None), title)
+
+def sort_games(keyed_games, source_name):
+    """
+    Sort keyed_games (as for render_games_table) according to ?sort=...&order=...,
+    by default by name, using the SortOrders index.
+    source_name: their gamelist, or None if from all the non-hidden gamelists.
+    """
+    sortkey, reverse = list_sort_params()
+    orders = indexes.sort_orders(source_name)
+    if not keyed_games or not orders:
+        return keyed_games
+    if source_name:
+        keys = [gameid for dbname, gameid, game in keyed_games]
+    else:
+        keys = [(dbname, gameid) for dbname, gameid, game in keyed_games]
+    if sortkey in inspect_rpg.genLimitsDict:
+        # Sort by name, then stable sort by the .gen value, with games without a .gen last
+        keyed_games = [keyed_games[idx] for idx in orders.argsort(keys, 'name')]
+        order = []
+        for matrix, positions, rows in gen_matrix_rows(keyed_games):
+            order += [positions[idx] for idx in matrix.argsort(sortkey, rows, reverse)]
+        has_gen = set(order)
+        order += [pos for pos in range(len(keyed_games)) if pos not in has_gen]
+    else:
+        if sortkey not in orders.orders:
+            sortkey, reverse = 'name', False
+        order = orders.argsort(keys, sortkey, reverse)
+    return [keyed_games[idx] for idx in order]
+
+def render_games_table(keyed_games, list_title, is_gamelist, filterinfo, numtotal, show_source = False, sort = True,
+                       source_name = None):
+    """
+    Generate a page with a table containing a page of a list of games.
 
     keyed_games:  This is a list of (dbname: str, srcid: str, game: Game) tuples.
     list_title:   What title to put on the page
     is_gamelist:  True if this is one of the imported game lists, not a list of .rpgs.
     filterinfo:   Extra info shown at the top.
     show_source:  Add the 'Source' column.
+    sort:         Sort according to ?sort=... (by default by name), otherwise keep the order of keyed_games.
+    source_name:  The gamelist keyed_games are from, or None for all non-hidden gamelists.
     """
-    zips_db = db_layer.load('zips')
-    # Generate a table as a list-of-lists, so it can be sorted
     if is_gamelist:
-        headers = ['Name', 'Author', 'Link', 'Download?', 'Scripts?', 'Description']
+        headers = [sort_link('Name', 'name'), sort_link('Author', 'author'), 'Link', 'Download?', 'Scripts?', 'Description']
     else:
-        headers = ['Name', 'Download?', 'Scripts?', 'Description']
+        headers = [sort_link('Name', 'name'), 'Download?', 'Scripts?', 'Description']
     if show_source:
         headers = ['Source'] + headers
-    headers = gamelist_extra_column_headers() + headers
-    table = []
-    for dbname, gameid, game in keyed_games:
-        row = []
-        row.append( game.name.lower().strip() )  # sort key 
-        row += gamelist_extra_column_cells( game )
-        if show_source:
-            row.append( dbname )
-        row.append( util.link('gamelists/%s/%s/' % (dbname, gameid), game.get_name()) )
-        if is_gamelist:
-            #util.link(game.author_link, game.get_author())
-            row.append( game.get_author() )
-            row.append( game.url and util.link(game.url, "➔") )
-        row += get_game_download_summary(game, zips_db)
-        row.append( util.shorten(util.strip_html(game.description), 150) )
-        table.append(row)
-    table.sort()
-    # Strip the sort key
-    table = [x[1:] for x in table]
+    extra_headers = gamelist_extra_column_headers()
+    for idx, column_key in enumerate(reqinfo.query.get('column', [])):
+        if column_key in inspect_rpg.genLimitsDict or column_key == 'size':
+            extra_headers[idx] = sort_link(extra_headers[idx], column_key)
+    headers = extra_headers + headers
+
+    if sort:
+        keyed_games = sort_games(keyed_games, source_name)
+    page_games, pageinfo = list_page(keyed_games)
+    extra_cells = gamelist_extra_column_cells(page_games)
+    summaries = {dbname: indexes.download_summaries(dbname) for dbname, gameid, game in page_games}
+
+    def table_rows():
+        "Generates the rows of the table (while the page is sent)"
+        yield "<tr>" + "".join("<th>%s</th>" % title for title in headers) + "</tr>\n"
+        for (dbname, gameid, game), cells in zip(page_games, extra_cells):
+            row = []
+            row += cells
+            if show_source:
+                row.append( dbname )
+            row.append( util.link('gamelists/%s/%s/' % (dbname, gameid), game.get_name()) )
+            if is_gamelist:
+                #util.link(game.author_link, game.get_author())
+                row.append( game.get_author() )
+                row.append( game.url and util.link(game.url, "➔") )
+            row += summaries[dbname][gameid]
+            row.append( util.shorten(game.get_short_description(), 150) )
+            yield "<tr>" + "".join("<td>%s</td>" % item for item in row) + "</tr>\n"
 
     topnote = util.link("gamelists/", "Back to gamelists ...") + "\n"
 
-    table_html = "<tr>" + "".join("<th>%s</th>" % title for title in headers) + "</tr>\n"
-    lines = []
-    for row in table:
-        lines.append("<tr>" + "".join("<td>%s</td>" % item for item in row) + "</tr>\n")
-    table_html += "".join(lines)
-
     column_form = gamelist_column_checkboxes(not is_gamelist, is_gamelist)
+    gen_stats = gamelist_gen_stats(keyed_games)
+    if gen_stats:
+        filterinfo = (filterinfo + "<br>" if filterinfo else "") + gen_stats
 
-    format_strs = {'listname': list_title, 'table': table_html, 'filterinfo': filterinfo,
-                   'numshown': len(table), 'numtotal': numtotal, 'pageurl': reqinfo.path,
+    format_strs = {'listname': list_title, 'table': table_rows(), 'filterinfo': filterinfo,
+                   'nummatching': len(keyed_games), 'numtotal': numtotal, 'pageinfo': pageinfo,
+                   'pageurl': reqinfo.path,
                    'column_checkboxes': column_form,
     }
     return templated_page('gamelist.html', topnote = topnote, title = 'OHRk - ' + list_title, **format_strs)
@@ -464,40 +683,6 @@ def get_game_reviews_info(game):
         lines.append('<li>%s %s %s</li>' % (util.link(review.url, byline), review.location, second_line))
     return '<ul>%s</ul>' % '\n'.join(lines)
 
-def get_game_download_summary(game, zips_db):
-    """Tell whether a game has a download available"""
-    if game.archives:
-        # Assume the zip is actually downloadable (FIXME: return Yes for loose .rpgs too)
-        has_scripts = "No"
-        for key in game.archives:
-            if key in zips_db:
-                if hasattr(zips_db[key], 'scripts') and zips_db[key].scripts:
-                    has_scripts = "Yes"
-        return "Yes", has_scripts
-        return "No", "No"
-
-    has_download = "No"
-    has_scripts = "No"
-    if game.website:
-        has_download = "?"
-        has_scripts = "?"
-    for download in game.downloads:
-        has_download = "?"
-        key = download.zipkey()
-        if key in zips_db:
-            if hasattr(zips_db[key], 'rpgs') and zips_db[key].rpgs:
-                # Has at least one rpg/rpgdir, even if it's corrupt or unextractable
-                has_download = "Yes"
-            if hasattr(zips_db[key], 'scripts') and zips_db[key].scripts:
-                has_scripts = "Yes"
-        else:
-            # A download link, but we don't recognise it, eg a .rar file
-            if has_download == "No":
-                has_download = "?"
-            if has_scripts == "No":
-                has_scripts = "?"
-    return has_download, has_scripts
-
 def render_game_description(game):
     """Perform fixups on a game's description text, retuning html"""
     text = game.description
@@ -520,7 +705,15 @@ def render_game(listname, gameid, game):
         return ''
 
     if listname != 'rpgs':
-        ret += add_row("Author", util.link(game.author_link, game.get_author()))
+        author = util.link(game.author_link, game.get_author())
+        # Don't build the AuthorIndex just for this link, it loads every gamelist
+        index = indexes.author_index(build = False)
+        author_key = index and index.key_of(game.author)
+        if index is None:
+            reqinfo.cacheable = False
+        if author_key:
+            author += " (%s)" % util.link("authors/" + author_key, "all their games")
+        ret += add_row("Author", author)
     if game.url:
         ret += add_row("Original entry", util.link(game.url, "On " + gamedb.SOURCES[listname]['name']))
     # else:
@@ -558,50 +751,117 @@ def render_tags(path):
     """
     sorttype = reqinfo.query.get('sort', ['name'])[0]
     display = reqinfo.query.get('display', ['cloud'])[0]
-    threshold = int(reqinfo.query.get('threshold', [1])[0])
-
-    tags = defaultdict(int)
-    for listname, listinfo in gamedb.SOURCES.items():
-        if listinfo.get('hidden', False):
-            continue
-        db = gamedb.GameList.load(listname)
-        for game in db.games.values():
-            for tag in game.tags:
-                tags[tag] += 1
+    threshold = query_int('threshold', 1)
 
-    tags = [(name, count) for name, count in tags.items() if count >= threshold]
+    # Counts of the tags (with different spellings combined) of all the non-hidden gamelists
+    index = indexes.tag_index()
+    tags = [(index.names[normtag], count) for normtag, count in index.counts.items() if count >= threshold]
     if sorttype == "count":
         tags.sort(key = lambda x : -x[1])
     else:  # "name"
         tags.sort(key = lambda x : x[0].lower())
 
-    ret = '<div class="%s">' % ("tag" + display)
+    ret = ['<div class="%s">' % ("tag" + display)]
     for tag, count in tags:
-        ret += "<div>%dx %s</div>\n" % (count, util.link("games?tag=" + tag, tag))
-    ret += "</div>"
+        ret.append("<div>%dx %s</div>\n" % (count, util.link("games?tag=" + tag, tag)))
+    ret.append("</div>")
     return templated_page('tags.html', title = 'OHRk Archive - Tags',
                           content = ret, sort = sorttype, display = display, threshold = threshold,
                           topnote = util.link(".", "Back to root ..."))
 
 ################################################################################
 
+def handle_authors(path):
+    """
+    Handles authors/ and authors/<name> URLs, where the name can be any spelling.
+    """
+    if not any(db_layer.generation(name) for name in indexes.INDEXES['authors'].deps):
+        return notfound("No gamelists")
+    index = indexes.author_index(build = False)
+    if index is None:
+        return templated_page('404.html', message = "The author index is still being built, try again soon",
+                              title = 'OHRk - 503', status = '503 Service Unavailable')
+    if len(path) == 1:
+        return render_authors(index)
+    author = index.lookup(path[1])
+    if not author:
+        return notfound("No author named %s" % path[1])
+    if author.key != path[1]:
+        return redirect(URL_ROOTPATH + 'authors/' + author.key)
+    return render_author(author)
+
+def render_authors(index):
+    """
+    Generate the authors/ page, listing everyone.
+    """
+    rows = []
+    for author in sorted(index.authors.values(), key = lambda author: author.name.lower()):
+        rows.append("<tr><td>%s</td><td>%d</td><td>%d</td></tr>\n" % (
+            util.link("authors/" + author.key, author.name), author.num_distinct, len(author.games)))
+    ret = ["<h1>Authors</h1>\n",
+           '<table class="sortable" border="0">\n<tbody>\n',
+           "<tr><th>Author</th><th>Games</th><th>Entries</th></tr>\n"]
+    ret += rows
+    ret.append("</tbody></table>\n")
+    return render_page(ret, title = 'OHRk - Authors', topnote = util.link(".", "Back to root ..."))
+
+def render_author(author):
+    """
+    Generate an authors/<key> page, from an indexes.AuthorStats.
+    """
+    def date(when):
+        return time.strftime('%Y-%m-%d', time.gmtime(when)) if when else "?"
+    ret = "<h1>%s</h1>\n" % author.name
+    ret += '<table class="game" border="0">\n<tbody>\n'
+    def add_row(key, val):
+        return '<tr><td class="heading">%s</td><td>%s</td></tr>\n' % (key, val)
+    if len(author.spellings) > 1:
+        ret += add_row("Also known as", ", ".join(author.spellings[1:]))
+    ret += add_row("Games", "%d (%d entries, in %s)" % (
+        author.num_distinct, len(author.games),
+        ", ".join("%s: %d" % (gamedb.SOURCES[name]['name'], count) for name, count in sorted(author.sources.items()))))
+    if author.first:
+        active = "%s to %s" % (date(author.first), date(author.last))
+        if author.median_gap is not None:
+            active += "; a new game every %d days (median)" % round(author.median_gap)
+        ret += add_row("Active", active)
+    if author.tags:
+        ret += add_row("Tags", ", ".join("%s (%d)" % (util.link("games?tag=" + tag, tag), count)
+                                         for tag, count in author.tags))
+    ret += "</tbody></table>\n"
+    ret = [ret, '<table class="sortable gamelist" border="0">\n<tbody>\n',
+           "<tr><th>Date</th><th>Source</th><th>Name</th></tr>\n"]
+    for when, listname, srcid, name in author.games:
+        ret.append("<tr><td>%s</td><td>%s</td><td>%s</td></tr>\n" % (
+            date(when), listname, util.link('gamelists/%s/%s/' % (listname, srcid), name)))
+    ret.append("</tbody></table>\n")
+    return render_page(ret, title = 'OHRk - ' + author.name, topnote = util.link("authors/", "All authors ..."))
+
+################################################################################
+
 def handle_gallery(path):
     """
     Generate a page of screenshots. Randomly sorted or paged.
     path is ignored.
     """
     screenshots = []
+    # Sets of the (listname, srcid) keys of the games passing each filter in the query
+    key_filters = [set(keys) for keys in (gamelist_search(), gamelist_tagged(), gamelist_authored())
+                   if keys is not None]
 
     for listname, listinfo in sorted(gamedb.SOURCES.items()):
         if listinfo.get('hidden', False):
             continue
         db = gamedb.GameList.load(listname)
+        if db is None:
+            continue
         for srcid, game in db.games.items():
-            if gamelist_filter_game(game):
+            if (all((listname, srcid) in keys for keys in key_filters)
+                    and gamelist_filter_game(listname, srcid, game)):
                 gameurl = 'gamelists/%s/%s/' % (db.name, srcid)
                 screenshots += [(gameurl, game.name, game.author, screenshot) for screenshot in game.screenshots]
 
-    pagesize = int(reqinfo.query.get('pagesize', [16])[0])
+    pagesize = query_int('pagesize', 16, minimum = 1)
     info = 'Found %s screenshots. ' % len(screenshots)
 
     def page_url(page = None, random = False):
@@ -616,47 +876,77 @@ def handle_gallery(path):
             newquery['random'] = ''
         return reqinfo.path + '?' + urlimp.urlencode(newquery, doseq = True)
 
+    numpages = max(1, (len(screenshots) + pagesize - 1) // pagesize)
     if 'random' in reqinfo.query:
         random.shuffle(screenshots)
         info += "Randomised. " + util.link(page_url(random = True), "Reload") + " to see more! "
         nextpage = 0
         titletext = "Random Gallery"
     else:
-        page = int(reqinfo.query.get('page', [0])[0])
+        page = query_int('page', 0, minimum = 0, maximum = numpages - 1)
         screenshots = screenshots[page * pagesize : (page + 1) * pagesize]
         info += "%s. Page %s. " % (util.link(page_url(random = True), "Randomise"), page)
         nextpage = page + 1
         titletext = "Gallery"
-    info += util.link(page_url(page = nextpage), "Go to page %d" % nextpage) + "."
+    if nextpage < numpages:
+        info += util.link(page_url(page = nextpage), "Go to page %d" % nextpage) + "."
 
     topnote = util.link(".", "Back to root ...") + "\n"
-    ret = "<p>" + info + "</p>"
-    ret += "<p>" + gamelist_describe_filter() + "</p>"
-    for gameurl, gamename, gameauthor, screenshot in screenshots[:pagesize]:
-        byline = (" by %s" % gameauthor) if gameauthor else ""
-        ret += util.link(gameurl, screenshot.img_tag('%s%s' % (gamename, byline)))
-
-    return templated_page('gallery.html', images = ret, title = 'OHRRPGCE Gallery',
+    describe_filter = gamelist_describe_filter()
+    def images():
+        yield "<p>" + info + "</p>"
+        yield "<p>" + describe_filter + "</p>"
+        for gameurl, gamename, gameauthor, screenshot in screenshots[:pagesize]:
+            byline = (" by %s" % gameauthor) if gameauthor else ""
+            yield util.link(gameurl, screenshot.img_tag('%s%s' % (gamename, byline)))
+
+    return templated_page('gallery.html', images = images(), title = 'OHRRPGCE Gallery',
                           titletext = titletext, topnote = topnote)
 
 ################################################################################
 
+def game_link(index, game):
+    "Link to the page of a game in a ZipIndex (as (source_name, srcid)), or None if it doesn't exist"
+    name = index.names.get(game)
+    if name is not None:
+        return util.link('gamelists/%s/%s' % game, name)
+
 def find_game_with_zip(zipkey):
     """Figure out which game has a download for this zip file; return a link to it."""
     srcname, zipname = zipkey.split(':', 1)
     if srcname not in gamedb.SOURCES:
         return " from collection '%s'" % srcname
     location = " on " + gamedb.SOURCES[srcname]['name']
-    games_db = gamedb.GameList.load(srcname)
-    for srcid, game in games_db.games.items():
-        #game = games_db.games
-        for download in game.downloads:
-            if download.zipkey() == zipkey:
-                return " from " + util.link('gamelists/%s/%s' % (srcname, srcid), game.name) + location
+    index = indexes.zip_index()
+    owner = index and index.owner(zipkey)
+    if owner:
+        return " from " + game_link(index, owner) + location
     # This can happen for example with old mirrored versions of downloads on SS,
     # which are no longer linked to by their game entries. Or reviews on Op:OHR.
     return " from unknown game" + location + "?"
 
+def get_zip_sharing_info(zips_db, zipkey):
+    """
+    Generates the list of games which link to or contain a zip or an identical copy
+    of it, for the zip page.
+    """
+    index = indexes.zip_index()
+    if not index:
+        return ""
+    lines = []
+    for (source_name, srcid), key in index.sharing(zipkey):
+        link = game_link(index, (source_name, srcid))
+        if not link:
+            continue
+        line = link + " on " + gamedb.SOURCES[source_name]['name']
+        if key != zipkey:
+            line += " (as %s)" % (util.link("zips/" + key, zips_db[key].name()) if key in zips_db else key)
+        lines.append("<li>%s</li>" % line)
+    if len(lines) < 2:
+        # Nothing more than find_game_with_zip shows
+        return ""
+    return "<p>Games sharing this archive:</p>\n<ul>%s</ul>" % "\n".join(lines)
+
 def render_zip_contents(zips_db, zipkey, fname):
     """
     Handles zips/<zipkey>/<fname> URLs.
@@ -664,12 +954,13 @@ def render_zip_contents(zips_db, zipkey, fname):
     (small text files)
     """
     zipdata = zips_db[zipkey]
+    files = zipdata.files  # Loaded from the side DB
 
     topnote = util.link("/zips/" + zipkey, "Back to %s..." % zipdata.name()) + "\n"
-    if fname not in zipdata.files:
+    if fname not in files:
         return notfound("That file is not available here; download the .zip yourself to view it.")
     ret = '<h1>%s/%s</h1>\n' % (zipdata.name(), fname)
-    ret += '<div class="textfile">%s</div>' % util.text2html(zipdata.files[fname])
+    ret += '<div class="textfile">%s</div>' % util.text2html(blobstore.get_text(files[fname]))
     return render_page(ret, title = fname, topnote = topnote)
 
 def render_zip(zips_db, zipkey):
@@ -688,10 +979,11 @@ def render_zip(zips_db, zipkey):
     if zipdata.unreadable:
         note = "This zip file is corrupt or could not be read (e.g. uses unusual compression)."
     else:
+        files = zipdata.files  # Loaded from the side DB
         lines = []
         for fname, size, mtime in sorted(zipdata.filelist):
             name = fname
-            if fname in zipdata.files:
+            if fname in files:
                 # We copied the contents of this file, provide a link to it
                 name = util.link("zips/%s/%s" % (zipkey, fname), name)
             if fname in zipdata.rpgs:
@@ -703,25 +995,35 @@ def render_zip(zips_db, zipkey):
                     name = util.link("gamelists/rpgs/%s/" % zipdata.rpgs[fname], name)
 
             lines.append( "<tr><td>%s</td><td>%s</td><td>%s</td></tr>\n" % (name, size, time.ctime(mtime)) )
-        table_html = "".join(lines)
+        table_html = lines
 
     if zipdata.error:
         note2 = "An error occurred while reading this .zip: " + zipdata.error
 
     format_strs = {'heading': zipdata.name(), 'table': table_html, 'size': zipdata.size,
-                   'mtime': time.ctime(zipdata.mtime), 'downloadable': downloadable, 'note': note, 'note2': note2}
+                   'mtime': time.ctime(zipdata.mtime), 'downloadable': downloadable,
+                   'sharing': get_zip_sharing_info(zips_db, zipkey), 'note': note, 'note2': note2}
     return templated_page('zipinfo.html', topnote = topnote, title = 'OHRk - ' + zipdata.name(), **format_strs)
 
 def render_zips(zips_db):
     """
     Handles zips/ URL. Show list of zips. This is for admin purposes, probably won't be public.
     """
-    # Just show a simple table
-    ret = "<ul>"
-    for zipkey in sorted(zips_db.keys()):
-        ret += "<li>%s</li>\n" % util.link("zips/" + zipkey, zipkey)
-    ret += "</ul>"
-    return render_page(ret, topnote = util.link(".", "Back to root ..."))
+    sortkey, reverse = list_sort_params()
+    orders = indexes.zip_orders()
+    if sortkey not in orders.orders:
+        sortkey, reverse = 'name', False
+    zipkeys, pageinfo = list_page(orders.sorted_keys(sortkey, reverse), "zips")
+    sort_links = ", ".join(sort_link(name, name) for name in indexes.ZIP_SORT_KEYS)
+    # Just show a simple list
+    def content():
+        yield "<p>Sort by %s.</p>\n" % sort_links
+        yield "<p>%s</p>\n" % pageinfo
+        yield "<ul>"
+        for zipkey in zipkeys:
+            yield "<li>%s</li>\n" % util.link("zips/" + zipkey, zipkey)
+        yield "</ul>"
+    return render_page(content(), topnote = util.link(".", "Back to root ..."))
 
 def handle_zips(path):
     """
@@ -741,30 +1043,76 @@ def handle_zips(path):
         else:
             return render_zip_contents(zips_db, zipkey, "/".join(path[2:]))
 
+def serve_blob(path):
+    """
+    Handles blobs/<key><extension> URLs: screenshots, etc. in the blob store.
+    """
+    if len(path) != 2:
+        return notfound("Bad blob URL")
+    key, extn = os.path.splitext(path[1])
+    data = blobstore.get(key)
+    if data is None:
+        return notfound("No such blob")
+    mimetype = {'.png': 'image/png',
+                '.gif': 'image/gif',
+                '.jpg': 'image/jpeg',
+                '.jpeg': 'image/jpeg',
+                '.bmp': 'image/bmp',
+                '.txt': 'text/plain; charset=utf-8',
+    }.get(extn, 'application/octet-stream')
+    # The contents of a blob never change
+    reqinfo.set_header('200 OK', [('Content-Type', mimetype), ('Content-Length', str(len(data))),
+                                  ('Cache-Control', 'public, max-age=31536000, immutable')])
+    return [data]
+
 ################################################################################
 ## Top-level application code and WSGI interfacing
 
+# Pages are sent to the WSGI server in pieces of about this many characters
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def stream(fragments):
+    "Generates the utf-8 encoded fragments (strs) joined into pieces of about STREAM_CHUNK_SIZE"
+    chunk = []
+    size = 0
+    for fragment in fragments:
+        chunk.append(fragment)
+        size += len(fragment)
+        if size >= STREAM_CHUNK_SIZE:
+            yield encode(''.join(chunk))
+            chunk = []
+            size = 0
+    if chunk:
+        yield encode(''.join(chunk))
+
 def render_page(content, title = 'OHRk', topnote = '', status = '200 OK'):
     """
-    Put the content of a dynamic page in the generic template, and return it to the WGSI server.
+    Put the content of a dynamic page (a str, or a list or generator of strs) in the
+    generic template, and return it to the WGSI server as a generator, so the start of
+    the page is sent while the rest (e.g. the rows of a table) is still being generated.
+    Any DBs should be read before calling this, so that they're noted before the
+    headers are sent (see page_validators).
     """
     reqinfo.set_header(status, [('Content-Type', 'text/html')])
-    page_template = util.read_text_file(STATIC_ROOT + 'page_template.html')
-    return [encode(page_template.format(
-        content = content, title = title, root = get_website_root(),
-        topnote = topnote, footer_info = reqinfo.get_footer()
-    ))]
+    page_template = templates.get(STATIC_ROOT + 'page_template.html')
+    info = reqinfo
+    def footer():
+        # Only generated after the rest of the page, as it includes the time taken
+        yield info.get_footer()
+    return stream(page_template.render_iter({
+        'content': content, 'title': title, 'root': get_website_root(),
+        'topnote': topnote, 'footer_info': footer()}))
 
 def templated_page(fname, title = 'OHRk', topnote = '', status = '200 OK', ignore_missing = False, **kwargs):
     """Try to render an .html link by substituting the corresponding .content.html file into
-    the global template; otherwise return None if 'ignore_missing' or raise an exception."""
+    the global template; otherwise return None if 'ignore_missing' or raise an exception.
+    The values of fields can be strs, or lists or generators of strs."""
     pagename, extn = os.path.splitext(fname)
     if ignore_missing:
-        if not (extn == '.html' and os.path.isfile(pagename + '.content.html')):
+        if not (extn == '.html' and templates.exists(pagename + '.content.html')):
             return None
-    with open(pagename + '.content.html', 'r') as temp:
-        content = temp.read().format(**kwargs)
-        return render_page(content, title = title, topnote = topnote, status = status)
+    content = templates.get(pagename + '.content.html').render_iter(kwargs)
+    return render_page(content, title = title, topnote = topnote, status = status)
 
 def notfound(message):
     return templated_page('404.html', message = message, title = 'OHRk - 404', status = '404 Not Found')
@@ -789,19 +1137,308 @@ def static_serve(path, environ, start_response):
                     'css': 'text/css',
                     'js': 'application/javascript',
         }.get(ext, 'application/octet-stream')
-        start_response('200 OK', [('Content-Type', mimetype)])
+        headers = [('Content-Type', mimetype)]
+        if staticgz.compressible(fname):
+            headers.append(('Vary', 'Accept-Encoding'))
+            # Send the prebuilt .gz instead if it's up to date
+            if accepts_encoding('gzip') and staticgz.is_fresh(fname):
+                headers.append(('Content-Encoding', 'gzip'))
+                fname = staticgz.gz_fname(fname)
+        start_response('200 OK', headers)
         return file_wrapper(open(fname, 'rb'))
 
     if os.path.isfile(fname):
         return send_file(fname)
     if os.path.isfile(fname + '/index.html'):
         return send_file(fname + '/index.html')
-    ret = templated_page(fname, ignore_missing = True)
-    if ret:
+    for pagename in (fname, fname + '/index.html'):
+        ret = templated_page(pagename, ignore_missing = True)
+        if ret:
+            return send_response(ret)
+
+################################################################################
+## Warmup
+
+# Status of warmup(): None if not started, then 'warming' or 'ready'
+warmup_state = None
+# DB name -> (seconds to load, number of items) for each DB loaded by warmup()
+warmup_times = {}
+
+def warmup_db_names():
+    "The DBs to preload: all the gamelists plus zips, but not the side DBs (see gamedb.ColdField)"
+    return list(gamedb.SOURCES) + ['zips']
+
+def warmup():
+    """Load (and cache) all the DBs and indexes that listings need, so the first requests don't have to.
+    Normally run in the background by start_warmup()."""
+    global warmup_state
+    warmup_state = 'warming'
+    timer = util.Timer().start()
+    db_layer.RequestContext(cache = False, readonly = True)
+    for name in warmup_db_names():
+        with util.Timer() as load_timer:
+            db = db_layer.load(name)
+        warmup_times[name] = (load_timer.time, len(db) if db is not None else None)
+        print("Warmup: loaded %s in %s" % (name, load_timer))
+    for name in indexes.INDEXES:
+        with util.Timer() as load_timer:
+            indexes.get(name)
+        warmup_times[name] = (load_timer.time, None)
+        print("Warmup: loaded index %s in %s" % (name, load_timer))
+    warmup_state = 'ready'
+    print("Warmup done in %s" % timer.stop())
+
+def start_warmup():
+    """Run warmup() in a background thread, while requests are served (ready/ returns
+    503 until it's done). Call after the server has started listening."""
+    global warmup_state
+    warmup_state = 'warming'
+    thread = threading.Thread(target = warmup, name = 'warmup', daemon = True)
+    thread.start()
+    return thread
+
+def render_ready(path):
+    """
+    Handles ready/ URL: a plain-text report for monitoring, with status 503 if
+    warmup() is still running, or 200 otherwise. Lists the DBs in memory.
+    """
+    status = '503 Service Unavailable' if warmup_state == 'warming' else '200 OK'
+    ret = "%s\n" % ('ready' if status == '200 OK' else 'warming up')
+    # Copy, since the DBWatcher and warmup threads may modify it
+    cache = dict(list(db_layer._cache.items()))
+    for name, cacheitem in sorted(cache.items()):
+        if name in indexes.INDEXES:
+            continue
+        db = cacheitem.db
+        line = "%-16s %8s items" % (name, len(db) if hasattr(db, '__len__') else '-')
+        if name in warmup_times:
+            line += "  loaded in %.3fs" % warmup_times[name][0]
+        ret += line + "\n"
+    for name in warmup_db_names():
+        if name not in cache:
+            ret += "%-16s %s\n" % (name, "not loaded" if name in warmup_times or not warmup_state else "pending")
+    for name in indexes.INDEXES:
+        line = "%-16s %8s" % (name, "index" if name in indexes._built else "not built")
+        if name in warmup_times:
+            line += "        loaded in %.3fs" % warmup_times[name][0]
+        ret += line + "\n"
+    reqinfo.set_header(status, [('Content-Type', 'text/plain'), ('Cache-Control', 'no-cache')])
+    return [encode(ret)]
+
+################################################################################
+
+if DB_WATCH_INTERVAL:
+    db_layer.start_watcher(DB_WATCH_INTERVAL)
+
+page_cache = pagecache.PageCache(PAGE_CACHE_SIZE) if PAGE_CACHE_SIZE else None
+
+# The dynamic pages which are cached and have ETags (not ready/, and blobs/ are
+# cached by the browser)
+CACHED_PAGES = ('gamelists', 'gallery', 'games', 'zips', 'tags', 'authors')
+
+def page_deps(path):
+    """
+    The DBs and indexes which the page at path (split into segments, path[0] in
+    CACHED_PAGES) may read, depending on the query. Used to work out whether the
+    browser's copy is still valid before rendering anything, so must include everything.
+    """
+    visible = [name for name, info in gamedb.SOURCES.items() if not info.get('hidden')]
+    deps = []
+    if 'author' in reqinfo.query:
+        deps.append('authors')
+    if 'search' in reqinfo.query:
+        # Matches are checked against the games' ColdFields, see TrigramIndex
+        searched = [path[1]] if path[0] == 'gamelists' else visible
+        deps += [gamedb.cold_dbname(name) for name in searched]
+    if path[0] == 'gamelists' and len(path) == 2:
+        deps += [path[1], 'zips']
+    elif path[0] == 'gamelists' and len(path) > 2:
+        # Game pages link to the zips the game is in and the games sharing them
+        deps += [path[1], gamedb.cold_dbname(path[1]), 'zips', 'rpgs', gamedb.cold_dbname('rpgs'),
+                 'zips.owners', 'authors']
+    elif path[0] in ('games', 'gallery'):
+        deps += visible + ['zips']
+    elif path[0] == 'zips':
+        deps += ['zips', gamedb.cold_dbname('zips'), 'zips.owners']
+    elif path[0] == 'tags':
+        deps += visible
+    elif path[0] == 'authors':
+        deps += visible + ['zips', 'authors']
+    return deps
+
+def page_generations(deps):
+    "Returns a dict of the generations of DBs, given DB and index names (see page_deps)"
+    names = []
+    for name in deps:
+        if name in indexes.INDEXES:
+            names += indexes.INDEXES[name].deps
+        else:
+            names.append(name)
+    return {name: db_layer.generation(name) for name in names}
+
+def page_cache_key(parameters):
+    "Identifies a request for the page cache"
+    # The <base> URL in the page depends on the host
+    return (get_website_root(), reqinfo.path,
+            tuple((name, tuple(values)) for name, values in sorted(parameters.items())))
+
+def code_version():
+    "The last modification time of the code and templates, which can change any page"
+    fnames = [__file__] + glob.glob(STATIC_ROOT + '*.html')
+    return max(os.path.getmtime(fname) for fname in fnames)
+
+CODE_VERSION = code_version()
+
+def page_validators(key, generations):
+    """
+    Returns the ETag, Last-Modified and Cache-Control headers for a page, given
+    its page_cache_key and the generations of the DBs it depends on (page_generations).
+    """
+    validator = repr((CODE_VERSION, key, sorted(generations.items())))
+    etag = '"%s"' % hashlib.blake2b(validator.encode('utf-8'), digest_size = 12).hexdigest()
+    # Browsers should always check whether the page changed
+    headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+    mtimes = [gen for gen in generations.values() if gen is not None] + [CODE_VERSION]
+    headers.append(('Last-Modified', email.utils.formatdate(max(mtimes), usegmt = True)))
+    return headers
+
+def not_modified(headers):
+    """
+    Whether the request is conditional (If-None-Match or If-Modified-Since) and the
+    browser's copy is still valid, given the validators from page_validators().
+    """
+    headers = dict(headers)
+    if_none_match = reqinfo.environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # Weak comparison, ignoring W/
+        etags = [etag.strip().replace('W/', '', 1) for etag in if_none_match.split(',')]
+        etags = [unencoded_etag(etag) for etag in etags]
+        return '*' in etags or headers['ETag'] in etags
+    if_modified_since = reqinfo.environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have a resolution of a second
+        return email.utils.parsedate_to_datetime(headers['Last-Modified']).timestamp() <= since
+    return False
+
+def not_modified_response(headers):
+    reqinfo.set_header('304 Not Modified', [header for header in headers
+                                            if header[0] in ('ETag', 'Last-Modified', 'Cache-Control')])
+    return []
+
+def cached_response(page, validators):
+    "Return a page from the page cache, with a new footer"
+    reqinfo.set_header(page.status, page.headers + validators)
+    return [page.before + encode(reqinfo.get_footer()) + page.after]
+
+def cacheable_response(key, ret, validators, generations):
+    """
+    Add validators to a newly rendered page (which may not have been generated yet,
+    see render_page), and add it to the page cache once it has if possible.
+    Neither if it isn't reqinfo.cacheable.
+    generations: those the validators were made from.
+    Returns the response.
+    """
+    if reqinfo.status != '200 OK' or not reqinfo.cacheable:
         return ret
-    ret = templated_page(fname + '/index.html', ignore_missing = True)
-    if ret:
+    undeclared = set(reqinfo.dbcontext.generations) - set(generations)
+    if undeclared:
+        print("Warning: %s read %s, which aren't in its page_deps" % (reqinfo.path, sorted(undeclared)))
+    headers = reqinfo.headers
+    reqinfo.headers = headers + validators
+    if page_cache is None:
         return ret
+    return cache_while_streaming(key, ret, headers)
+
+def cache_while_streaming(key, ret, headers):
+    """Generates the response ret, and afterwards adds it to the page cache if it isn't too large.
+    headers: the headers of the uncompressed page (see compress_response), without validators."""
+    info = reqinfo
+    chunks = []
+    size = 0
+    for chunk in ret:
+        yield chunk
+        if chunks is not None:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > page_cache.max_size:
+                chunks = None
+    if chunks is None or info.footer is None:
+        return
+    parts = b''.join(chunks).split(encode(info.footer))
+    if len(parts) == 2:
+        page_cache.put(key, pagecache.CachedPage(info.status, headers, parts[0], parts[1],
+                                                 info.dbcontext.generations))
+
+# zlib wbits for each Content-Encoding we can send, in order of preference
+ENCODING_WBITS = {'gzip': 31, 'deflate': 15}
+
+def accepts_encoding(encoding):
+    "Whether the browser accepts a content-coding such as 'gzip', according to its Accept-Encoding header."
+    qvalues = {}
+    for item in reqinfo.environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.partition(';')
+        params = params.strip()
+        try:
+            qvalue = float(params[2:]) if params.startswith('q=') else 1.
+        except ValueError:
+            qvalue = 0.
+        qvalues[coding.strip().lower()] = qvalue
+    return qvalues.get(encoding, qvalues.get('*', 0.)) > 0
+
+def unencoded_etag(etag):
+    "Strip the suffix compress_response adds to the ETag of a compressed page"
+    for encoding in ENCODING_WBITS:
+        suffix = '-' + encoding + '"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+def compress_stream(chunks, encoding):
+    """Generates the compressed chunks of a response. Each chunk is flushed as soon as
+    it's compressed, so that a streamed page (see render_page) is still sent in pieces."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, ENCODING_WBITS[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def compress_response(ret):
+    """
+    Compress a dynamic HTML page if the browser accepts gzip or deflate (and GZIP_LEVEL
+    isn't 0), changing reqinfo.headers accordingly. Also gives a 304 response the ETag
+    the browser has. Returns the response.
+    """
+    headers = dict(reqinfo.headers)
+    is_304 = reqinfo.status.startswith('304')
+    if not GZIP_LEVEL or not (is_304 or headers.get('Content-Type') == 'text/html'):
+        return ret
+    encoding = next((enc for enc in ENCODING_WBITS if accepts_encoding(enc)), None)
+    # Don't modify reqinfo.headers in place, it may be stored in the page cache
+    new_headers = []
+    for name, value in reqinfo.headers:
+        if name == 'ETag' and encoding:
+            # Different encodings of a page need different ETags
+            value = value[:-1] + '-' + encoding + '"'
+        elif name == 'Content-Length' and encoding:
+            continue
+        new_headers.append((name, value))
+    new_headers.append(('Vary', 'Accept-Encoding'))
+    if encoding and not is_304:
+        new_headers.append(('Content-Encoding', encoding))
+        ret = compress_stream(ret, encoding)
+    reqinfo.headers = new_headers
+    return ret
+
+def send_response(ret):
+    "Compress the response if possible, then send the headers. Returns the response."
+    ret = compress_response(ret)
+    reqinfo.send_header()
+    return ret
 
 def application(environ, start_response):
     """
@@ -833,7 +1470,31 @@ def application(environ, start_response):
     parameters = urlimp.parse_qs(environ.get('QUERY_STRING', ''), keep_blank_values = True)
     reqinfo.query = parameters
 
-    # Handle dynamic pages
+    if path[0] in CACHED_PAGES and 'random' not in parameters:
+        # Check whether the browser's copy is still valid before doing any work,
+        # then the page cache, and add ETag, etc
+        key = page_cache_key(parameters)
+        generations = page_generations(page_deps(path))
+        validators = page_validators(key, generations)
+        page = None
+        if not_modified(validators):
+            ret = not_modified_response(validators)
+        else:
+            if page_cache is not None:
+                page = page_cache.get(key)
+                reqinfo.cache_status = 'hit' if page else 'miss'
+            if page:
+                ret = cached_response(page, validators)
+            else:
+                ret = cacheable_response(key, handle_dynamic(path), validators, generations)
+    else:
+        ret = handle_dynamic(path)
+    return send_response(ret)
+
+def handle_dynamic(path):
+    """
+    Generate a dynamic page, given the path split into segments.
+    """
     if path[0] == "gamelists":
         return handle_gamelists(path)
     elif path[0] == "gallery":
@@ -844,5 +1505,11 @@ def application(environ, start_response):
         return handle_zips(path)
     elif path[0] == "tags":
         return render_tags(path)
+    elif path[0] == "authors":
+        return handle_authors(path)
+    elif path[0] == "ready":
+        return render_ready(path)
+    elif path[0] == "blobs":
+        return serve_blob(path)
     else:
         return notfound(reqinfo.path + " not found")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# So that the ohrk package can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,47 @@
+from ohrk import changefeed, db_layer, gamedb
+
+
+def make_game(name):
+    game = gamedb.Game()
+    game.name = name
+    return game
+
+def test_diff_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_layer, 'DB_DIR', str(tmp_path))
+    monkeypatch.setattr(db_layer, '_cache', {})
+    games = {key: make_game(key) for key in ('c', 'a', 'd', 'b')}
+    changes = changefeed.diff('ss', games)
+    db_layer.save('ss', games)
+    changefeed.commit(changes)
+    assert changes.keys() == ['c', 'a', 'd', 'b']
+
+    # Items in dict order, then the removed ones in their old order
+    games = {'e': make_game('e'), 'b': make_game('B'), 'a': games['a']}
+    changes = changefeed.diff('ss', games)
+    assert changes.added == ['e']
+    assert changes.modified == {'b': ['name']}
+    assert changes.removed == ['c', 'd']
+    assert changes.keys() == ['e', 'b', 'c', 'd']
+
+def test_diff_after_save(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_layer, 'DB_DIR', str(tmp_path))
+    monkeypatch.setattr(db_layer, '_cache', {})
+    games = {'1': make_game('one'), '2': make_game('two')}
+    changes = changefeed.diff('ss', games)
+    assert not changes.reset and changes.added == ['1', '2']
+    db_layer.save('ss', games)
+    changefeed.commit(changes)
+    assert not changefeed.diff('ss', games)
+
+    # Only comparing some keys
+    games['1'].description = "New"
+    changes = changefeed.diff('ss', games, ['2'])
+    assert not changes
+    changes = changefeed.diff('ss', games, ['1'])
+    assert changes.modified == {'1': ['description']}
+
+    # Saved without committing the changes, so it's out of date
+    db_layer.save('ss', games)
+    changes = changefeed.diff('ss', games)
+    assert changes.reset
+    assert changes.added == ['1', '2']
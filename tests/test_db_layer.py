@@ -0,0 +1,85 @@
+import pytest
+
+from ohrk import db_layer, gamedb, ohrkpaths
+
+
+# (backend, compression, journal, snapshots)
+CONFIGS = [
+    ('pickle', None, False, False),
+    ('pickle', 'zlib', False, False),
+    ('pickle', 'lzma', False, False),
+    ('pickle', None, True, False),
+    ('pickle', 'zlib', True, True),
+    ('sqlite', None, False, False),
+    ('sqlite', None, False, True),
+]
+
+@pytest.fixture(params = CONFIGS, ids = lambda config: '-'.join(str(part) for part in config))
+def config(request, tmp_path, monkeypatch):
+    backend, compression, journal, snapshots = request.param
+    monkeypatch.setattr(db_layer, 'DB_DIR', str(tmp_path))
+    monkeypatch.setattr(db_layer, '_cache', {})
+    # New instances, which don't have connections or state from other tests
+    monkeypatch.setitem(db_layer.BACKENDS, 'pickle', db_layer.PickleBackend())
+    monkeypatch.setitem(db_layer.BACKENDS, 'sqlite', db_layer.SQLiteBackend())
+    monkeypatch.setattr(ohrkpaths, 'DB_BACKEND', backend)
+    monkeypatch.setattr(ohrkpaths, 'DB_COMPRESSION', compression)
+    monkeypatch.setattr(ohrkpaths, 'DB_JOURNAL', journal)
+    monkeypatch.setattr(ohrkpaths, 'DB_SNAPSHOTS', snapshots)
+    db_layer.RequestContext(cache = False)
+    return request.param
+
+def make_game(name, author = ""):
+    game = gamedb.Game()
+    game.name = name
+    game.author = author
+    game.tags = ['rpg']
+    game.downloads = [gamedb.DownloadLink('ss', name, 'http://example.com/%s.zip' % name)]
+    return game
+
+def summary(db):
+    "Comparable contents of a DB of Games"
+    return [(key, game.name, game.author, game.tags, [link.zipname for link in game.downloads])
+            for key, game in db.items()]
+
+def reload(name, readonly = False):
+    "Load a DB from disk rather than the cache"
+    db_layer._cache.clear()
+    db_layer.RequestContext(cache = False, readonly = readonly)
+    return db_layer.load(name)
+
+def test_save_load(config):
+    games = {'b': make_game("Bee", "Someone"), 'a': make_game("Ay")}
+    db_layer.save('ss', games)
+    assert db_layer.exists('ss')
+    assert summary(reload('ss')) == summary(games)
+    snapshot = reload('ss', readonly = True)
+    assert isinstance(snapshot, db_layer.SnapshotDB) == ohrkpaths.DB_SNAPSHOTS
+    assert summary(snapshot) == summary(games)
+    # Not a dict with str keys
+    db_layer.save('misc', [1, (2, 3)])
+    assert reload('misc') == [1, (2, 3)]
+    assert reload('missing') is None
+
+def test_save_items(config):
+    games = {'b': make_game("Bee"), 'a': make_game("Ay"), 'c': make_game("Sea")}
+    db_layer.save('ss', games)
+    gen = db_layer.generation('ss')
+    db_layer._cache.clear()
+    db_layer.save_items('ss', {'a': make_game("Ay 2"), 'd': make_game("Dee")}, ['c'])
+    assert db_layer.generation('ss') != gen
+    expected = {'b': games['b'], 'a': make_game("Ay 2"), 'd': make_game("Dee")}
+    assert summary(reload('ss')) == summary(expected)
+    assert summary(reload('ss', readonly = True)) == summary(expected)
+    db_layer._cache.clear()
+    assert db_layer.load_item('ss', 'd').name == "Dee"
+    assert db_layer.load_item('ss', 'c') is None
+    # Folds the journal (if any) back in
+    db_layer.compact('ss')
+    assert summary(reload('ss')) == summary(expected)
+
+def test_find_keys(config):
+    db_layer.save('ss', {'1': make_game("One", "Mogri"), '2': make_game("Two", "TMC")})
+    db_layer._cache.clear()
+    assert db_layer.find_keys('ss', author = 'mogri') == ['1']
+    assert db_layer.find_keys('ss', name = 'two', author = 'tmc') == ['2']
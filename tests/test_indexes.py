@@ -0,0 +1,89 @@
+from ohrk import gamedb, indexes
+
+
+def make_game(name, downloads = (), archives = ()):
+    game = gamedb.Game()
+    game.name = name
+    game.downloads = list(downloads)
+    game.archives = archives
+    return game
+
+def test_zip_index_game_without_archives():
+    # Games saved before Game.archives existed get the default, None
+    old = make_game("Old game", archives = None)
+    new = make_game("New game", downloads = [gamedb.DownloadLink('ss', 'new', 'http://example.com/new.zip')])
+    rpg = make_game("An rpg", archives = ['ss:new'])
+    index = indexes.ZipIndex(['ss', 'rpgs'], [{'1': old, '2': new}, {'h1': rpg}, {}])
+    assert index.owner('ss:new') == ('ss', '2')
+    assert index.sharing('ss:new') == [(('ss', '2'), 'ss:new'), (('rpgs', 'h1'), 'ss:new')]
+    assert index.archives == {'ss:new': [('rpgs', 'h1')]}
+    assert index.names == {('ss', '2'): "New game", ('rpgs', 'h1'): "An rpg"}
+
+def test_invalidate_defers_rebuild(tmp_path, monkeypatch):
+    from ohrk import db_layer
+    monkeypatch.setattr(db_layer, 'DB_DIR', str(tmp_path))
+    builds = []
+    def build(db):
+        builds.append(dict(db))
+        return sorted(db)
+    monkeypatch.setitem(indexes.INDEXES, 'testdb.keys', indexes.Index('testdb.keys', ['testdb'], build))
+    try:
+        db_layer.save('testdb', {'a': 1})
+        indexes.refresh('testdb')
+        assert len(builds) == 1
+        db_layer.save_items('testdb', {'b': 2})
+        indexes.invalidate('testdb')
+        assert len(builds) == 1
+        # Rebuilt in memory when needed, and saved (without building again) by rebuild_stale
+        assert indexes.get('testdb.keys') == ['a', 'b']
+        indexes.rebuild_stale()
+        assert len(builds) == 2
+        assert db_layer.load('testdb.keys', derived = True).data == ['a', 'b']
+    finally:
+        indexes._built.pop('testdb.keys', None)
+        db_layer._cache.clear()
+
+def test_refresh_defers_cross_db_indexes(tmp_path, monkeypatch):
+    from ohrk import db_layer
+    monkeypatch.setattr(db_layer, 'DB_DIR', str(tmp_path))
+    builds = []
+    def build(*dbs):
+        builds.append(len(dbs))
+        return [sorted(db or ()) for db in dbs]
+    monkeypatch.setitem(indexes.INDEXES, 'testdb.keys', indexes.Index('testdb.keys', ['testdb'], build))
+    monkeypatch.setitem(indexes.INDEXES, 'both.keys', indexes.Index('both.keys', ['testdb', 'testdb2'], build,
+                                                                    optional_deps = True))
+    try:
+        db_layer.save('testdb', {'a': 1})
+        indexes.refresh('testdb')
+        db_layer.save('testdb2', {'b': 2})
+        indexes.refresh('testdb2')
+        # Only the index of just testdb was built so far
+        assert builds == [1]
+        assert not db_layer.exists('both.keys')
+        indexes.rebuild_stale()
+        assert builds == [1, 2]
+        assert db_layer.load('both.keys', derived = True).data == [['a'], ['b']]
+    finally:
+        indexes._built.pop('testdb.keys', None)
+        indexes._built.pop('both.keys', None)
+        db_layer._cache.clear()
+
+def test_trigram_index_search():
+    games = {'1': make_game("Dragon quest"), '2': make_game("Drago is gone"), '3': make_game("Ox")}
+    games['3'].tags = ['RPG']
+    index = indexes.TrigramIndex.from_games(games)
+    assert not hasattr(index, 'texts')
+    loaded = []
+    def load_game(srcid):
+        loaded.append(srcid)
+        return games[srcid]
+    # Up to 3 characters, answered by the trigrams alone
+    assert index.search(['ox', 'rpg'], load_game) == ['3']
+    assert index.search(['DRA'], load_game) == ['1', '2']
+    assert loaded == []
+    # Longer terms are checked against just the candidates
+    assert index.search(['dragon'], load_game) == ['1']
+    assert loaded == ['1', '2']
+    merged = indexes.TrigramIndex.merge([('ss', index), ('cp', index)])
+    assert merged.search(['quest'], lambda key: games[key[1]]) == [('ss', '1'), ('cp', '1')]
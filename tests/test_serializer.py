@@ -0,0 +1,66 @@
+import io
+import pickle
+
+import numpy as np
+
+from ohrk import gamedb, serializer
+
+
+class Thing(gamedb.Slotted):
+    __slots__ = ('name', 'size')
+    _version = 2
+    # Version 1 had 'length' rather than 'size'
+    _migrations = {1: lambda state: dict(state, size = state.pop('length', 0))}
+
+
+def make_game():
+    game = gamedb.Game()
+    game.name = "A game"
+    game.author = "Someone"
+    game.description = "<b>Bold</b>"
+    game.tags = ['rpg', 'demo']
+    game.downloads = [gamedb.DownloadLink('ss', 'ss:1', 'http://example.com/1.zip', "game.zip")]
+    game.screenshots = [gamedb.Screenshot('http://example.com/1.png', 'data/1.png', "Title screen")]
+    return game
+
+def test_game_round_trip():
+    games = {'1': make_game(), '2': gamedb.Game()}
+    loaded = serializer.loads(serializer.dumps(games))
+    assert list(loaded) == ['1', '2']
+    game = loaded['1']
+    assert (game.name, game.author, game.description, game.tags) == ("A game", "Someone", "<b>Bold</b>", ['rpg', 'demo'])
+    assert game.downloads[0].__getstate__() == games['1'].downloads[0].__getstate__()
+    assert game.screenshots[0].__getstate__() == games['1'].screenshots[0].__getstate__()
+    assert loaded['2'].__getstate__() == games['2'].__getstate__()
+
+def test_arrays_out_of_band():
+    data = {'a': np.arange(10, dtype = np.int32), 'b': np.ones((3, 5), np.uint8)}
+    loaded = serializer.loads(bytearray(serializer.dumps(data)))
+    for key in data:
+        assert loaded[key].dtype == data[key].dtype
+        assert np.array_equal(loaded[key], data[key])
+    loaded['a'][0] = 5  # Writable, from a bytearray
+
+def test_stream_and_plain_pickle():
+    stream = io.BytesIO()
+    serializer.dump([1, 2], stream)
+    serializer.dump({'x': np.zeros(3)}, stream)
+    stream.seek(0)
+    assert serializer.load(stream) == [1, 2]
+    assert list(serializer.load(stream)['x']) == [0, 0, 0]
+    # Old DBs are plain pickles
+    assert serializer.loads(pickle.dumps({'old': 1}, 2)) == {'old': 1}
+
+class OldThing:
+    "Saved like version 1 of Thing"
+    def __reduce__(self):
+        return serializer._restore, (serializer._Schema(Thing, 1, ('name', 'length')), ("y", 7))
+
+def test_migration():
+    thing = Thing()
+    thing.name = "x"
+    thing.size = 3
+    assert serializer.loads(serializer.dumps(thing)).size == 3
+    loaded = serializer.loads(serializer.dumps(OldThing()))
+    assert type(loaded) is Thing
+    assert (loaded.name, loaded.size) == ("y", 7)
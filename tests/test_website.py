@@ -0,0 +1,94 @@
+import os
+import threading
+
+from ohrk import db_layer, website
+
+# The web server runs in web/, which STATIC_ROOT is relative to
+WEB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'web')
+
+
+def get(path, headers = None, with_headers = False):
+    environ = {'PATH_INFO': path, 'QUERY_STRING': '', 'wsgi.url_scheme': 'http',
+               'HTTP_HOST': 'localhost', 'wsgi.file_wrapper': lambda file: [file.read()]}
+    environ.update(headers or {})
+    response = {}
+    def start_response(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+    body = b''.join(website.application(environ, start_response))
+    if with_headers:
+        return response['status'], response['headers'], body.decode('utf-8')
+    return response['status'], body.decode('utf-8')
+
+def test_ready_while_warming_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_layer, 'DB_DIR', str(tmp_path))
+    monkeypatch.setattr(website, 'warmup_state', None)
+    # Hold up the warmup thread until the server has answered
+    proceed = threading.Event()
+    def warmup_db_names():
+        # (Also called by render_ready)
+        if threading.current_thread().name == 'warmup':
+            proceed.wait(10)
+        return []
+    monkeypatch.setattr(website, 'warmup_db_names', warmup_db_names)
+
+    assert get('/ark/ready')[0] == '200 OK'
+    thread = website.start_warmup()
+    status, body = get('/ark/ready')
+    assert status == '503 Service Unavailable'
+    assert body.startswith('warming up')
+    proceed.set()
+    thread.join(10)
+    status, body = get('/ark/ready')
+    assert status == '200 OK'
+    assert body.startswith('ready')
+
+def test_not_modified_skips_handler(tmp_path, monkeypatch):
+    monkeypatch.chdir(WEB_DIR)
+    monkeypatch.setattr(db_layer, 'DB_DIR', str(tmp_path))
+    monkeypatch.setattr(website, 'page_cache', None)
+    calls = []
+    def handle_dynamic(path):
+        calls.append(path)
+        return website.render_page("Tags")
+    monkeypatch.setattr(website, 'handle_dynamic', handle_dynamic)
+
+    status, headers, body = get('/ark/tags', with_headers = True)
+    assert status == '200 OK' and len(calls) == 1
+    etag = headers['ETag']
+    status, headers, body = get('/ark/tags', {'HTTP_IF_NONE_MATCH': etag}, with_headers = True)
+    assert status == '304 Not Modified'
+    assert headers['ETag'] == etag
+    assert body == ''
+    assert len(calls) == 1
+
+    # Modifying a DB the page depends on invalidates it
+    db_layer.save('ss', {})
+    status, headers, body = get('/ark/tags', {'HTTP_IF_NONE_MATCH': etag}, with_headers = True)
+    assert status == '200 OK' and len(calls) == 2
+    assert headers['ETag'] != etag
+
+def test_game_page_doesnt_build_author_index(tmp_path, monkeypatch):
+    from ohrk import gamedb, indexes
+    monkeypatch.chdir(WEB_DIR)
+    monkeypatch.setattr(db_layer, 'DB_DIR', str(tmp_path))
+    monkeypatch.setattr(website, 'page_cache', None)
+    # Forget DBs and indexes from other tests
+    monkeypatch.setattr(db_layer, '_cache', {})
+    monkeypatch.setattr(indexes, '_built', {})
+    game = gamedb.Game()
+    game.name = "A game"
+    game.author = "Someone"
+    # Saved without indexes.refresh(), so there's no AuthorIndex
+    db_layer.save('cp', {'1': game})
+    status, body = get('/ark/gamelists/cp/1/')
+    assert status == '200 OK'
+    assert 'Someone' in body and 'all their games' not in body
+    assert 'authors' not in indexes._built
+    assert get('/ark/authors')[0] == '503 Service Unavailable'
+
+    indexes.refresh('cp')
+    indexes.rebuild_stale()
+    status, body = get('/ark/gamelists/cp/1/')
+    assert 'all their games' in body
+    assert get('/ark/authors/someone')[0] == '200 OK'
@@ -10,9 +10,14 @@ sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/..'))
 from wsgiref.simple_server import make_server
 
 import ohrk.website
+from ohrk.ohrkpaths import WARMUP
 
 httpd = make_server('', 8080, ohrk.website.application)
 print("Serving HTTP on port 8080...")
 
+# Loads the DBs in the background; ready/ returns 503 until it's done
+if WARMUP or '--warmup' in sys.argv:
+    ohrk.website.start_warmup()
+
 # Respond to requests until process is killed
 httpd.serve_forever()